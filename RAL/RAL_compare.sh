@@ -195,11 +195,13 @@ for attempt in $attempts; do
 	    rm -f ${site_dump_tmp}
     	t1=`date +%s`
         
-        $python cmp3/json_file.py ${stats} set scanner.scanner.attempt $attempt
-        $python cmp3/json_file.py ${stats} set scanner.scanner.status -t failed
-        $python cmp3/json_file.py ${stats} set scanner.scanner.last_attempt_time_utc -t "$attempt_time"
-        $python cmp3/json_file.py ${stats} set scanner.scanner.status_code $xrdcp_status
-        $python cmp3/json_file.py ${stats} set scanner.scanner.stderr -t - < $stderr
+        $python cmp3/stats_log.py batch ${stats} << _EOF_
+set scanner.scanner.attempt $attempt
+set -t scanner.scanner.status failed
+set -t scanner.scanner.last_attempt_time_utc $attempt_time
+set scanner.scanner.status_code $xrdcp_status
+set -f scanner.scanner.stderr $stderr
+_EOF_
 	
         echo download failed:
         cat $stderr
@@ -216,12 +218,14 @@ for attempt in $attempts; do
     	t1=`date +%s`
         downloaded="yes"
 
-        $python cmp3/json_file.py ${stats} set scanner.scanner.attempt $attempt
-        $python cmp3/json_file.py ${stats} set scanner.scanner.status -t "done"
-        $python cmp3/json_file.py ${stats} set scanner.scanner.last_attempt_time_utc -t "$attempt_time"
-        $python cmp3/json_file.py ${stats} set scanner.scanner.status_code $xrdcp_status
-        $python cmp3/json_file.py ${stats} set scanner.scanner.stderr -t ""
-        $python cmp3/json_file.py ${stats} set scanner.total_files $n
+        $python cmp3/stats_log.py batch ${stats} << _EOF_
+set scanner.scanner.attempt $attempt
+set -t scanner.scanner.status done
+set -t scanner.scanner.last_attempt_time_utc $attempt_time
+set scanner.scanner.status_code $xrdcp_status
+set -t scanner.scanner.stderr
+set scanner.total_files $n
+_EOF_
         
         
         # unmerged files list and stats
@@ -235,7 +239,7 @@ for attempt in $attempts; do
             echo $n files in the partitioned list
 
             if [ "$um_stats" != "" ]; then
-                $python cmp3/json_file.py $um_stats set scanner.files $n
+                $python cmp3/stats_log.py set $um_stats scanner.files $n
             fi   
             rm -f $filtered_unmerged_list
         fi
@@ -246,20 +250,24 @@ done
 rm -f $site_dump_tmp
 
 if [ "$downloaded" == "yes" ]; then
-    $python cmp3/json_file.py ${stats} set scanner.status -t "done"
-    $python cmp3/json_file.py ${stats} set scanner.end_time $t1
-    if [ "$um_stats" != "" ]; then
-        $python cmp3/json_file.py $um_stats set scanner.status -t "done"
-        $python cmp3/json_file.py $um_stats set scanner.end_time $t1
-    fi
+    scanner_status="done"
 else
-    $python cmp3/json_file.py ${stats} set scanner.status -t "failed"
-    $python cmp3/json_file.py ${stats} set scanner.end_time $t1
+    scanner_status="failed"
+fi
 
-    if [ "$um_stats" != "" ]; then
-        $python cmp3/json_file.py $um_stats set scanner.status -t "failed"
-        $python cmp3/json_file.py $um_stats set scanner.end_time $t1
-    fi
+# -c: fold the scanner events into the stats file before other tools update it
+$python cmp3/stats_log.py batch -c ${stats} << _EOF_
+set -t scanner.status $scanner_status
+set scanner.end_time $t1
+_EOF_
+if [ "$um_stats" != "" ]; then
+    $python cmp3/stats_log.py batch -c $um_stats << _EOF_
+set -t scanner.status $scanner_status
+set scanner.end_time $t1
+_EOF_
+fi
+
+if [ "$downloaded" != "yes" ]; then
     exit 1
 fi
 
@@ -287,8 +295,16 @@ rce_cmp5 -s ${stats} \
 echo Dark list:    `wc -l ${d_out}`
 echo Missing list: `wc -l ${m_out}`
 
+# Add the compared run to the run catalog, if the out dir has one, so that the following steps see it complete
+if [ -f ${out}/catalog.sqlite ]; then
+    $python cmp3/catalog.py sync $out
+fi
+
 # Calculate diffs with previous run
-$python cmp3/diffs.py -u -s ${stats} $out $RSE $run
+$python cmp3/diffs.py -u -l -s ${stats} $out $RSE $run
+
+# Per-directory counts of dark and missing files
+$python cmp3/rollup.py -u -s ${stats} $out $RSE $run
 
 #
 # 5. Declare missing and dark replicas
@@ -303,4 +319,9 @@ d_action_list=${out}/${RSE}_${run}_D_action.list
 $python actions/declare_missing.py -a root -o ${m_action_list} -c ${config} -s $stats $out $scope $RSE 2> $missing_action_errors
 $python actions/declare_dark.py    -a root -o ${d_action_list} -c ${config} -s $stats $out        $RSE 2> $dark_action_errors
 
+# Update the run catalog with the final stats
+if [ -f ${out}/catalog.sqlite ]; then
+    $python cmp3/catalog.py sync $out
+fi
+
 
@@ -1,9 +1,11 @@
 import sys, os, getopt, time
 from datetime import datetime, timedelta
 
-from rucio_consistency import Stats
+from stats import Stats
 
-from run import CCRun
+from run import RunHistory
+from sort_merge import external_sort, multi_intersect
+from age_index import AgeIndex
 from config import ActionConfiguration
 
 Version = "1.2"
@@ -16,6 +18,9 @@ python declare_dark.py [options] <storage_path> <rse>
     -s <stats file>             - file to write stats to
     -S <stats key>              - key to store stats under, default: "dark_action"
     -c <config.yaml>|rucio      - load configuration from a YAML file or Rucio
+    -t <tmp dir>                - directory for temporary files used to sort the dark lists
+    -A                          - use the persistent dark age index in <storage_path> instead of reading
+                                  all dark lists in the confirmation window. The index is updated with new runs first.
     -v                          - verbose output
 
     The following will override values read from the configuration:
@@ -31,13 +36,37 @@ def chunked(lst, chunk_size=1000):
     for i in range(0, len(lst), chunk_size):
         yield lst[i:i+chunk_size]
 
-def dark_action(storage_dir, rse, out, stats, stats_key, account, dry_run, my_stats):
+def confirm_dark(runs, tmp_dir=None):
+    #
+    # streams the dark lists of all the runs through one merge pass
+    # returns sorted list of files found dark in all the runs and {run -> number of candidates from the first run dropped at this run}
+    #
+    dropped = [0] * len(runs)
+    confirmed = list(multi_intersect([external_sort(run.dark_files(), tmp_dir) for run in runs], dropped))
+    return confirmed, {run.Run: n for run, n in zip(runs[1:], dropped[1:])}
+
+def confirm_dark_indexed(storage_path, rse, runs, first_run, tmp_dir=None):
+    #
+    # brings the age index up to date with the runs and returns sorted list of files
+    # found dark in all the runs since first_run, and index stats
+    #
+    index = AgeIndex(storage_path, rse, "D", tmp_dir)
+    added = index.update_from_runs(runs)
+    confirmed = list(index.confirmed(first_run.Run))
+    return confirmed, {
+        "file":         os.path.basename(index.file_path()),
+        "last_run":     index.LastRun,
+        "rebuilt":      index.Rebuilt,
+        "runs_added":   added
+    }
+
+def dark_action(storage_dir, rse, out, stats, stats_key, account, dry_run, my_stats, tmp_dir=None, use_age_index=False):
 
     my_stats["start_time"] = t0 = time.time()
     if stats is not None:
         stats.update_section(stats_key, my_stats)
 
-    runs = CCRun.runs_for_rse(storage_path, rse)
+    runs = RunHistory.get(storage_path, rse).runs(complete_only=True)
     now = datetime.now()
     recent_runs = sorted(
             [r for r in runs if r.Timestamp >= now - timedelta(days=window)],
@@ -80,9 +109,10 @@ def dark_action(storage_dir, rse, out, stats, stats_key, account, dry_run, my_st
             aborted_reason = "oldest run is not old enough: %s, required: > %d days old" % (first_run.Timestamp, min_age_first)
 
         else:
-            confirmed = set(recent_runs[0].dark_files())
-            for run in recent_runs[1:]:
-                confirmed &= set(run.dark_files())
+            if use_age_index:
+                confirmed, my_stats["age_index"] = confirm_dark_indexed(storage_path, rse, runs, first_run, tmp_dir)
+            else:
+                confirmed, my_stats["dropped_per_run"] = confirm_dark(recent_runs, tmp_dir)
 
             confirmed_dark_count = len(confirmed)
             print("Confirmed dark files:", confirmed_dark_count, file=sys.stderr)
@@ -93,7 +123,7 @@ def dark_action(storage_dir, rse, out, stats, stats_key, account, dry_run, my_st
 
                 if confirmed:
                     if out is not None:
-                        for f in sorted(confirmed):
+                        for f in confirmed:
                             print(f, file=out)
                         if out is not sys.stdout:
                             out.close()                 
@@ -130,7 +160,7 @@ if not sys.argv[1:] or sys.argv[1] == "help":
     print(Usage)
     sys.exit(2)
 
-opts, args = getopt.getopt(sys.argv[1:], "h?o:M:m:w:n:f:s:S:c:va:d")
+opts, args = getopt.getopt(sys.argv[1:], "h?o:M:m:w:n:f:s:S:c:va:dt:A")
 opts = dict(opts)
 
 if not args or "-h" in opts or "-?" in opts:
@@ -160,6 +190,8 @@ fraction = float(opts.get("-f", config.get("max_fraction", 0.01)))
 min_runs = int(opts.get("-n", config.get("min_runs", 3)))
 account = opts.get("-a")
 dry_run = "-d" in opts
+tmp_dir = opts.get("-t")
+use_age_index = "-A" in opts
 
 if dry_run:
     print("====== dry run mode ======")
@@ -181,6 +213,7 @@ if "-v" in opts:
     print("  max age for first run:       ", max_age_last)
     print("  min number of runs:          ", min_runs)
     print("  max dark files fraction:     ", fraction)
+    print("  use age index:               ", use_age_index)
     print()
 
 my_stats = {
@@ -198,6 +231,8 @@ my_stats = {
     "aborted_reason": None,
     "error": None,
     "runs_compared": None,
+    "dropped_per_run": None,
+    "age_index": None,
     "configuration": {
         "confirmation_window": window,
         "min_age_first_run": min_age_first,
@@ -210,7 +245,7 @@ my_stats = {
 if stats is not None:
     stats.update_section(stats_key, my_stats)
 
-run_stats = dark_action(storage_path, rse, out, stats, stats_key, account, dry_run, my_stats)
+run_stats = dark_action(storage_path, rse, out, stats, stats_key, account, dry_run, my_stats, tmp_dir, use_age_index)
 status = run_stats["status"]
 error = run_stats.get("error")
 aborted_reason = run_stats.get("aborted_reason")
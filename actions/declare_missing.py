@@ -1,10 +1,11 @@
 import sys, os, getopt, time, json
 from datetime import datetime, timedelta
 
-from rucio_consistency import Stats
+from stats import Stats
 
-from run import CCRun
+from run import RunHistory
 from config import ActionConfiguration
+from rucio_pipeline import DeclarationPipeline
 
 from rucio.client.replicaclient import ReplicaClient
 
@@ -25,19 +26,11 @@ python declare_missing.py [options] <storage_path> <scope> <rse>
     -f <ratio>                  - max allowed fraction of missing files to total number of files found by the scanner,
                                   floating point, default = 0.05
     -m <days>                   - max age for the most recent run, integer, default = 1 day
+    -j <workers>                - number of concurrent Rucio requests, default = 5
+    -r <requests/second>        - max Rucio request rate, floating point, default = no limit
+    -R <retries>                - number of retries for a failed Rucio request, default = 3
 """
 
-def chunked(lst, chunk_size=1000):
-    for i in range(0, len(lst), chunk_size):
-        yield lst[i:i+chunk_size]
-
-def isReplicaLost(states, rse):
-    """
-    Checks is the replica is AVAILABLE at any other rse apart from the one where it's missing. 
-    """
-    available_at_other_rses = {key:value for key,value in states.items() if value=='AVAILABLE' and key != rse}
-    return len(available_at_other_rses)<1
-
 def missing_action(storage_dir, rse, scope, max_age_last, out, stats, stats_key, account, dry_run):
     t0 = time.time()
     my_stats = {
@@ -55,9 +48,13 @@ def missing_action(storage_dir, rse, scope, max_age_last, out, stats, stats_key,
         "aborted_reason": None,
         "error": None,
         "declaration_errors": {},
+        "declaration_pipeline": None,
         "configuration": {
             "max_age_last_run": age_last,
-            "max_fraction": fraction
+            "max_fraction": fraction,
+            "max_workers": max_workers,
+            "max_request_rate": max_rate,
+            "retries": retries
         }
     }
 
@@ -65,7 +62,7 @@ def missing_action(storage_dir, rse, scope, max_age_last, out, stats, stats_key,
         stats.update_section(stats_key, my_stats)
 
     now = datetime.now()
-    latest_run = list(CCRun.runs_for_rse(storage_path, rse))[-1]
+    latest_run = RunHistory.get(storage_path, rse).last(complete_only=True)
 
     status = "started"
     aborted_reason = None
@@ -111,62 +108,57 @@ def missing_action(storage_dir, rse, scope, max_age_last, out, stats, stats_key,
                 aborted_reason = "too many missing files: %d (%.2f%% > %.2f%%)" % (missing_count, ratio*100.0, fraction*100.0)
                 print("Missing ratio is too high (above %.2f%%) -- aborting action" % (fraction*100.0,))
 
-            missing_list = [{"scope":scope, "rse":rse, "name":f} for f in latest_run.missing_files()]
-            lost_files = []
-
-            client = ReplicaClient(account=account)
-            for chunk in chunked(missing_list):
-                replicas = list(client.list_replicas(dids=[{'scope':element['scope'],'name':element['name']} for element in chunk]))
-                lost_replicas = [replica['name'] for replica in replicas if isReplicaLost(replica['states'],rse=rse)]
-                lost_files.extend(lost_replicas)
-
         if abort:
             status = "aborted"
         elif missing_count > 0:
-            if out is not None:
-                for f in latest_run.missing_files():
+            missing_list = []
+            for f in latest_run.missing_files():
+                missing_list.append({"scope":scope, "rse":rse, "name":f})
+                if out is not None:
                     print(f, file=out)
-                if out is not sys.stdout:
-                    out.close()                 
-            if not dry_run:
-                missing_list = [{"scope":scope, "rse":rse, "name":f} for f in latest_run.missing_files()]
-                lost_files = []
-
-                try:
-                    client = ReplicaClient(account=account)
-                    not_declared = []
-                    # chunk the list to avoid "request too large" errors
-                    for chunk in chunked(missing_list):
-                        # generates list of replicas across all rses for each chunk
-                        replicas = list(client.list_replicas(dids=[{'scope':element['scope'],'name':element['name']} for element in chunk]))
-                        result = client.declare_bad_file_replicas(chunk, "detected missing by CE", force=True)
-                        not_declared += result.pop(rse, [])      # there should be no other RSE in there
-                        assert not result, "Other RSEs in the not_declared dictionary: "  + ",".join(result.keys())
-                except Exception as e:
+            if out is not None and out is not sys.stdout:
+                out.close()
+
+            # look up the replicas once and, unless dry run, declare them, chunk by chunk, concurrently
+            # chunks are limited in size to avoid "request too large" errors
+            try:
+                client = ReplicaClient(account=account)
+                pipeline = DeclarationPipeline(client, rse, declare=not dry_run,
+                    max_workers=max_workers, rate=max_rate, retries=retries, verbose=verbose)
+                pipeline.run(missing_list)
+            except Exception as e:
+                status = "failed"
+                error = f"Rucio declaration error: {e}"
+            else:
+                my_stats["declaration_pipeline"] = pipeline.stats()
+                if pipeline.Failed:
                     status = "failed"
-                    error = f"Rucio declaration error: {e}"
-                else:
-                    not_declared_count = len(not_declared)
+                    chunk_index, chunk_error = pipeline.Failed[0]
+                    error = f"Rucio declaration error: {len(pipeline.Failed)} chunks failed, first error: {chunk_error}"
+                if not dry_run:
+                    not_declared_count = len(pipeline.NotDeclared)
                     if not_declared_count:
                         print("Replicas failed to declare:", not_declared_count)
                     declaration_errors = {}
-                    for item in not_declared:
+                    for item in pipeline.NotDeclared:
                         words = item.split(None, 1)
                         if len(words) == 2:
-                            declaration_errors[error] = declaration_errors.get(words[1], 0) + 1
+                            declaration_errors[words[1]] = declaration_errors.get(words[1], 0) + 1
                     my_stats["declaration_errors"] = declaration_errors
-                    my_stats["declared_missing_files"] = len(missing_list) - not_declared_count
-
-                try:
-                    my_stats["permanently_lost_files"] = len(lost_files)
-                    if outLost is not None:
-                        lost_files_to_write = '\n'.join(str(item) for item in lost_files)
-                        outLost.write(lost_files_to_write)
-                        if outLost is not sys.stdout:
-                            outLost.close()
-                except Exception as e:
-                    status = "failed"
-                    error = f"Rucio lost file exporting error: {e}"
+                    my_stats["declared_missing_files"] = pipeline.DeclaredCount
+
+                    # as before, the lost files are reported only after the replicas were actually declared
+                    lost_files = pipeline.LostFiles
+                    try:
+                        my_stats["permanently_lost_files"] = len(lost_files)
+                        if outLost is not None:
+                            lost_files_to_write = '\n'.join(str(item) for item in lost_files)
+                            outLost.write(lost_files_to_write)
+                            if outLost is not sys.stdout:
+                                outLost.close()
+                    except Exception as e:
+                        status = "failed"
+                        error = f"Rucio lost file exporting error: {e}"
 
 
     t1 = time.time()
@@ -187,7 +179,7 @@ if not sys.argv[1:] or sys.argv[1] == "help":
     print(Usage)
     sys.exit(2)
 
-opts, args = getopt.getopt(sys.argv[1:], "h?o:L:m:f:s:S:c:vda:")
+opts, args = getopt.getopt(sys.argv[1:], "h?o:L:m:f:s:S:c:vda:j:r:R:")
 opts = dict(opts)
 
 if not args or "-h" in opts or "-?" in opts:
@@ -218,6 +210,11 @@ age_last = int(opts.get("-m", config.get("max_age_last_run", 1)))
 fraction = float(opts.get("-f", config.get("max_fraction", 0.01)))
 account = opts.get("-a")
 dry_run = "-d" in opts
+verbose = "-v" in opts
+max_workers = int(opts.get("-j", config.get("max_workers", 5)))
+max_rate = opts.get("-r", config.get("max_request_rate"))
+max_rate = float(max_rate) if max_rate is not None else None
+retries = int(opts.get("-R", config.get("retries", 3)))
 
 if dry_run:
     print("====== dry run mode ======")
@@ -237,6 +234,9 @@ if "-v" in opts:
     print("  config:                      ", opts.get("-c"))
     print("  max age for last run:        ", age_last)
     print("  max missing files fraction:  ", fraction)
+    print("  Rucio workers:               ", max_workers)
+    print("  max Rucio request rate:      ", "no limit" if max_rate is None else max_rate)
+    print("  Rucio request retries:       ", retries)
     print()
 
 final_stats = missing_action(storage_path, rse, scope, age_last, out, stats, stats_key, account, dry_run)
@@ -2,9 +2,11 @@ import sys, os, getopt, time, os.path
 from datetime import datetime, timedelta
 from pythreader import TaskQueue, Task, Primitive, synchronized
 
-from run import CCRun, FileNotFoundException
+from run import RunHistory, FileNotFoundException
+from age_index import AgeIndex
 from config import ActionConfiguration
-from rucio_consistency import CEConfiguration, Stats
+from rucio_consistency import CEConfiguration
+from stats import Stats
 from rucio_consistency.xrootd import XRootDClient
 
 
@@ -18,6 +20,9 @@ python remove_empty_dirs.py [options] (<storage_path>|<file path>) <rse>
     -S <stats key>              - key to store stats under, default: "empty_action"
     -c <config.yaml>|rucio      - load configuration from a YAML file or Rucio
     -v                          - verbose output
+    -A                          - use the persistent empty directory age index in <storage_path> instead of reading
+                                  all empty directory lists in the confirmation window. The index is updated with new runs first.
+    -t <tmp dir>                - directory for temporary files used to sort the lists when updating the age index
 
     The following will override values read from the configuration:
     -L <number>                 - stop after removing so many directories
@@ -177,13 +182,40 @@ def update_confirmed(confirmed, update):
             except KeyError:    pass
     return new_confirmed
 
-def empty_action(storage_path, rse, out, lfn_converter, stats, stats_key, dry_run, client, my_stats, verbose, limit):
+def confirm_empty_indexed(storage_path, rse, runs, first_run, lfn_converter, tmp_dir=None):
+    #
+    # brings the age index up to date with the runs and returns the set of directories found empty
+    # in all the runs since first_run, and index stats.
+    # Same exclusion rule as update_confirmed(): parents of the directories which were empty in first_run,
+    # but dropped out of the empty set in a later run, are not confirmed. These directories are the ones
+    # in the first run's list which are not confirmed by the index, so only that one list is read.
+    #
+    index = AgeIndex(storage_path, rse, "ED", tmp_dir)
+    added = index.update_from_runs(runs)
+    confirmed = set(lfn_converter.lfn_or_path_to_path(path) for path in index.confirmed(first_run.Run))
+    dropped = set()
+    for path in first_run.empty_directories():
+        path = lfn_converter.lfn_or_path_to_path(path)
+        if path not in confirmed:
+            dropped.add(path)
+    for path in dropped:
+        for parent in parents(path):
+            confirmed.discard(parent)
+    return confirmed, {
+        "file":         os.path.basename(index.file_path()),
+        "last_run":     index.LastRun,
+        "runs_added":   added,
+        "rebuilt":      index.Rebuilt
+    }
+
+def empty_action(storage_path, rse, out, lfn_converter, stats, stats_key, dry_run, client, my_stats, verbose, limit,
+            tmp_dir=None, use_age_index=False):
 
     my_stats["start_time"] = t0 = time.time()
     if stats is not None:
         stats.update_section(stats_key, my_stats)
 
-    runs = list(CCRun.runs_for_rse(storage_path, rse, complete_only=False))
+    runs = RunHistory.get(storage_path, rse).runs()
     now = datetime.now()
 
     for r in runs:
@@ -244,14 +276,25 @@ def empty_action(storage_path, rse, out, lfn_converter, stats, stats_key, dry_ru
 
         else:
             # compute confirmed list and make sure the list would contain only removable directories
-            confirmed = set(lfn_converter.lfn_or_path_to_path(path) for path in recent_runs[0].empty_directories())
-            confirmed = update_confirmed(confirmed, set(lfn_converter.lfn_or_path_to_path(path) for path in recent_runs[-1].empty_directories()))
-            for run in recent_runs[1:-1]:
-                print(f"run: {run.Run} - #confirmed: {len(confirmed)}")
-                if not confirmed:
-                    break
-                run_set = set(lfn_converter.lfn_or_path_to_path(path) for path in run.empty_directories())
-                confirmed = update_confirmed(confirmed, run_set)
+            if use_age_index:
+                usable_runs = sorted(
+                    [r for r in runs
+                        if r.empty_directories_collected()
+                            and r.empty_directory_count() is not None
+                            and r.empty_dir_list_exists()
+                    ],
+                    key=lambda r: r.Timestamp
+                )
+                confirmed, my_stats["age_index"] = confirm_empty_indexed(storage_path, rse, usable_runs, first_run, lfn_converter, tmp_dir)
+            else:
+                confirmed = set(lfn_converter.lfn_or_path_to_path(path) for path in recent_runs[0].empty_directories())
+                confirmed = update_confirmed(confirmed, set(lfn_converter.lfn_or_path_to_path(path) for path in recent_runs[-1].empty_directories()))
+                for run in recent_runs[1:-1]:
+                    print(f"run: {run.Run} - #confirmed: {len(confirmed)}")
+                    if not confirmed:
+                        break
+                    run_set = set(lfn_converter.lfn_or_path_to_path(path) for path in run.empty_directories())
+                    confirmed = update_confirmed(confirmed, run_set)
 
             confirmed_empty_count = len(confirmed)
             print("Confirmed empty directories:", confirmed_empty_count, file=sys.stderr)
@@ -303,7 +346,7 @@ if not sys.argv[1:] or sys.argv[1] == "help":
     print(Usage)
     sys.exit(2)
 
-opts, args = getopt.getopt(sys.argv[1:], "h?o:M:m:w:n:f:s:S:c:va:dL:")
+opts, args = getopt.getopt(sys.argv[1:], "h?o:M:m:w:n:f:s:S:c:va:dL:At:")
 opts = dict(opts)
 
 if not args or "-h" in opts or "-?" in opts:
@@ -333,6 +376,8 @@ min_runs = int(opts.get("-n", config.get("min_runs", 3)))
 account = opts.get("-a")
 dry_run = "-d" in opts
 verbose = "-v" in opts
+use_age_index = "-A" in opts
+tmp_dir = opts.get("-t")
 limit = opts.get("-L")
 if limit:   limit = int(limit)
 
@@ -357,6 +402,7 @@ if "-v" in opts:
     print("  max age for first run:       ", max_age_last)
     print("  min number of runs:          ", min_runs)
     print("  limit:                       ", "no limit" if limit is None else limit)
+    print("  use age index:               ", use_age_index)
     print()
     print("Scanner:")
     print("  server:        ", scanner_config["server"])
@@ -382,6 +428,7 @@ my_stats = {
     "error": None,
     "runs_compared": None,
     "limit": limit,
+    "age_index": None,
     "configuration": {
         "confirmation_window": window,
         "min_age_first_run": min_age_first,
@@ -406,7 +453,8 @@ client = XRootDClient(server, is_redirector, server_root, timeout=timeout)
 if os.path.isfile(storage_path):
     run_stats = remove_from_file(storage_path, rse, out, lfn_converter, stats, stats_key, dry_run, client, my_stats, verbose, limit)
 else:
-    run_stats = empty_action(storage_path, rse, out, lfn_converter, stats, stats_key, dry_run, client, my_stats, verbose, limit)
+    run_stats = empty_action(storage_path, rse, out, lfn_converter, stats, stats_key, dry_run, client, my_stats, verbose, limit,
+                tmp_dir, use_age_index)
 status = run_stats["status"]
 error = run_stats.get("error")
 aborted_reason = run_stats.get("aborted_reason")
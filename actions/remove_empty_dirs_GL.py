@@ -2,9 +2,10 @@ import sys, os, getopt, time, os.path
 from datetime import datetime, timedelta
 from pythreader import TaskQueue, Task, Primitive, synchronized
 
-from run import CCRun, FileNotFoundException
+from run import RunHistory, FileNotFoundException
 from config import ActionConfiguration
-from rucio_consistency import CEConfiguration, Stats
+from rucio_consistency import CEConfiguration
+from stats import Stats
 from rucio_consistency.xrootd import XRootDClient
 
 
@@ -183,7 +184,7 @@ def empty_action(storage_path, rse, out, lfn_converter, stats, stats_key, dry_ru
     if stats is not None:
         stats.update_section(stats_key, my_stats)
 
-    runs = list(CCRun.runs_for_rse(storage_path, rse, complete_only=False))
+    runs = RunHistory.get(storage_path, rse).runs()
     now = datetime.now()
 
     for r in runs:
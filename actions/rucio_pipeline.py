@@ -0,0 +1,231 @@
+import sys, time, random
+from pythreader import TaskQueue, Task, Primitive, synchronized
+
+#
+# Concurrent Rucio declaration pipeline.
+#
+# The missing list is split into chunks. Each chunk is processed by one task on a bounded thread pool:
+# the replicas are looked up once with list_replicas() to find the permanently lost files, then
+# the chunk is declared with declare_bad_file_replicas(). All Rucio calls go through a shared rate
+# limiter and are retried with exponential backoff. Per-chunk latencies are collected for the stats.
+#
+
+def chunked(lst, chunk_size=1000):
+    for i in range(0, len(lst), chunk_size):
+        yield lst[i:i+chunk_size]
+
+def is_replica_lost(states, rse):
+    # the replica is lost if it is not AVAILABLE at any other RSE apart from the one where it's missing
+    return not any(state == 'AVAILABLE' and other_rse != rse for other_rse, state in states.items())
+
+class RateLimiter(Primitive):
+
+    def __init__(self, rate=None):
+        # rate: max number of requests per second, None - no limit
+        Primitive.__init__(self)
+        self.Interval = 1.0/rate if rate else 0.0
+        self.NextTime = 0.0
+
+    @synchronized
+    def reserve(self):
+        # returns time when the request can be sent
+        t = max(time.time(), self.NextTime)
+        self.NextTime = t + self.Interval
+        return t
+
+    def wait(self):
+        if self.Interval > 0:
+            delay = self.reserve() - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+class ChunkTask(Task):
+
+    def __init__(self, pipeline, index, chunk):
+        Task.__init__(self)
+        self.Pipeline = pipeline
+        self.Index = index
+        self.Chunk = chunk
+
+    def run(self):
+        return self.Pipeline.process_chunk(self.Index, self.Chunk)
+
+class DeclarationPipeline(Primitive):
+
+    Reason = "detected missing by CE"
+
+    def __init__(self, client, rse, declare=True, chunk_size=1000, max_workers=5, rate=None, retries=3, backoff=1.0,
+                verbose=False):
+        #
+        # client: object with list_replicas(dids) and declare_bad_file_replicas(replicas, reason, force) methods,
+        #           normally rucio ReplicaClient
+        # declare: if False, only look up the replicas
+        # rate: max number of Rucio requests per second for all workers together, None - no limit
+        #
+        Primitive.__init__(self)
+        self.Client = client
+        self.RSE = rse
+        self.Declare = declare
+        self.ChunkSize = chunk_size
+        self.MaxWorkers = max_workers
+        self.Limiter = RateLimiter(rate)
+        self.Rate = rate
+        self.Retries = retries
+        self.Backoff = backoff
+        self.Verbose = verbose
+
+        self.LostFiles = []
+        self.NotDeclared = []
+        self.DeclaredCount = 0
+        self.ChunkStats = []            # [{"chunk":, "size":, "lookup_time":, "declare_time":, "retries":}, ...]
+        self.Failed = []                # [(chunk index, error), ...]
+        self.RetryCount = 0
+
+    def call(self, method, *params, **args):
+        # returns (result, number of retries)
+        retries = 0
+        while True:
+            self.Limiter.wait()
+            try:
+                return method(*params, **args), retries
+            except Exception as e:
+                if retries >= self.Retries:
+                    raise
+                delay = self.Backoff * 2**retries * (1.0 + random.random()/2)
+                if self.Verbose:
+                    print("retrying %s after error: %s, in %.1f seconds" % (method.__name__, e, delay), file=sys.stderr)
+                time.sleep(delay)
+                retries += 1
+
+    def list_replicas(self, dids):
+        # list_replicas() returns a generator, the request is sent when it is iterated
+        return list(self.Client.list_replicas(dids=dids))
+
+    def process_chunk(self, index, chunk):
+        dids = [{'scope':element['scope'], 'name':element['name']} for element in chunk]
+        t0 = time.time()
+        replicas, lookup_retries = self.call(self.list_replicas, dids)
+        t1 = time.time()
+        lost = [replica['name'] for replica in replicas if is_replica_lost(replica['states'], self.RSE)]
+        not_declared = []
+        declare_retries = 0
+        declare_time = None
+        if self.Declare:
+            result, declare_retries = self.call(self.Client.declare_bad_file_replicas, chunk, self.Reason, force=True)
+            declare_time = time.time() - t1
+            not_declared = result.pop(self.RSE, [])      # there should be no other RSE in there
+            assert not result, "Other RSEs in the not_declared dictionary: "  + ",".join(result.keys())
+        return lost, not_declared, {
+            "chunk":        index,
+            "size":         len(chunk),
+            "lookup_time":  t1 - t0,
+            "declare_time": declare_time,
+            "retries":      lookup_retries + declare_retries
+        }
+
+    def run(self, missing_list):
+        queue = TaskQueue(self.MaxWorkers, capacity=self.MaxWorkers*2, delegate=self)
+        for index, chunk in enumerate(chunked(missing_list, self.ChunkSize)):
+            queue.append(ChunkTask(self, index, chunk))
+        queue.waitUntilEmpty()
+        self.ChunkStats.sort(key=lambda s: s["chunk"])
+        self.Failed.sort()
+        return self
+
+    @synchronized
+    def taskEnded(self, queue, task, result):
+        lost, not_declared, chunk_stats = result
+        self.LostFiles.extend(lost)
+        self.NotDeclared.extend(not_declared)
+        if self.Declare:
+            self.DeclaredCount += len(task.Chunk) - len(not_declared)
+        self.RetryCount += chunk_stats["retries"]
+        self.ChunkStats.append(chunk_stats)
+        if self.Verbose:
+            print("chunk %d done: lookup: %.2fs, declare: %s" % (task.Index, chunk_stats["lookup_time"],
+                    "-" if chunk_stats["declare_time"] is None else "%.2fs" % (chunk_stats["declare_time"],)),
+                file=sys.stderr)
+
+    @synchronized
+    def taskFailed(self, queue, task, exc_type, exc_value, tb):
+        if self.Verbose:
+            print("chunk %d failed: %s" % (task.Index, exc_value), file=sys.stderr)
+        self.Failed.append((task.Index, str(exc_value)))
+
+    def stats(self):
+        latencies = [s["lookup_time"] + (s["declare_time"] or 0.0) for s in self.ChunkStats]
+        return {
+            "chunk_size":       self.ChunkSize,
+            "workers":          self.MaxWorkers,
+            "max_rate":         self.Rate,
+            "chunks":           len(self.ChunkStats) + len(self.Failed),
+            "failed_chunks":    len(self.Failed),
+            "retries":          self.RetryCount,
+            "chunk_latency": {
+                "min":  min(latencies) if latencies else None,
+                "max":  max(latencies) if latencies else None,
+                "mean": sum(latencies)/len(latencies) if latencies else None
+            },
+            "chunk_stats":      self.ChunkStats
+        }
+
+class StubReplicaClient(object):
+    #
+    # Local stand-in for rucio ReplicaClient to test the pipeline without Rucio.
+    # Every replica is AVAILABLE at the given RSE only, unless listed in available_elsewhere.
+    #
+
+    def __init__(self, rse, latency=0.05, failure_rate=0.0, available_elsewhere=()):
+        self.RSE = rse
+        self.Latency = latency
+        self.FailureRate = failure_rate
+        self.AvailableElsewhere = set(available_elsewhere)
+
+    def request(self):
+        time.sleep(self.Latency)
+        if random.random() < self.FailureRate:
+            raise RuntimeError("simulated Rucio error")
+
+    def list_replicas(self, dids):
+        self.request()
+        for did in dids:
+            states = {self.RSE: "AVAILABLE"}
+            if did["name"] in self.AvailableElsewhere:
+                states["OTHER_RSE"] = "AVAILABLE"
+            yield {"scope": did["scope"], "name": did["name"], "states": states}
+
+    def declare_bad_file_replicas(self, replicas, reason, force=False):
+        self.request()
+        return {}
+
+if __name__ == "__main__":
+    import getopt, json
+
+    Usage = """
+python rucio_pipeline.py [options] <number of files>    - run the pipeline against the stub Rucio client
+    -j <workers>            - default 5
+    -r <requests/second>    - default: no limit
+    -c <chunk size>         - default 1000
+    -l <latency, seconds>   - stub request latency, default 0.05
+    -e <failure rate>       - stub request failure rate, default 0
+    """
+
+    opts, args = getopt.getopt(sys.argv[1:], "j:r:c:l:e:")
+    opts = dict(opts)
+    if not args:
+        print(Usage)
+        sys.exit(2)
+
+    n = int(args[0])
+    rate = opts.get("-r")
+    client = StubReplicaClient("RSE", float(opts.get("-l", 0.05)), float(opts.get("-e", 0.0)),
+        available_elsewhere=["/store/file_%d" % (i,) for i in range(0, n, 2)])
+    pipeline = DeclarationPipeline(client, "RSE",
+        chunk_size=int(opts.get("-c", 1000)), max_workers=int(opts.get("-j", 5)), rate=rate and float(rate),
+        backoff=0.1, verbose=True)
+    t0 = time.time()
+    pipeline.run([{"scope":"cms", "rse":"RSE", "name":"/store/file_%d" % (i,)} for i in range(n)])
+    stats = pipeline.stats()
+    del stats["chunk_stats"]
+    print(json.dumps(stats, indent=4))
+    print("lost:", len(pipeline.LostFiles), "  declared:", pipeline.DeclaredCount, "  elapsed: %.2fs" % (time.time() - t0,))
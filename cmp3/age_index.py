@@ -0,0 +1,182 @@
+import os, gzip, sys
+
+from sort_merge import external_sort
+
+Usage = """
+python age_index.py update [-t <tmp dir>] <storage_path> <rse> (D|ED)      - bring the index up to date with the complete runs
+python age_index.py confirmed <storage_path> <rse> (D|ED) <run>             - print paths seen in all runs since <run>
+python age_index.py dump <storage_path> <rse> (D|ED)                        - print the index
+"""
+
+#
+# Persistent age index.
+#
+# For each path found in the dark (D) or empty directory (ED) lists, the index records the first run
+# the path appeared in and the last run it was seen in. Only the paths seen in all the runs since
+# their first run are kept, so a path missing from one run starts over. Each new run updates the index
+# with one pass over its own (sorted) list merged with the (sorted) index, and confirmation becomes
+# a single scan of the index filtering on the first run.
+#
+# A run which shows up after a newer run was already added (e.g. a run which finished late) can not be
+# merged into the index, because the streaks depend on the run order. The index records the runs it includes,
+# and when such a run appears, the index is rebuilt from all the runs.
+#
+# File format: <storage_path>/<rse>_<type>Age.tsv.gz, text, sorted by path:
+#
+#   #last_run <run>
+#   #runs <run> <run> ...
+#   <path>\t<first run>\t<last run>
+#
+
+class AgeIndex(object):
+
+    Types = {
+        "D":    "Dark",
+        "ED":   "Empty"
+    }
+
+    def __init__(self, dir_path, rse, typ, tmp_dir=None):
+        assert typ in self.Types, "Unknown list type: %s" % (typ,)
+        self.Path = dir_path
+        self.RSE = rse
+        self.Type = typ
+        self.TmpDir = tmp_dir
+        self.LastRun = None
+        self.Runs = set()           # run ids included in the index, None if not recorded (older index files)
+        self.Rebuilt = False
+        if os.path.isfile(self.file_path()):
+            with gzip.open(self.file_path(), "rt") as f:
+                self.LastRun, self.Runs = self.read_header(f)
+
+    def file_path(self):
+        return f"{self.Path}/{self.RSE}_{self.Types[self.Type]}Age.tsv.gz"
+
+    @staticmethod
+    def read_header(f):
+        # returns (last run, set of included runs or None)
+        last_run = runs = None
+        for line in f:
+            if not line.startswith("#"):
+                break
+            words = line.split()
+            if words[0] == "#last_run" and len(words) > 1:
+                last_run = words[1]
+            elif words[0] == "#runs":
+                runs = set(words[1:])
+        return last_run, runs
+
+    def entries(self):
+        # yields (path, first_run, last_run) in path order
+        if not os.path.isfile(self.file_path()):
+            return
+        with gzip.open(self.file_path(), "rt") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line and not line.startswith("#"):
+                    path, first_run, last_run = line.split("\t")
+                    yield path, first_run, last_run
+
+    def __iter__(self):
+        return self.entries()
+
+    def update(self, run, paths):
+        #
+        # run: run id, must be newer than the last run in the index
+        # paths: the run's list, in any order
+        # returns number of paths in the updated index
+        #
+        if self.LastRun is not None and run <= self.LastRun:
+            return None         # already included
+        old = self.entries()
+        new = external_sort(paths, self.TmpDir)
+        tmp_path = self.file_path() + ".tmp"
+        runs = (self.Runs or set()) | {run}
+        n = 0
+        with gzip.open(tmp_path, "wt") as out:
+            out.write("#last_run %s\n" % (run,))
+            out.write("#runs %s\n" % (" ".join(sorted(runs)),))
+            entry = next(old, None)
+            for path in new:
+                while entry is not None and entry[0] < path:
+                    entry = next(old, None)         # not in the new run - dropped
+                first_run = run
+                if entry is not None and entry[0] == path:
+                    first_run = entry[1]
+                    entry = next(old, None)
+                out.write("%s\t%s\t%s\n" % (path, first_run, run))
+                n += 1
+        old.close()
+        os.replace(tmp_path, self.file_path())
+        self.LastRun = run
+        self.Runs = runs
+        return n
+
+    def reset(self):
+        if os.path.isfile(self.file_path()):
+            os.remove(self.file_path())
+        self.LastRun = None
+        self.Runs = set()
+
+    def update_from_runs(self, runs):
+        #
+        # runs: CCRun objects in chronological order. Runs already included in the index are skipped.
+        # If one of the runs is older than the last run in the index but is not included, the index is rebuilt.
+        # returns list of run ids added to the index
+        #
+        runs = list(runs)
+        if self.LastRun is not None:
+            missed = [run.Run for run in runs
+                if run.Run < self.LastRun and (self.Runs is None or run.Run not in self.Runs)]
+            if missed:
+                self.reset()
+                self.Rebuilt = True
+        added = []
+        for run in runs:
+            if self.LastRun is None or run.Run > self.LastRun:
+                paths = run.dark_files() if self.Type == "D" else run.empty_directories()
+                self.update(run.Run, paths)
+                added.append(run.Run)
+        return added
+
+    def confirmed(self, since_run):
+        # yields paths seen in all runs since since_run, in path order
+        for path, first_run, _ in self.entries():
+            if first_run <= since_run:
+                yield path
+
+if __name__ == "__main__":
+    import getopt
+    from run import RunHistory
+
+    opts, args = getopt.getopt(sys.argv[1:], "t:")
+    opts = dict(opts)
+    if len(args) < 4:
+        print(Usage)
+        sys.exit(2)
+
+    cmd, storage_path, rse, typ = args[:4]
+    index = AgeIndex(storage_path, rse, typ, opts.get("-t"))
+    if cmd == "update":
+        runs = RunHistory.get(storage_path, rse).runs(complete_only=typ == "D")
+        if typ == "ED":
+            runs = (r for r in runs if r.empty_directories_collected() and r.empty_dir_list_exists())
+        added = index.update_from_runs(runs)
+        if index.Rebuilt:
+            print("index rebuilt")
+        for run_id in added:
+            print("added:", run_id)
+        print("last run:", index.LastRun)
+    elif cmd == "confirmed":
+        if len(args) < 5:
+            print(Usage)
+            sys.exit(2)
+        for path in index.confirmed(args[4]):
+            print(path)
+    elif cmd == "dump":
+        print("#last_run", index.LastRun)
+        print("#runs", *sorted(index.Runs or []))
+        for path, first_run, last_run in index.entries():
+            print("%s\t%s\t%s" % (path, first_run, last_run))
+    else:
+        print(Usage)
+        sys.exit(2)
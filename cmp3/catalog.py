@@ -0,0 +1,279 @@
+import sys, os, time, json, sqlite3, getopt, re
+from stats_log import read_stats, log_path, compacting_path
+
+Usage = """
+python catalog.py [-d <database>] sync <storage path>                           - create the catalog or ingest new and modified stats files
+python catalog.py [-d <database>] rses <storage path>                           - list RSEs
+python catalog.py [-d <database>] runs [-c] [-n <n>] <storage path> <rse>       - list runs for the RSE
+    -c                  - complete runs only
+    -n <n>              - last <n> runs only
+python catalog.py [-d <database>] status <storage path> <component> <status> [<days>]
+                                                                                - list runs where the component had the status,
+                                                                                  started in last <days> days
+python catalog.py [-d <database>] sql <storage path> "<query>"                  - run SQL query
+
+Default database location: <storage path>/catalog.sqlite
+The query commands open the catalog read-only and do not sync it.
+"""
+
+#
+# Optional SQLite catalog of the runs found in a storage directory.
+#
+# Each <rse>_<run>_stats.json file is ingested into one row of the "runs" table, one row of the "components" table
+# per stats section (scanner, cmp3, dark_action, ...) and the numeric values of each section go into the "counts" table.
+# The catalog is kept in sync by comparing the stats file mtime and size with the recorded ones, so only new and
+# modified stats files are parsed. Pending events from the stats log (see stats_log.py) are folded in.
+# Stats files which can not be parsed are recorded with mtime = NULL so that they are listed as runs
+# and re-read on the next sync.
+#
+# The catalog is updated only by "catalog.py sync", which the driver scripts run after the comparison step and
+# at the end of the run, if the catalog exists. The readers (CCRun, RunHistory, the query commands) open it read-only
+# and never sync it, so reading does not scan the directory or write to the database. If the database file exists,
+# CCRun uses it instead of globbing the directory.
+#
+
+SCHEMA_VERSION = "1"
+
+Schema = """
+    create table if not exists meta (
+        name        text primary key,
+        value       text
+    );
+
+    create table if not exists runs (
+        rse         text,
+        run         text,
+        mtime       real,
+        size        integer,
+        complete    integer,
+        disabled    integer,
+        start_time  real,
+        end_time    real,
+        ndark       integer,
+        nmissing    integer,
+        nexpected   integer,
+        primary key (rse, run)
+    );
+
+    create table if not exists components (
+        rse         text,
+        run         text,
+        component   text,
+        status      text,
+        start_time  real,
+        end_time    real,
+        elapsed     real,
+        primary key (rse, run, component)
+    );
+
+    create index if not exists components_status on components(component, status, start_time);
+
+    create table if not exists counts (
+        rse         text,
+        run         text,
+        component   text,
+        name        text,
+        value       real,
+        primary key (rse, run, component, name)
+    );
+"""
+
+StatsFileRE = re.compile(r"(?P<rse>\w+?)_(?P<run>\d{4}_\d{2}_\d{2}_\d{2}_\d{2})_stats\.json$")
+
+TimeKeys = ("start_time", "end_time", "elapsed", "heartbeat")
+
+class Catalog(object):
+
+    DefaultName = "catalog.sqlite"
+
+    def __init__(self, dir_path, db_path=None, readonly=False, timeout=60):
+        self.Path = dir_path
+        self.DBPath = db_path or self.default_path(dir_path)
+        if readonly:
+            self.DB = sqlite3.connect("file:%s?mode=ro" % (self.DBPath,), uri=True, timeout=timeout)
+        else:
+            self.DB = sqlite3.connect(self.DBPath, timeout=timeout)
+            self.DB.executescript(Schema)
+            self.DB.execute("insert or ignore into meta(name, value) values('schema_version', ?)", (SCHEMA_VERSION,))
+            self.DB.commit()
+        version = self.DB.execute("select value from meta where name='schema_version'").fetchone()
+        if version is None or version[0] != SCHEMA_VERSION:
+            raise ValueError("Unsupported catalog schema version %s in %s" % (version and version[0], self.DBPath))
+
+    @staticmethod
+    def default_path(dir_path):
+        return f"{dir_path}/{Catalog.DefaultName}"
+
+    @staticmethod
+    def open(dir_path, sync=False):
+        # returns Catalog if the database exists in the directory, otherwise None
+        # sync=False: read-only, sync=True: open for writing and synchronize with the directory
+        if not os.path.isfile(Catalog.default_path(dir_path)):
+            return None
+        catalog = Catalog(dir_path, readonly=not sync)
+        if sync:
+            catalog.sync()
+        return catalog
+
+    def close(self):
+        self.DB.close()
+
+    #
+    # ingestion
+    #
+
+    def stats_files(self):
+        # yields (rse, run, path, mtime, size) for non-empty stats files
+        # mtime and size include the stats log, so that appended events trigger re-ingestion
+        for entry in os.scandir(self.Path):
+            m = StatsFileRE.match(entry.name)
+            if m:
+                try:    st = entry.stat()
+                except OSError: continue
+                if st.st_size > 0:
+                    mtime, size = st.st_mtime, st.st_size
+                    for path in (log_path(entry.path), compacting_path(entry.path)):
+                        try:    log_st = os.stat(path)
+                        except OSError: continue
+                        mtime, size = max(mtime, log_st.st_mtime), size + log_st.st_size
+                    yield m["rse"], m["run"], entry.path, mtime, size
+
+    def sync(self):
+        # returns (ingested, removed)
+        known = {(rse, run): (mtime, size) for rse, run, mtime, size in self.DB.execute("select rse, run, mtime, size from runs")}
+        found = set()
+        ingested = 0
+        for rse, run, path, mtime, size in self.stats_files():
+            found.add((rse, run))
+            if known.get((rse, run)) != (mtime, size):
+                self.ingest(rse, run, path, mtime, size)
+                ingested += 1
+        removed = set(known) - found
+        for rse, run in removed:
+            self.delete(rse, run)
+        self.DB.commit()
+        return ingested, len(removed)
+
+    def delete(self, rse, run):
+        for table in ("runs", "components", "counts"):
+            self.DB.execute(f"delete from {table} where rse=? and run=?", (rse, run))
+
+    def ingest(self, rse, run, path, mtime, size):
+        self.delete(rse, run)
+        try:
+            stats = read_stats(path)
+            if not isinstance(stats, dict):
+                raise ValueError("not a dictionary")
+        except (OSError, ValueError):
+            # can not be read now, record the run and try again next time
+            self.DB.execute("insert into runs(rse, run, mtime, size, complete) values(?, ?, NULL, ?, 0)", (rse, run, size))
+            return
+        cmp3 = stats.get("cmp3", {})
+        self.DB.execute("""
+            insert into runs(rse, run, mtime, size, complete, disabled, start_time, end_time, ndark, nmissing, nexpected)
+                values(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (rse, run, mtime, size, int(cmp3.get("status") == "done"), int(bool(stats.get("disabled"))),
+                stats.get("start_time"), stats.get("end_time"),
+                cmp3.get("dark"), cmp3.get("missing"), cmp3.get("expected_files"))
+        )
+        for component, section in stats.items():
+            if not isinstance(section, dict):
+                continue
+            self.DB.execute("""
+                insert into components(rse, run, component, status, start_time, end_time, elapsed)
+                    values(?, ?, ?, ?, ?, ?, ?)
+                """, (rse, run, component, section.get("status"),
+                    section.get("start_time"), section.get("end_time"), section.get("elapsed"))
+            )
+            self.DB.executemany("insert into counts(rse, run, component, name, value) values(?, ?, ?, ?, ?)",
+                [(rse, run, component, name, value) for name, value in section.items()
+                    if isinstance(value, (int, float)) and not isinstance(value, bool) and name not in TimeKeys]
+            )
+
+    #
+    # queries
+    #
+
+    def rses(self):
+        return [rse for (rse,) in self.DB.execute("select distinct rse from runs order by rse")]
+
+    def run_ids(self, rse, complete_only=False, limit=None):
+        # returns sorted list of run ids, limit applies to the latest runs
+        sql = "select run from runs where rse=?"
+        if complete_only:
+            sql += " and complete=1"
+        sql += " order by run desc"
+        params = (rse,)
+        if limit is not None:
+            sql += " limit ?"
+            params = (rse, limit)
+        return [run for (run,) in self.DB.execute(sql, params)][::-1]
+
+    def runs_with_status(self, component, status, since=None):
+        # returns [(rse, run, start_time), ...] for runs where the component has the status
+        # and, if since is given, started at or after that time
+        sql = "select rse, run, start_time from components where component=? and status=?"
+        params = [component, status]
+        if since is not None:
+            sql += " and start_time >= ?"
+            params.append(since)
+        return list(self.DB.execute(sql + " order by rse, run", params))
+
+    def counts(self, rse, run, component=None):
+        # returns {component -> {name -> value}}
+        sql = "select component, name, value from counts where rse=? and run=?"
+        params = [rse, run]
+        if component is not None:
+            sql += " and component=?"
+            params.append(component)
+        out = {}
+        for comp, name, value in self.DB.execute(sql, params):
+            out.setdefault(comp, {})[name] = value
+        return out
+
+    def query(self, sql, params=()):
+        cursor = self.DB.execute(sql, params)
+        columns = [d[0] for d in cursor.description or []]
+        return columns, cursor.fetchall()
+
+def main():
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "d:cn:")
+    opts = dict(opts)
+    if len(args) < 2:
+        print(Usage)
+        sys.exit(2)
+
+    cmd, storage_path, args = args[0], args[1], args[2:]
+    try:
+        catalog = Catalog(storage_path, opts.get("-d"), readonly = cmd != "sync")
+    except sqlite3.Error as e:
+        print("Can not open the catalog:", e, file=sys.stderr)
+        sys.exit(1)
+
+    if cmd == "sync":
+        t0 = time.time()
+        ingested, removed = catalog.sync()
+        print("ingested: %d, removed: %d, elapsed: %.1f" % (ingested, removed, time.time() - t0), file=sys.stderr)
+    elif cmd == "rses":
+        for rse in catalog.rses():
+            print(rse)
+    elif cmd == "runs":
+        limit = int(opts["-n"]) if "-n" in opts else None
+        for run in catalog.run_ids(args[0], complete_only="-c" in opts, limit=limit):
+            print(run)
+    elif cmd == "status":
+        component, status = args[0], args[1]
+        since = time.time() - float(args[2])*24*3600 if len(args) > 2 else None
+        for rse, run, start_time in catalog.runs_with_status(component, status, since):
+            print(rse, run)
+    elif cmd == "sql":
+        columns, rows = catalog.query(args[0])
+        print("\t".join(columns))
+        for row in rows:
+            print("\t".join(str(x) for x in row))
+    else:
+        print(Usage)
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
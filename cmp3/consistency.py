@@ -1,7 +1,9 @@
 import random, string, sys, glob
-from zlib import adler32
 import os.path
-import os
+import os, tempfile, shutil
+from sort_merge import cmp3_merge
+from fingerprint import cmp3_fingerprint
+from partitioner import StreamingPartitioner
 
 py3 = sys.version_info >= (3,)
 
@@ -33,7 +35,57 @@ def cmp3(a, r, b):
                         m.add(x)
         return list(d), list(m)
 
-def cmp3_parts(n, a_dir, r_dir, b_dir):
+def cmp3_sources(open_a, open_r, open_b, engine="sets"):
+        # open_a, open_r, open_b: callables returning a new iterable over the respective list
+        if engine == "fingerprint":
+                d, m, counts = cmp3_fingerprint(open_a, open_r, open_b)
+                if Verbose or counts["collisions"]:
+                        print("Fingerprint duplicates: %(duplicates)d, collisions: %(collisions)d" % counts)
+                return d, m
+        return cmp3(open_a(), open_r(), open_b())
+
+def file_lines(path):
+        # the file is closed when the generator is exhausted or discarded
+        with open(path, "r") as f:
+                yield from f
+
+def cmp3_files(an, rn, bn, engine="sets"):
+        return cmp3_sources(
+                lambda: file_lines(an),
+                lambda: file_lines(rn),
+                lambda: file_lines(bn),
+                engine
+        )
+
+def cmp3_streamed(n_parts, after, storage, before, tempdir, engine="sets"):
+        #
+        # reads each input once, fanning the lines out into compressed per-partition spill files,
+        # then compares the partitions one at a time. The spill files of a partition are removed once
+        # it is compared
+        #
+        partitioner = StreamingPartitioner(n_parts)
+        spill_dir = tempfile.mkdtemp(prefix="cmp3_spill_", dir=tempdir)
+        try:
+                a_parts = partitioner.spill(after, spill_dir, "a")
+                r_parts = partitioner.spill(storage, spill_dir, "r")
+                b_parts = partitioner.spill(before, spill_dir, "b")
+                d_list, m_list = [], []
+                for i, (an, rn, bn) in enumerate(zip(a_parts, r_parts, b_parts)):
+                        d, m = cmp3_sources(
+                                lambda: partitioner.read_part(an),
+                                lambda: partitioner.read_part(rn),
+                                lambda: partitioner.read_part(bn),
+                                engine
+                        )
+                        for fn in (an, rn, bn): os.remove(fn)
+                        d_list += d
+                        m_list += m
+                        if Verbose: print(f"Partition {i} compared: dark:{len(d)} missing:{len(m)}")
+        finally:
+                shutil.rmtree(spill_dir, ignore_errors=True)
+        return d_list, m_list
+
+def cmp3_parts(n, a_dir, r_dir, b_dir, engine="sets"):
         a_part_names = sorted(glob.glob("%s/a.list.*" % (a_dir,)))[:n]
         r_part_names = sorted(glob.glob("%s/r.list.*" % (r_dir, )))[:n]
         b_part_names = sorted(glob.glob("%s/b.list.*" % (b_dir, )))[:n]
@@ -45,11 +97,7 @@ def cmp3_parts(n, a_dir, r_dir, b_dir):
         d_list, m_list = [], []
         for i, (an, rn, bn) in enumerate(zip(a_part_names, r_part_names, b_part_names)):
                 if Verbose: print("Comparing %s %s %s..." % (an, rn, bn))
-                d, m = cmp3(
-                        open(an, "r"),
-                        open(rn, "r"),
-                        open(bn, "r")
-                )
+                d, m = cmp3_files(an, rn, bn, engine)
                 d_list += d
                 m_list += m
                 if Verbose: print(f"Partition {i} compared: dark:{len(d)} missing:{len(m)}") 
@@ -57,20 +105,49 @@ def cmp3_parts(n, a_dir, r_dir, b_dir):
     
 def split_file(fn, n_parts, prefix, outdir):
     part_names = ["%s/%s.%05d" % (outdir, prefix, i) for i in range(n_parts)]
-    parts = [open(fn, "w") for fn in part_names]
-    for l in open(fn, "r"):
-        i = adler32(bytes(l, "utf-8") if py3 else l) % n_parts
-        parts[i].write(l)
-    [p.close() for p in parts]
+    StreamingPartitioner(n_parts).split(fn, part_names)
     return part_names
     
     
-def consistency(before, storage, after, out, tempdir=None):
+def stripped_lines(paths):
+    for path in paths:
+        with open(path, "r") as f:
+            for l in f:
+                l = l.strip()
+                if l:
+                    yield l
+
+def consistency_merge(before, storage, after, out, tempdir=None):
+    #
+    # sort-merge version: the lists do not need to be split and the output comes out sorted
+    #
+    if os.path.isfile(before):
+        assert os.path.isfile(storage) and os.path.isfile(after)
+        a_files, r_files, b_files = [after], [storage], [before]
+    else:
+        assert os.path.isdir(storage) and os.path.isdir(after)
+        a_files = sorted(glob.glob("%s/a.list.*" % (after,)))
+        b_files = sorted(glob.glob("%s/b.list.*" % (before,)))
+        r_files = sorted(glob.glob("%s/r.list.*" % (storage,)))
+
+    d, m = cmp3_merge(stripped_lines(a_files), stripped_lines(r_files), stripped_lines(b_files), tempdir)
+
+    with open(out, "w") as out_f:
+        for p in m: out_f.write("LOST,%s\n" % (p,))
+        for p in d: out_f.write("DARK,%s\n" % (p,))
+
+    return d, m
+
+def consistency(before, storage, after, out, tempdir=None, engine="sets", stream=False):
     #
     # before, storage and after can be either file paths or directory paths
+    # stream: if True, the files are partitioned on the fly instead of being split into temporary files
     #
     
     assert os.path.exists(before) and os.path.exists(after) and os.path.exists(storage)
+
+    if engine == "merge":
+        return consistency_merge(before, storage, after, out, tempdir)
     
     d, m = [], []      
     
@@ -81,39 +158,39 @@ def consistency(before, storage, after, out, tempdir=None):
         max_size = max(os.path.getsize(f) for f in (before, storage, after))
         n_parts = (max_size + PART_SIZE - 1) // PART_SIZE
         
+        if n_parts > 1:
+            if tempdir is None:
+                tempdir = os.path.dirname(out) or "."   # assume its ok to write temp files into the output directory
+            assert os.path.isdir(tempdir), "To compare individual files, a temp directory needs to be provided"
+
         if n_parts == 1:
             # no need to split
-            d, m = cmp3(
-                open(after, "r"),
-                open(storage, "r"),
-                open(before, "r")
-            )
+            d, m = cmp3_files(after, storage, before, engine)
+        elif stream:
+            d, m = cmp3_streamed(n_parts, after, storage, before, tempdir, engine)
         else:
-            if tempdir is None:
-                tempdir = os.path.dirname(out)      # assume its ok to write temp files into the output directory
-            assert os.path.isdir(tempdir), "To compare individual files, a temp directory needs to be provided"
             tmp_names = split_file(after, n_parts, "a.list", tempdir) \
                 + split_file(before, n_parts, "b.list", tempdir) \
                 + split_file(storage, n_parts, "r.list", tempdir)
-            d, m = cmp3_parts(n_parts, tempdir, tempdir, tempdir)            
+            d, m = cmp3_parts(n_parts, tempdir, tempdir, tempdir, engine)
             for fn in tmp_names: os.remove(fn)  # remove temp files
     else:
         # files are pre-split and named a.list.#####, b.list.#####, r.list.###### in respective directories
         assert os.path.isdir(storage) and os.path.isdir(after)
         n = len(glob.glob("%s/a.list.*" % (after,)))
         assert n == len(glob.glob("%s/b.list.*" % (before,))) and n == len(glob.glob("%s/r.list.*" % (storage,)))
-        d, m = cmp3_parts(n, before, storage, after)
+        d, m = cmp3_parts(n, before, storage, after, engine)
     
     with open(out, "w") as out_f:
-        for p in sorted(m): out_f.write("LOST,%s" % (p,))
-        for p in sorted(d): out_f.write("DARK,%s" % (p,))
+        for p in sorted(m): out_f.write("LOST,%s\n" % (p.strip(),))
+        for p in sorted(d): out_f.write("DARK,%s\n" % (p.strip(),))
 
     return d, m
 
 Usage = """
 Usage: 
 	
-        python consistency.py [-p <part size>] [-t <tmp dir>] <before> <storage> <after> <output file>
+        python consistency.py [-p <part size>] [-t <tmp dir>] [-s] [-m|-f] <before> <storage> <after> <output file>
 
 <before>, <after> and <storage> can be either files or directories.
 If directories, they must contain part files like b.list.001, b.list.002, ... a.list.001, a.list.002, ..., r.list.001, r.list.002, ... respectively
@@ -122,6 +199,18 @@ If <tmp dir> is not given, then the <output file>'s directory will be used to pa
 Part size can be specified either as an integer or as <int>k, <int>m, <int>g for kilobytes, megabytes, gigabytes.
 Default part size is 1 GB.
 
+-s reads each input file once and fans it out into fast-compressed per-part spill files in a temporary
+subdirectory of <tmp dir>. The parts are compared one at a time and each part's spill files are removed
+as soon as it is compared, so less disk space and I/O is used than with the plain part files.
+
+-m selects the sort-merge engine: the lists are sorted externally (in <tmp dir> if given) and compared
+in a single merge pass using bounded memory. The input files are not split and -p is ignored.
+
+-f compares 64-bit path fingerprints instead of full paths to reduce memory usage. Only the dark and missing
+fingerprints are resolved back to paths. Collisions between distinct paths within one list are reported.
+Collisions between paths in different lists are not detected: a dark file whose fingerprint matches another
+path in the <after> list would not be reported. The probability is about n*m/2**64 for lists of n and m files.
+
 If the input is already split into parts and all the parts are in the same directory, you can use this:
 
 	python consistency.py <directory> <output file>
@@ -133,10 +222,11 @@ in this case, all the parts for all 3 lists are expected to be in the specified
 if __name__ == "__main__":
     import getopt
     
-    opts, args = getopt.getopt(sys.argv[1:], "t:p:")
+    opts, args = getopt.getopt(sys.argv[1:], "t:p:mfs")
     opts = dict(opts)
     
     temp_dir = opts.get("-t")
+    engine = "merge" if "-m" in opts else ("fingerprint" if "-f" in opts else "sets")
     part_size = opts.get("-p", "1g")
 
     if part_size[-1] in "kmg":
@@ -160,7 +250,7 @@ if __name__ == "__main__":
 
         
     
-    d, m = consistency(before, storage, after, out, temp_dir)
+    d, m = consistency(before, storage, after, out, temp_dir, engine, "-s" in opts)
     nd = len(d)
     nm = len(m)
 
@@ -1,17 +1,49 @@
-import sys, time, getopt, json
-from run import CCRun
-from rucio_consistency import Stats
-
-def diff(prev, last):
-    prev_set = set(prev)
-    new_set = set()
-    old_set = set()
-    for f in last:
-        if f in prev_set:
-            old_set.add(f)
+import sys, time, getopt, json, gzip
+from run import RunHistory
+from stats import Stats
+from sort_merge import external_sort, multi_merge
+
+def diff(prev, last, tmp_dir=None):
+    #
+    # merge-based diff, the lists are sorted externally if needed
+    # yields ("old"|"new"|"resolved", path) in sorted order:
+    #   old:        in both lists
+    #   new:        in the last list only
+    #   resolved:   in the previous list only
+    #
+    PREV, LAST = 0, 1
+    for path, where in multi_merge([external_sort(prev, tmp_dir), external_sort(last, tmp_dir)]):
+        if where == [PREV, LAST]:
+            yield "old", path
+        elif where == [LAST]:
+            yield "new", path
         else:
-            new_set.add(f)
-    return old_set, new_set
+            yield "resolved", path
+
+DiffTypes = ("old", "new", "resolved")
+
+def diff_lists(prev, last, out_prefix=None, tmp_dir=None):
+    #
+    # returns counts {"old":n, "new":n, "resolved":n} and list file names {"old":..., ...}
+    # if out_prefix is not None, writes the lists into <out_prefix><type>.list.gz
+    #
+    counts = {t: 0 for t in DiffTypes}
+    files = {}
+    outputs = {}
+    if out_prefix is not None:
+        for t in DiffTypes:
+            path = f"{out_prefix}{t}.list.gz"
+            files[t] = path.rsplit("/", 1)[-1]
+            outputs[t] = gzip.open(path, "wt")
+    try:
+        for t, path in diff(prev, last, tmp_dir):
+            counts[t] += 1
+            if outputs:
+                outputs[t].write(path + "\n")
+    finally:
+        for f in outputs.values():
+            f.close()
+    return counts, files
 
 Usage = """
 python diffs.py [options] <storage path> <RSE> [<run id>]
@@ -20,10 +52,13 @@ python diffs.py [options] <storage path> <RSE> [<run id>]
     -u                      - update run stats in place
     -s <JSON file>          - save results into JSON stats file
     -S                      - section key for the stats file, used with -s or -u. Default: "diffs"
+    -l                      - write lists of old, new and resolved dark and missing files into the storage path
+                              as <RSE>_<run id>_<D|M><old|new|resolved>.list.gz
+    -t <tmp dir>            - directory for temporary files used for sorting
 """
 
 def main():
-    opts, args = getopt.getopt(sys.argv[1:], "s:S:jpu")
+    opts, args = getopt.getopt(sys.argv[1:], "s:S:jpult:")
     opts = dict(opts)
 
     if not args:
@@ -36,11 +71,12 @@ def main():
 
     run_id = None
     path, rse = args[0], args[1]
+    history = RunHistory.get(path, rse)
     if len(args) > 2:
         run_id = args[2]
-        run = CCRun(path, rse, run_id)
+        run = history.run(run_id)
     else:
-        run = CCRun.last_run_for_rse(path, rse)
+        run = history.last()
 
     if run is None or not run.is_complete():
         print("Last run not found or incomplete", file=sys.stderr)
@@ -51,15 +87,27 @@ def main():
         print("Previous run not found or incomplete", file=sys.stderr)
         sys.exit(1)
     
-    old_dark, new_dark = diff(prev_run.dark_files(), run.dark_files())
-    old_missing, new_missing = diff(prev_run.missing_files(), run.missing_files())
+    tmp_dir = opts.get("-t")
+    dark_prefix = missing_prefix = None
+    if "-l" in opts:
+        dark_prefix = f"{path}/{rse}_{run.Run}_D"
+        missing_prefix = f"{path}/{rse}_{run.Run}_M"
+
+    dark_counts, dark_files = diff_lists(prev_run.dark_files(), run.dark_files(), dark_prefix, tmp_dir)
+    missing_counts, missing_files = diff_lists(prev_run.missing_files(), run.missing_files(), missing_prefix, tmp_dir)
 
     diff_data = dict(
             run=run.Run,
             prev_run=prev_run.Run,
-            missing_old=len(old_missing),
-            dark_old=len(old_dark)
+            missing_old=missing_counts["old"],
+            missing_new=missing_counts["new"],
+            missing_resolved=missing_counts["resolved"],
+            dark_old=dark_counts["old"],
+            dark_new=dark_counts["new"],
+            dark_resolved=dark_counts["resolved"]
     )
+    if "-l" in opts:
+        diff_data["list_files"] = dict(dark=dark_files, missing=missing_files)
 
     if "-p" in opts:
         if as_json:
@@ -0,0 +1,169 @@
+import hashlib
+from array import array
+
+try:
+    import numpy as np
+    Use_numpy = True
+except:
+    Use_numpy = False
+
+#
+# Compact fingerprint representation of path lists.
+#
+# Each path is replaced with its 64-bit hash, stored in a sorted array('Q') buffer (8 bytes per path
+# instead of ~200 bytes for a Python str in a set). The set algebra runs on the sorted arrays and
+# only the fingerprints found in the (small) dark and missing sets are resolved back to full paths
+# with a second pass over R or A.
+#
+# Collisions within one list are detected: fingerprints which occur more than once in a list are resolved
+# with an extra pass over that list, and the distinct paths sharing a fingerprint are counted as collisions.
+# Repeated identical paths are counted separately as duplicates, they do not affect the result.
+#
+# Collisions between different paths in different lists are NOT detected. For example, a dark file in R
+# whose fingerprint equals that of another path in A would be treated as present in A and would not be
+# reported as dark. With 64-bit fingerprints the probability of any such collision is about n*m/2**64
+# for lists of n and m paths.
+#
+
+def fingerprint(path):
+    if isinstance(path, str):
+        path = path.encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(path, digest_size=8).digest(), "little")
+
+class FingerprintSet(object):
+
+    def __init__(self, values, repeated=None):
+        # values: sorted array('Q') of unique fingerprints
+        # repeated: array('Q') of fingerprints which occurred more than once in the input
+        self.Values = values
+        self.Repeated = repeated if repeated is not None else array('Q')
+
+    @staticmethod
+    def from_array(values):
+        if Use_numpy:
+            values = np.sort(np.frombuffer(values, dtype=np.uint64))
+            if len(values) == 0:
+                return FingerprintSet(array('Q'))
+            same = values[1:] == values[:-1]
+            unique = values[np.concatenate(([True], ~same))]
+            repeated = np.unique(values[1:][same])
+            return FingerprintSet(array('Q', unique.tobytes()), array('Q', repeated.tobytes()))
+        unique = array('Q')
+        repeated = array('Q')
+        last = None
+        for v in sorted(values):
+            if v == last:
+                if not repeated or repeated[-1] != v:
+                    repeated.append(v)
+            else:
+                unique.append(v)
+                last = v
+        return FingerprintSet(unique, repeated)
+
+    @staticmethod
+    def from_paths(paths):
+        return FingerprintSet.from_array(array('Q', (fingerprint(p) for p in paths)))
+
+    def __len__(self):
+        return len(self.Values)
+
+    def __iter__(self):
+        return iter(self.Values)
+
+    def __sub__(self, other):
+        if Use_numpy:
+            a = np.frombuffer(self.Values, dtype=np.uint64)
+            b = np.frombuffer(other.Values, dtype=np.uint64)
+            return FingerprintSet(array('Q', np.setdiff1d(a, b, assume_unique=True).tobytes()))
+        out = array('Q')
+        b = other.Values
+        j, nb = 0, len(b)
+        for x in self.Values:
+            while j < nb and b[j] < x:
+                j += 1
+            if j >= nb or b[j] != x:
+                out.append(x)
+        return FingerprintSet(out)
+
+    def __and__(self, other):
+        if Use_numpy:
+            a = np.frombuffer(self.Values, dtype=np.uint64)
+            b = np.frombuffer(other.Values, dtype=np.uint64)
+            return FingerprintSet(array('Q', np.intersect1d(a, b, assume_unique=True).tobytes()))
+        out = array('Q')
+        b = other.Values
+        j, nb = 0, len(b)
+        for x in self.Values:
+            while j < nb and b[j] < x:
+                j += 1
+            if j < nb and b[j] == x:
+                out.append(x)
+        return FingerprintSet(out)
+
+def resolve(paths, fingerprints):
+    #
+    # finds paths for the fingerprints
+    # returns list of paths, a fingerprint matching more than one distinct path yields all of them
+    #
+    out = []
+    seen = set()
+    targets = set(fingerprints)
+    if targets:
+        for path in paths:
+            if fingerprint(path) in targets and path not in seen:
+                seen.add(path)
+                out.append(path)
+    return out
+
+def count_repeated(paths, fingerprints):
+    #
+    # resolves fingerprints which occurred more than once in one list
+    # returns (duplicates, collisions):
+    #   duplicates - number of repeated occurrences of identical paths
+    #   collisions - number of extra distinct paths sharing a fingerprint
+    #
+    occurrences = {}            # {fingerprint -> {path -> count}}
+    targets = set(fingerprints)
+    if targets:
+        for path in paths:
+            fp = fingerprint(path)
+            if fp in targets:
+                counts = occurrences.setdefault(fp, {})
+                counts[path] = counts.get(path, 0) + 1
+    duplicates = collisions = 0
+    for counts in occurrences.values():
+        collisions += len(counts) - 1
+        duplicates += sum(counts.values()) - len(counts)
+    return duplicates, collisions
+
+def cmp3_fingerprint(open_a, open_r, open_b):
+    #
+    # open_a, open_r, open_b: callables returning a new iterable over the respective list
+    #
+    #       D = R-A-B
+    #       M = A*B-R
+    #
+    # returns d, m, {"duplicates":..., "collisions":...}
+    #   duplicates - repeated identical paths within the lists
+    #   collisions - distinct paths sharing a fingerprint within one list. Collisions across lists are not detected
+    #
+    duplicates = collisions = 0
+    sets = []
+    for open_list in (open_a, open_r, open_b):
+        s = FingerprintSet.from_paths(open_list())
+        if s.Repeated:
+            # rare, one more pass over this list to tell repeated paths from collisions
+            nd, nc = count_repeated(open_list(), s.Repeated)
+            duplicates += nd
+            collisions += nc
+        sets.append(s)
+    a, r, b = sets
+    d_fp = r - a - b
+    m_fp = (a & b) - r
+    del a, r, b, sets           # release memory
+    d = resolve(open_r(), d_fp)
+    m = resolve(open_a(), m_fp)
+    return d, m, {
+        "duplicates":   duplicates,
+        "collisions":   collisions
+    }
@@ -1,4 +1,6 @@
 import json, os.path, traceback
+from stats import atomic_write_json
+from stats_log import compact, parse_batch
 
 class JSONFile(object):
     
@@ -24,7 +26,7 @@ class JSONFile(object):
         self.Data = json.load(open(self.Path, "r"))
 
     def save(self):
-        open(self.Path, "w").write(json.dumps(self.Data, indent=4))
+        atomic_write_json(self.Path, self.Data, indent=4)
         
     def __getitem__(self, name):
         return self.Data[name]
@@ -66,15 +68,12 @@ class JSONFile(object):
 
 def write_stats(my_stats, stats_file, stats_key = None):
     if stats_file:
-        stats = {}
-        if os.path.isfile(stats_file):    
-            with open(stats_file, "r") as f:
-                stats = json.loads(f.read())
-        if stats_key:
-            stats[stats_key] = my_stats
-        else:
-            stats.update(my_stats)
-        open(stats_file, "w").write(json.dumps(stats))
+        def merge(stats):
+            if stats_key:
+                stats[stats_key] = my_stats
+            else:
+                stats.update(my_stats)
+        compact(stats_file, merge)
 
 if __name__ == "__main__":
     import sys, getopt
@@ -85,9 +84,15 @@ if __name__ == "__main__":
         set <path> - < file.json
         set <path> -t "text"
         set <path> -t -   < file.text
+        batch < operations          - apply "set" operations read from stdin, one per line, in one read-modify-write:
+            set <path> <JSON expression>
+            set -t <path> <text to the end of the line>
+            set -f <path> <file>    - the text value is read from the file
     """
 
     def do_set(jf, args):
+        # re-read the file under the lock, with the pending stats log events folded in, so that concurrent updates
+        # of other parts of the file are not lost
         path = args[0]
         opts, args = getopt.getopt(args[1:], "t")
         opts = dict(opts)
@@ -99,8 +104,21 @@ if __name__ == "__main__":
             pass
         else:
             data = json.loads(data)
-        jf.set_at_path(path, data)
-        jf.save()
+        def update(current):
+            jf.Data = current
+            jf.set_at_path(path, data)
+        compact(jf.Path, update)
+
+    def do_batch(jf):
+        operations = parse_batch(sys.stdin)
+        for op, path, value in operations:
+            if op != "set":
+                raise ValueError("Unsupported batch operation: %s" % (op,))
+        def update(current):
+            jf.Data = current
+            for op, path, value in operations:
+                jf.set_at_path(path, value)
+        compact(jf.Path, update)
 
     opts, args = getopt.getopt(sys.argv[1:], "c")
     if not args:
@@ -112,6 +130,8 @@ if __name__ == "__main__":
     command_args = args[2:]
     if command == "set":
         do_set(jf, command_args)
+    elif command == "batch":
+        do_batch(jf)
     else:
         print(Usage)
         sys.exit(0)
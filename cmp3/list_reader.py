@@ -0,0 +1,126 @@
+import os, zlib
+
+#
+# Fast reader for the file lists (<rse>_<run>_<type>.list[.gz]).
+#
+# Gzipped lists are read through a reusable input buffer and decompressed in large blocks, and the data is
+# split into lines a block at a time, so the per-line work is one bytes.split() and strip() instead of
+# a pass through the GzipFile and TextIOWrapper layers. Plain lists are read through a file object with
+# a large buffer, which splits the lines in C: it measured faster than splitting memory-mapped or readinto()
+# blocks in Python, and it does not copy the data into intermediate blocks. The reader holds one open file and
+# closes it when the iteration ends, when it is used as a context manager, or when the iterator is
+# garbage collected.
+#
+#   with ListReader(path) as reader:
+#       for line in reader:
+#           ...
+#
+
+BLOCK_SIZE = 4*1024*1024            # decompressed bytes per block
+READ_SIZE = 1024*1024               # compressed bytes per read, plain file buffer size
+
+class ListReader(object):
+
+    def __init__(self, path, as_bytes=False, block_size=BLOCK_SIZE):
+        # as_bytes: yield lines as bytes instead of str
+        self.Path = path
+        self.AsBytes = as_bytes
+        self.BlockSize = block_size
+        self.Compressed = path.endswith(".gz")
+        if self.Compressed or as_bytes:
+            self.File = open(path, "rb", buffering=READ_SIZE)
+        else:
+            self.File = open(path, "r", encoding="utf-8", buffering=READ_SIZE)
+
+    def close(self):
+        if self.File is not None:
+            self.File.close()
+            self.File = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *params):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def __iter__(self):
+        return self.lines()
+
+    def decompressed_blocks(self):
+        buf = bytearray(READ_SIZE)
+        view = memoryview(buf)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out = []
+        nout = 0
+        while True:
+            n = self.File.readinto(buf)
+            if not n:
+                break
+            data = view[:n]
+            while data:
+                block = decompressor.decompress(data)
+                if block:
+                    out.append(block)
+                    nout += len(block)
+                data = decompressor.unused_data
+                if data:
+                    # concatenated gzip members
+                    out.append(decompressor.flush())
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if nout >= self.BlockSize:
+                yield b"".join(out)
+                out = []
+                nout = 0
+        out.append(decompressor.flush())
+        yield b"".join(out)
+
+    def plain_lines(self):
+        try:
+            for line in self.File:
+                line = line.strip()
+                if line:
+                    yield line
+        finally:
+            self.close()
+
+    def decompressed_lines(self):
+        try:
+            tail = b""
+            for block in self.decompressed_blocks():
+                block = tail + block
+                end = block.rfind(b"\n") + 1
+                tail = block[end:]
+                if self.AsBytes:
+                    lines = block[:end].split(b"\n")
+                else:
+                    lines = block[:end].decode("utf-8").split("\n")       # decode the whole block at once
+                for line in lines:
+                    line = line.strip()
+                    if line:
+                        yield line
+            tail = tail.strip()
+            if tail:
+                yield tail if self.AsBytes else tail.decode("utf-8")
+        finally:
+            self.close()
+
+    def lines(self):
+        # returns generator of stripped non-empty lines, the file is closed when the generator is exhausted
+        # or discarded. The lines are yielded directly by plain_lines() or decompressed_lines(), without
+        # an extra generator layer, which costs a few percent for short lines
+        return self.decompressed_lines() if self.Compressed else self.plain_lines()
+
+def find_list(path):
+    # returns <path> or <path>.gz, whichever exists, or None
+    if os.path.isfile(path):
+        return path
+    elif os.path.isfile(path + ".gz"):
+        return path + ".gz"
+    return None
+
+def read_lines(path, as_bytes=False):
+    # generator of stripped non-empty lines, the file is closed when the generator is exhausted or discarded
+    return ListReader(path, as_bytes).lines()
@@ -1,5 +1,4 @@
 import os, yaml, pprint, json
-from rucio.client.rseclient import RSEClient
 
 class MergedCEConfiguration(object):
 
@@ -15,6 +14,7 @@ class MergedCEConfiguration(object):
     """
 
     def __init__(self, rse, config_file, account="root"):
+        from rucio.client.rseclient import RSEClient        # imported here so that "get" does not need to load the Rucio client
         self.RSEClient = RSEClient(account=account)
         self.RSE = rse
         self.ConfigFromFile = yaml.load(open(config_file, "r"), Loader=yaml.SafeLoader)
@@ -70,9 +70,21 @@ class MergedCEConfiguration(object):
 
 Usage = """
 python merge_config.py merge [-j] <rse> <config file> 
-python merge_config.py get [-d <default>] <config file> <path, dot-separated>
+python merge_config.py get [-d <default>] <config file> <path, dot-separated> [<path> ...]
+    prints JSON value for each path, one per line, in the order of the paths
 """
 
+def get_path(cfg, path):
+    # raises KeyError if the path is not found
+    value = cfg
+    for head in path.split("."):
+        if head:
+            if isinstance(value, dict) and head in value:
+                value = value[head]
+            else:
+                raise KeyError(path)
+    return value
+
 if __name__ == "__main__":
     import sys, getopt
     
@@ -102,30 +114,28 @@ if __name__ == "__main__":
         opts, args = getopt.getopt(argv, "d:")
         opts = dict(opts)
         default = opts.get("-d")
-        merged_config_file, path = args
+        merged_config_file, paths = args[0], args[1:]
+        if not paths:
+            print(Usage)
+            sys.exit(2)
         cfg = yaml.load(open(merged_config_file, "r"), Loader=yaml.SafeLoader)
-        path = path.split(".")
-        value = cfg
-        try:
-            while path:
-                head = path.pop(0)
-                if head:
-                    if isinstance(value, dict) and head in value:
-                        value = value[head]
-                    else:
-                        raise KeyError()
-        except KeyError:
-            if default is not None:
-                value = default
-            else:
-                print("Path not fond", file=sys.stderr)
+        out = []
+        for path in paths:
+            try:
+                value = get_path(cfg, path)
+            except KeyError:
+                if default is not None:
+                    value = default
+                else:
+                    print("Path not fond:", path, file=sys.stderr)
+                    sys.exit(1)
+            try:
+                value = json.dumps(value)
+            except:
+                print("non-jsonable value:", value, file=sys.stderr)
                 sys.exit(1)
-        try:
-            value = json.dumps(value)
-        except:
-            print("non-jsonable value:", value, file=sys.stderr)
-            sys.exit(1)
-        print(value)
+            out.append(value)
+        print("\n".join(out))
 
         
     
@@ -1,5 +1,5 @@
 import random, string, sys, glob, time, gzip
-from cmplib import cmp3_generator
+from cmplib import cmp3_generator, cmp3_merge_generator, cmp3_fingerprint_generator, cmp5_parallel
 
 from part import PartitionedList
 
@@ -12,7 +12,12 @@ Version = "cmp5 1.1"
 
 
 Usage = """
-python cmp5.py [-z] [-s <stats file> [-S <stats key>]] <b m prefix> <b d prefix> <r prefix> <a m prefix> <a d prefix> <dark output> <missing output>
+python cmp5.py [-z] [-m [-t <tmp dir>]] [-j <n workers>] [-f] [-s <stats file> [-S <stats key>]] <b m prefix> <b d prefix> <r prefix> <a m prefix> <a d prefix> <dark output> <missing output>
+    -m              - use sort-merge comparison engine, produces sorted output using bounded memory
+    -t <tmp dir>    - directory for temporary sorted runs, used with -m
+    -j <n workers>  - compare partitions in parallel using a pool of worker processes
+    -f              - compare 64-bit path fingerprints instead of full paths to reduce memory usage,
+                      fingerprint collisions are reported in the stats
 """
 
 
@@ -34,13 +39,20 @@ def main():
 
         t0 = time.time()
 
-        opts, args = getopt.getopt(sys.argv[1:], "s:S:z")
+        opts, args = getopt.getopt(sys.argv[1:], "s:S:zmt:j:f")
         opts = dict(opts)
 
         if len(args) < 5:
                 print (Usage)
                 sys.exit(2)
         compress = "-z" in opts
+        merge = "-m" in opts
+        tmp_dir = opts.get("-t")
+        nworkers = int(opts.get("-j", 0))
+        fingerprints = "-f" in opts
+        if merge and (nworkers or fingerprints):
+                print("-m can not be used with -j or -f")
+                sys.exit(2)
         stats_file = opts.get("-s")
         stats_key = opts.get("-S", "cmp3")
         stats = Stats(stats_file) if stats_file else None
@@ -65,6 +77,8 @@ def main():
                 "missing_list_file": None,
                 "dark_list_file": None,
                 
+                "engine": "merge" if merge else ("fingerprints" if fingerprints else "sets"),
+                "workers": nworkers or None,
                 "status": "started"
             }
             
@@ -101,18 +115,43 @@ def main():
             fd = open(out_dark, "w")
             fm = open(out_missing, "w")
 
-        diffs_m = cmp3_generator(a_m_list, r_m_list, b_m_list, 'm')
         nm = nd = 0
-        for path in diffs_m:
-            fm.write(path+"\n")
-            nm += 1
-        fm.close()
-
-        diffs_d = cmp3_generator(a_d_list, r_d_list, b_d_list, 'd')
-        for path in diffs_d:
-            fd.write(path+"\n")
-            nd += 1
-        fd.close()
+        fp_stats = {"duplicates": 0, "collisions": 0} if fingerprints else None
+        if nworkers:
+            for d, m, part_fp_stats in cmp5_parallel(a_m_list, a_d_list, r_d_list, b_m_list, b_d_list, nworkers, fingerprints):
+                if part_fp_stats:
+                    for k, n in part_fp_stats.items():
+                        fp_stats[k] += n
+                for path in m:
+                    fm.write(path+"\n")
+                for path in d:
+                    fd.write(path+"\n")
+                nm += len(m)
+                nd += len(d)
+            fm.close()
+            fd.close()
+        else:
+            if merge:
+                diffs_m = cmp3_merge_generator(a_m_list, r_m_list, b_m_list, 'm', tmp_dir)
+            elif fingerprints:
+                diffs_m = cmp3_fingerprint_generator(a_m_list, r_m_list, b_m_list, 'm', fp_stats)
+            else:
+                diffs_m = cmp3_generator(a_m_list, r_m_list, b_m_list, 'm')
+            for path in diffs_m:
+                fm.write(path+"\n")
+                nm += 1
+            fm.close()
+
+            if merge:
+                diffs_d = cmp3_merge_generator(a_d_list, r_d_list, b_d_list, 'd', tmp_dir)
+            elif fingerprints:
+                diffs_d = cmp3_fingerprint_generator(a_d_list, r_d_list, b_d_list, 'd', fp_stats)
+            else:
+                diffs_d = cmp3_generator(a_d_list, r_d_list, b_d_list, 'd')
+            for path in diffs_d:
+                fd.write(path+"\n")
+                nd += 1
+            fd.close()
 
         print("Found %d dark and %d missing replicas" % (nd, nm))
         t1 = time.time()
@@ -126,6 +165,10 @@ def main():
                 "missing_list_file": out_missing.rsplit('/', 1)[-1],        # file names only
                 "dark_list_file": out_dark.rsplit('/', 1)[-1]
             })
+        if fp_stats is not None:
+            my_stats["fingerprints"] = fp_stats
+            if fp_stats["collisions"] or fp_stats["duplicates"]:
+                print("Fingerprint duplicates: %(duplicates)d, collisions: %(collisions)d" % fp_stats)
                 
         if stats is not None:
             stats[stats_key] = my_stats
@@ -1,4 +1,7 @@
+import multiprocessing
 from part import PartitionedList
+from sort_merge import external_sort, cmp3_sorted
+from fingerprint import FingerprintSet, resolve, count_repeated, cmp3_fingerprint
 
 def cmp3(a, r, b):
     #
@@ -83,6 +86,114 @@ def cmp3_generator(a_list, r_list, b_list, stream=None):
             elif stream == 'm':
                 yield from cmp3_missing(ap, rp, bp)
 
+def cmp3_fingerprint_generator(a_list, r_list, b_list, stream=None, fp_stats=None):
+    #
+    # fingerprint version of cmp3_generator
+    # fp_stats, if not None, is a dictionary to accumulate duplicates and collisions counts in
+    #
+    assert a_list.NParts == r_list.NParts and r_list.NParts == b_list.NParts, "Inconsistent number of parts: B:%d, R:%d, A:%d" % (
+        b_list.NParts, r_list.NParts, a_list.NParts)
+
+    for an, rn, bn in zip(a_list.FileNames, r_list.FileNames, b_list.FileNames):
+        d, m, counts = cmp3_fingerprint(
+            lambda: PartitionedList.open(files=[an]),
+            lambda: PartitionedList.open(files=[rn]),
+            lambda: PartitionedList.open(files=[bn])
+        )
+        if fp_stats is not None:
+            for k, n in counts.items():
+                fp_stats[k] = fp_stats.get(k, 0) + n
+        if stream is None:
+            yield from (('d',f) for f in d)
+            yield from (('m',f) for f in m)
+        elif stream == 'd':
+            yield from d
+        elif stream == 'm':
+            yield from m
+
+def cmp5_partition_fingerprint(files):
+    #
+    # same as cmp5_partition, but uses fingerprint sets
+    # duplicates and collisions are counted the same way as in cmp3_fingerprint
+    #
+    a_m_file, a_d_file, r_file, b_m_file, b_d_file = files
+    counts = {"duplicates": 0, "collisions": 0}
+
+    def fingerprint_set(file_name):
+        s = FingerprintSet.from_paths(PartitionedList.open(files=[file_name]))
+        if s.Repeated:
+            # rare, one more pass over this file to tell repeated paths from collisions
+            nd, nc = count_repeated(PartitionedList.open(files=[file_name]), s.Repeated)
+            counts["duplicates"] += nd
+            counts["collisions"] += nc
+        return s
+
+    r = fingerprint_set(r_file)
+    a_m = fingerprint_set(a_m_file)
+    b_m = fingerprint_set(b_m_file)
+    m_fp = (a_m & b_m) - r
+    del a_m, b_m
+    a_d = fingerprint_set(a_d_file)
+    b_d = fingerprint_set(b_d_file)
+    d_fp = r - a_d - b_d
+    del r, a_d, b_d
+    d = resolve(PartitionedList.open(files=[r_file]), d_fp)
+    m = resolve(PartitionedList.open(files=[a_m_file]), m_fp)
+    return d, m, counts
+
+def cmp5_partition(files):
+    #
+    # compares one partition for both dark and missing, reading each of the partition files once
+    #
+    #       M = A_M*B_M-R
+    #       D = R-A_D-B_D
+    #
+    a_m_file, a_d_file, r_file, b_m_file, b_d_file = files
+    a_m = set(PartitionedList.open(files=[a_m_file]))
+    m = set()
+    for x in PartitionedList.open(files=[b_m_file]):
+        if x in a_m:
+            m.add(x)
+    del a_m                     # release memory
+    d = set()
+    for x in PartitionedList.open(files=[r_file]):
+        d.add(x)
+        m.discard(x)
+    for x in PartitionedList.open(files=[a_d_file]):
+        d.discard(x)
+    for x in PartitionedList.open(files=[b_d_file]):
+        d.discard(x)
+    return list(d), list(m), None
+
+def cmp5_parallel(a_m_list, a_d_list, r_list, b_m_list, b_d_list, nworkers, fingerprints=False):
+    #
+    # compares partitions in a pool of worker processes
+    # yields (d, m, fingerprint stats) for each partition, in partition order
+    # fingerprint stats is None unless fingerprints=True
+    #
+    lists = (a_m_list, a_d_list, r_list, b_m_list, b_d_list)
+    nparts = r_list.NParts
+    assert all(lst.NParts == nparts for lst in lists), "Inconsistent number of parts: A_M:%d, A_D:%d, R:%d, B_M:%d, B_D:%d" % \
+        tuple(lst.NParts for lst in lists)
+    partitions = list(zip(*[lst.FileNames for lst in lists]))
+    with multiprocessing.Pool(nworkers) as pool:
+        yield from pool.imap(cmp5_partition_fingerprint if fingerprints else cmp5_partition, partitions)
+
+def cmp3_merge_generator(a_list, r_list, b_list, stream=None, tmp_dir=None):
+    #
+    # sort-merge version of cmp3_generator: the lists are compared as a whole, not partition by partition,
+    # so that the output is sorted
+    #
+    # lists in sorted binary format only need to be merged
+    diffs = cmp3_sorted(*[
+        lst.sorted_items() if lst.is_sorted() else external_sort(lst, tmp_dir)
+        for lst in (a_list, r_list, b_list)
+    ])
+    if stream is None:
+        yield from diffs
+    else:
+        yield from (path for t, path in diffs if t == stream)
+
 def cmp3_parts(a_prefix, r_prefix, b_prefix):
     a_list = PartitionedList.open(a_prefix)
     r_list = PartitionedList.open(r_prefix)
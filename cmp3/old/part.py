@@ -1,14 +1,213 @@
 from zlib import adler32
-import gzip, glob
+import gzip, glob, struct, heapq, os
 from py3 import to_bytes, PY3
+from sort_merge import ExternalSort
 
 
 def part(nparts, path):
+        # partition key: adler32 of the stripped UTF-8 path, shared with partitioner.StreamingPartitioner and split.py
         if nparts <= 1: return 0
         if PY3:    path = to_bytes(path)
         #print("part(", nparts, path,"): adler:", adler32(path))
         return adler32(path) % nparts
         
+#
+# Binary partition format, version 1
+#
+#   header:
+#       magic           4 bytes, b"PLST"
+#       version         uint8
+#       flags           uint8, bit 0: paths are sorted and unique
+#       hash name len   uint8
+#       (pad)           1 byte
+#       partition index uint32
+#       nparts          uint32
+#       count           uint64
+#       hash name       ascii
+#
+#   followed by blocks:
+#       entries         uint32
+#       payload size    uint32
+#       payload         entries front-coded relative to the previous path in the block:
+#                           varint shared prefix length, varint suffix length, suffix bytes
+#                       the first entry of each block is stored in full
+#
+# all integers are little-endian
+#
+
+BINARY_EXT = ".plb"
+
+def _encode_varint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _decode_varint(buf, i):
+    n = shift = 0
+    while True:
+        b = buf[i]
+        i += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+class _BinaryPartitionWriter(object):
+    #
+    # Paths are encoded and written a block at a time, so the memory use does not depend on the partition size.
+    # With sort=True, the paths go through ExternalSort first: sorted runs of up to SORT_RUN_SIZE paths are spilled
+    # into temporary files next to the output file and merged in close(). The header is rewritten in close(),
+    # when the number of paths is known.
+    #
+
+    MAGIC = b"PLST"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBBBxIIQ")
+    BLOCK_HEADER = struct.Struct("<II")
+    BLOCK_SIZE = 1024               # entries per block
+    SORT_RUN_SIZE = 100000          # paths kept in memory per partition while sorting
+    FLAG_SORTED = 1
+
+    def __init__(self, path, index, nparts, sort=True, hash_function="adler32", sort_run_size=SORT_RUN_SIZE):
+        self.Path = path
+        self.Index = index
+        self.NParts = nparts
+        self.Sort = sort
+        self.HashFunction = hash_function
+        self.Sorter = ExternalSort(tmp_dir=os.path.dirname(path) or ".", run_size=sort_run_size) if sort else None
+        self.Block = []
+        self.Count = 0
+        self.Closed = False
+        self.F = open(path, "wb")
+        self.write_header()
+
+    def write_header(self):
+        hash_name = self.HashFunction.encode("ascii")
+        self.F.seek(0)
+        self.F.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.FLAG_SORTED if self.Sort else 0, len(hash_name),
+            self.Index, self.NParts, self.Count))
+        self.F.write(hash_name)
+
+    def write(self, line):
+        line = line.strip()
+        if line:
+            if self.Sorter is not None:
+                self.Sorter.add(line)
+            else:
+                self.add_path(line)
+
+    def add_path(self, path):
+        self.Block.append(to_bytes(path))
+        self.Count += 1
+        if len(self.Block) >= self.BLOCK_SIZE:
+            self.write_block()
+
+    def write_block(self):
+        payload = bytearray()
+        prev = b""
+        for path in self.Block:
+            n = 0
+            for n, (x, y) in enumerate(zip(prev, path)):
+                if x != y:  break
+            else:
+                n = min(len(prev), len(path))
+            _encode_varint(n, payload)
+            _encode_varint(len(path) - n, payload)
+            payload += path[n:]
+            prev = path
+        self.F.write(self.BLOCK_HEADER.pack(len(self.Block), len(payload)))
+        self.F.write(payload)
+        self.Block = []
+
+    def close(self):
+        if self.Closed:
+            return
+        self.Closed = True
+        if self.Sorter is not None:
+            for path in self.Sorter.sorted():          # sorted and unique
+                self.add_path(path)
+            self.Sorter = None
+        if self.Block:
+            self.write_block()
+        self.write_header()
+        self.F.close()
+
+class _BinaryPartitionReader(object):
+
+    def __init__(self, path):
+        self.Path = path
+        self.F = open(path, "rb")
+        header = self.F.read(_BinaryPartitionWriter.HEADER.size)
+        magic, version, flags, hash_len, self.Index, self.NParts, self.Count = _BinaryPartitionWriter.HEADER.unpack(header)
+        if magic != _BinaryPartitionWriter.MAGIC:
+            raise ValueError("Not a binary partition file: %s" % (path,))
+        if version > _BinaryPartitionWriter.VERSION:
+            raise ValueError("Unsupported binary partition format version %d in %s" % (version, path))
+        self.Version = version
+        self.Sorted = bool(flags & _BinaryPartitionWriter.FLAG_SORTED)
+        self.HashFunction = self.F.read(hash_len).decode("ascii")
+        self.DataOffset = self.F.tell()
+        self.Block = []
+        self.BlockIndex = 0
+
+    @staticmethod
+    def is_binary(path):
+        return path.endswith(BINARY_EXT)
+
+    def read_block(self):
+        header = self.F.read(_BinaryPartitionWriter.BLOCK_HEADER.size)
+        if not header:
+            return None
+        n, size = _BinaryPartitionWriter.BLOCK_HEADER.unpack(header)
+        payload = self.F.read(size)
+        paths = []
+        prev = b""
+        i = 0
+        for _ in range(n):
+            shared, i = _decode_varint(payload, i)
+            length, i = _decode_varint(payload, i)
+            prev = prev[:shared] + payload[i:i+length]
+            i += length
+            paths.append(prev.decode("utf-8"))
+        return paths
+
+    def paths(self):
+        while True:
+            if self.BlockIndex >= len(self.Block):
+                self.Block = self.read_block()
+                self.BlockIndex = 0
+                if not self.Block:
+                    self.Block = []
+                    return
+            path = self.Block[self.BlockIndex]
+            self.BlockIndex += 1
+            yield path
+
+    def __iter__(self):
+        return self.paths()
+
+    # file-like interface, used by PartitionedList and _Partition
+
+    def readline(self):
+        if self.BlockIndex >= len(self.Block):
+            self.Block = self.read_block() or []
+            self.BlockIndex = 0
+            if not self.Block:
+                return ""
+        path = self.Block[self.BlockIndex]
+        self.BlockIndex += 1
+        return path + "\n"
+
+    def seek(self, offset, whence=0):
+        assert offset == 0 and whence == 0, "Binary partition can only be rewound"
+        self.F.seek(self.DataOffset, 0)
+        self.Block = []
+        self.BlockIndex = 0
+
+    def close(self):
+        self.F.close()
+
 class _Partition(object):
     
     def __init__(self, f, path):
@@ -29,7 +228,7 @@ class _Partition(object):
         
 class PartitionedList(object):
     
-    def __init__(self, mode, filenames, compressed=False):
+    def __init__(self, mode, filenames, compressed=False, binary=False):
         #
         # mode: "r" or "w"
         #
@@ -38,11 +237,19 @@ class PartitionedList(object):
         self.Files = []
         self.NParts = len(filenames)
         self.Compressed = compressed
+        self.Binary = binary
         
         if mode == "w":
-            self.Files = [open(fn, "w") if not compressed else gzip.open(fn, "wt") for fn in self.FileNames]
+            if binary:
+                self.Files = [_BinaryPartitionWriter(fn, i, self.NParts) for i, fn in enumerate(self.FileNames)]
+            else:
+                self.Files = [open(fn, "w") if not compressed else gzip.open(fn, "wt") for fn in self.FileNames]
         else:
-            self.Files = [open(fn, "r") if not fn.endswith(".gz") else gzip.open(fn, "rt") for fn in self.FileNames]
+            self.Files = [
+                _BinaryPartitionReader(fn) if _BinaryPartitionReader.is_binary(fn)
+                    else (open(fn, "r") if not fn.endswith(".gz") else gzip.open(fn, "rt")) 
+                for fn in self.FileNames
+            ]
             
         self.NWritten = 0
             
@@ -54,18 +261,22 @@ class PartitionedList(object):
         return PartitionedList("r", files)
         
     @staticmethod
-    def create(nparts, prefix, compressed=False):
+    def create(nparts, prefix, compressed=False, binary=False):
         # create new set
-        gz = ".gz" if compressed else ""
-        files = ["%s.%05d%s" % (prefix, i, gz) for i in range(nparts)]
-        return PartitionedList("w", files, compressed)
+        # binary: use sorted, front-coded binary format, compressed is ignored
+        ext = BINARY_EXT if binary else (".gz" if compressed else "")
+        files = ["%s.%05d%s" % (prefix, i, ext) for i in range(nparts)]
+        return PartitionedList("w", files, compressed, binary)
         
     @staticmethod
-    def create_file(path, compressed=False):
+    def create_file(path, compressed=False, binary=False):
         # create a single file set
-        if compressed and not path.endswith(".gz"):
+        if binary:
+            if not path.endswith(BINARY_EXT):
+                path = path + BINARY_EXT
+        elif compressed and not path.endswith(".gz"):
             path = path + ".gz"
-        return PartitionedList("w", [path], compressed)
+        return PartitionedList("w", [path], compressed, binary)
         
     def add(self, item):
         if self.Mode != "w":    raise ValueError("The list is not open for writing")
@@ -83,6 +294,15 @@ class PartitionedList(object):
     def partitions(self):
         return [_Partition(f, path) for f, path in zip(self.Files, self.FileNames)]
         
+    def is_sorted(self):
+        # True if each partition is sorted and has no duplicates, i.e. all partitions are in sorted binary format
+        return self.Mode == "r" and all(isinstance(f, _BinaryPartitionReader) and f.Sorted for f in self.Files)
+
+    def sorted_items(self):
+        # merges sorted partitions, does not sort
+        assert self.is_sorted()
+        yield from heapq.merge(*[f.paths() for f in self.Files])
+
     def items(self):
         assert self.Mode == "r"
         for f in self.Files:
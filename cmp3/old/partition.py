@@ -17,11 +17,12 @@ Optional:
             -r <rse> - RSE name - to use RSE-specific configuration, ignored if -c is not used
             -n <nparts> - override the value from the <config file>
             -z - use gzip compression for output
+            -b - use sorted front-coded binary format for output
 """
 
 
 def main():
-    opts, args = getopt.getopt(sys.argv[1:], "n:o:c:qr:z")
+    opts, args = getopt.getopt(sys.argv[1:], "n:o:c:qr:zb")
     opts = dict(opts)
     if not args or not ("-o" in opts):
         print(Usage)
@@ -38,6 +39,7 @@ def main():
         ignore_list = config.IgnoreList
         nparts = config.NPartitions
     zout = "-z" in opts
+    bout = "-b" in opts
     nparts = int(opts.get("-n", nparts))
     
     if nparts is None:
@@ -46,7 +48,7 @@ def main():
         sys.exit(2)
     
     in_lst = PartitionedList.open(files=args)
-    out_lst = PartitionedList.create(nparts, out_prefix, zout)
+    out_lst = PartitionedList.create(nparts, out_prefix, zout, bout)
 
     #print("ignore list:", ignore_list)
     
@@ -0,0 +1,101 @@
+import gzip, sys, os
+from zlib import adler32
+from list_reader import read_lines
+
+#
+# Streaming partitioner.
+#
+# Reads plain or gzipped path lists in large binary chunks and splits them into lines without
+# decoding them. Lines are assigned to partitions by adler32 hash of the stripped path, the same
+# way PartitionedList does it, so the output is compatible with PartitionedList.open().
+# The hashes of a chunk are computed with map(adler32, lines), so the per-line loop runs in C.
+# The standard library has no vectorised adler32, and the partition assignment has to stay
+# compatible with PartitionedList, so the hash function is not changed.
+#
+# Each input is read once: split() fans the lines out into per-partition files, spill() does the same
+# into compressed temporary files which can be handed to the comparison one partition at a time.
+#
+
+class StreamingPartitioner(object):
+
+    CHUNK_SIZE = 16*1024*1024           # input read size
+    BUFFER_SIZE = 1024*1024             # output buffer size per partition
+
+    def __init__(self, nparts, chunk_size=CHUNK_SIZE):
+        self.NParts = nparts
+        self.ChunkSize = chunk_size
+
+    @staticmethod
+    def open_input(path):
+        if path == "-":
+            return sys.stdin.buffer
+        elif path.endswith(".gz"):
+            return gzip.open(path, "rb")
+        else:
+            return open(path, "rb")
+
+    def chunks(self, path):
+        # yields lists of stripped non-empty lines as bytes
+        f = self.open_input(path)
+        try:
+            tail = b""
+            while True:
+                data = f.read(self.ChunkSize)
+                if not data:
+                    break
+                lines = (tail + data).split(b"\n")
+                tail = lines.pop()
+                yield [l for l in (line.strip() for line in lines) if l]
+            tail = tail.strip()
+            if tail:
+                yield [tail]
+        finally:
+            if f is not sys.stdin.buffer:
+                f.close()
+
+    def split_chunk(self, lines):
+        # returns list of lists of lines, one per partition
+        n = self.NParts
+        parts = [[] for _ in range(n)]
+        if n <= 1:
+            parts[0] = lines
+        else:
+            for line, h in zip(lines, map(adler32, lines)):
+                parts[h % n].append(line)
+        return parts
+
+    def split(self, path, part_names, compressed=False, compresslevel=9):
+        #
+        # writes partitions into files
+        # returns number of lines written
+        #
+        assert len(part_names) == self.NParts
+        if compressed:
+            outputs = [gzip.open(fn, "wb", compresslevel=compresslevel) for fn in part_names]
+        else:
+            outputs = [open(fn, "wb", buffering=self.BUFFER_SIZE) for fn in part_names]
+        n = 0
+        try:
+            for lines in self.chunks(path):
+                for out, part in zip(outputs, self.split_chunk(lines)):
+                    if part:
+                        out.write(b"\n".join(part) + b"\n")
+                n += len(lines)
+        finally:
+            for out in outputs:
+                out.close()
+        return n
+
+    def spill(self, path, tempdir, prefix):
+        #
+        # one pass over the input, each partition goes into a fast-compressed spill file in tempdir
+        # returns list of spill file names, read them with read_part()
+        #
+        part_names = ["%s/%s.%05d.gz" % (tempdir, prefix, i) for i in range(self.NParts)]
+        self.split(path, part_names, compressed=True, compresslevel=1)
+        return part_names
+
+    @staticmethod
+    def read_part(part_name):
+        # yields stripped lines of a spilled partition as strings
+        return read_lines(part_name)
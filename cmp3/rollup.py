@@ -0,0 +1,126 @@
+import sys, os, time, getopt, json
+from run import RunHistory
+from stats import Stats
+
+Version = "1.0"
+
+Usage = """
+python rollup.py [options] <storage path> <RSE> [<run id>]
+    -d <depth>,...          - directory depths to aggregate at, default: 2,3,4
+                              e.g. depth 4 for /store/mc/<campaign>/<dataset>
+    -n <max dirs>           - keep only so many directories with most files per depth, default: 1000
+    -u                      - update run stats in place
+    -s <JSON file>          - save summary into JSON stats file
+    -S                      - section key for the stats file, used with -s or -u. Default: "rollup"
+
+Writes per-directory counts of dark and missing files into <storage path>/<RSE>_<run id>_rollup.json
+"""
+
+DEFAULT_DEPTHS = (2, 3, 4)
+MAX_DIRS = 1000
+
+ListTypes = {
+    "dark":             "D",
+    "missing":          "M"
+}
+
+def directory(path, depth):
+    # returns the directory containing the path, truncated to <depth> components
+    items = [item for item in path.split("/") if item]
+    return "/" + "/".join(items[:min(depth, len(items)-1)])
+
+def rollup(paths, depths, max_dirs=MAX_DIRS):
+    #
+    # returns {"total": n, "depths": {depth: {"directories": n, "counts": [[dir, count], ...]}}}
+    # counts are sorted by count, descending, and truncated to max_dirs
+    #
+    counts = {depth: {} for depth in depths}
+    total = 0
+    for path in paths:
+        total += 1
+        for depth, depth_counts in counts.items():
+            d = directory(path, depth)
+            depth_counts[d] = depth_counts.get(d, 0) + 1
+    out = {}
+    for depth, depth_counts in counts.items():
+        top = sorted(depth_counts.items(), key=lambda x: (-x[1], x[0]))
+        out[str(depth)] = {
+            "directories":  len(depth_counts),
+            "counts":       [[d, n] for d, n in top[:max_dirs]]
+        }
+    return {"total": total, "depths": out}
+
+def rollup_path(storage_path, rse, run_id):
+    return f"{storage_path}/{rse}_{run_id}_rollup.json"
+
+def write_rollup(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], "d:n:s:S:u")
+    opts = dict(opts)
+
+    if len(args) < 2:
+        print(Usage)
+        sys.exit(2)
+
+    depths = DEFAULT_DEPTHS
+    if "-d" in opts:
+        depths = sorted(int(d) for d in opts["-d"].split(","))
+    max_dirs = int(opts.get("-n", MAX_DIRS))
+    section_key = opts.get("-S", "rollup")
+
+    path, rse = args[0], args[1]
+    history = RunHistory.get(path, rse)
+    if len(args) > 2:
+        run = history.run(args[2])
+    else:
+        run = history.last()
+
+    if run is None or not run.is_complete():
+        print("Run not found or incomplete", file=sys.stderr)
+        sys.exit(1)
+
+    t0 = time.time()
+    data = dict(
+        version=Version,
+        rse=rse,
+        run=run.Run,
+        depths=list(depths),
+        max_dirs=max_dirs
+    )
+    for name, typ in ListTypes.items():
+        if run.list_exists(typ):
+            data[name] = rollup(run.list_iterator(typ), depths, max_dirs)
+        else:
+            data[name] = None
+    t1 = time.time()
+    data["elapsed"] = t1 - t0
+    data["end_time"] = t1
+
+    out_path = rollup_path(path, rse, run.Run)
+    write_rollup(out_path, data)
+
+    summary = dict(
+        version=Version,
+        status="done",
+        start_time=t0,
+        end_time=t1,
+        elapsed=t1-t0,
+        depths=list(depths),
+        rollup_file=out_path.rsplit("/", 1)[-1]
+    )
+
+    if "-u" in opts:
+        stats = Stats(run.stats_path())
+        stats.update_section(section_key, summary)
+
+    if "-s" in opts:
+        stats = Stats(opts["-s"])
+        stats.update_section(section_key, summary)
+
+if __name__ == "__main__":
+    main()
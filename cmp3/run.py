@@ -1,17 +1,41 @@
-import glob, re, sys, os, json, os.path, gzip
+import glob, re, sys, os, json, os.path, gzip, sqlite3, bisect, functools
 from datetime import datetime, timedelta
+from stats_log import read_stats
+from list_reader import find_list, read_lines
 
 class FileNotFoundException(Exception):
     pass
 
+def memoized(method):
+    # caches the method result per CCRun object and arguments. Exceptions are not cached
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        key = (method.__name__,) + args
+        try:
+            return self.Memo[key]
+        except KeyError:
+            value = self.Memo[key] = method(self, *args)
+            return value
+    return wrapper
+
 class CCRun(object):
-    def __init__(self, dir_path, rse, run):
+    def __init__(self, dir_path, rse, run, history=None):
+        # the stats file is read on first access to self.Stats
         self.Path = dir_path
         self.Run = run
         self.RSE = rse
         self.Timestamp = CCRun.parse_run(run)
-        self.Stats = CCRun.get_stats(dir_path, rse, run)
+        self.History = history
+        self.Memo = {}
+        self._Stats = None
+
+    @property
+    def Stats(self):
+        if self._Stats is None:
+            self._Stats = CCRun.get_stats(self.Path, self.RSE, self.Run)
+        return self._Stats
 
+    @memoized
     def is_complete(self):
         return self.Stats.get("cmp3", {}).get("status") == "done"
         
@@ -42,9 +66,11 @@ class CCRun(object):
     def dbdump_file_count(self, before_or_after):
         return self.Stats.get("dbdump_" + before_or_after, {}).get("files")
 
+    @memoized
     def empty_directories_collected(self):
         return not not self.Stats.get("scanner", {}).get("empty_dirs_output_file")
 
+    @memoized
     def empty_directory_count(self):
         roots = self.Stats.get("scanner", {}).get("roots", [])
         total = None
@@ -55,6 +81,7 @@ class CCRun(object):
                     total = (total or 0) + n
         return total
 
+    @memoized
     def scanner_num_files(self):
         scanner_stats = self.Stats["scanner"]
         nfiles = scanner_stats.get("total_files") or sum(root_stats.get("files", 0) for root_stats in scanner_stats.get("roots", []))
@@ -87,6 +114,11 @@ class CCRun(object):
 
     @staticmethod
     def rses(dir_path):
+        catalog = CCRun.catalog(dir_path)
+        if catalog is not None:
+            try:    yield from catalog.rses()
+            finally:    catalog.close()
+            return
         seen = set()
         for path in glob.glob(f"{dir_path}/*_stats.json"):
             filename = path.rsplit("/", 1)[-1]
@@ -97,7 +129,21 @@ class CCRun(object):
                     yield rse
 
     @staticmethod
-    def run_ids_for_rse(dir_path, rse):
+    def catalog(dir_path):
+        # returns read-only Catalog if the directory has one, otherwise None.
+        # The catalog is synchronized by the driver scripts ("catalog.py sync"), not here
+        try:
+            from catalog import Catalog
+            return Catalog.open(dir_path, sync=False)
+        except (ImportError, ValueError, sqlite3.Error):
+            return None
+
+    @staticmethod
+    def run_ids_for_rse(dir_path, rse, complete_only=False):
+        catalog = CCRun.catalog(dir_path)
+        if catalog is not None:
+            try:    return catalog.run_ids(rse, complete_only=complete_only)
+            finally:    catalog.close()
         files = glob.glob(f"{dir_path}/{rse}_*_stats.json")
         runs = []
         for path in files:
@@ -112,64 +158,57 @@ class CCRun(object):
         
     @staticmethod
     def last_run_for_rse(dir_path, rse):
-        run_ids = CCRun.run_ids_for_rse(dir_path, rse)
-        if not run_ids:
-            return None
-        else:
-            return CCRun(dir_path, rse, run_ids[-1])
+        return RunHistory.get(dir_path, rse).last()
             
     @staticmethod
     def runs_for_rse(dir_path, rse, complete_only=True):
-        runs = (CCRun(dir_path, rse, run_id) for run_id in CCRun.run_ids_for_rse(dir_path, rse))
-        if complete_only:
-            runs = (run for run in runs if run.is_complete())
-        return runs
+        return RunHistory.get(dir_path, rse).runs(complete_only)
         
     def stats_path(self):
         return f"{self.Path}/{self.RSE}_{self.Run}_stats.json"
             
     @staticmethod
     def get_stats(dir_path, rse, run):
+        # the stats file with the pending events from the stats log folded in
         path = f"{dir_path}/{rse}_{run}_stats.json"
-        stats = json.load(open(path, "r"))
+        stats = read_stats(path)
+        if stats is None:
+            raise FileNotFoundError(path)
         return stats
         
+    def history(self):
+        if self.History is None:
+            self.History = RunHistory.get(self.Path, self.RSE)
+        return self.History
+
     def previous_run(self):
-        run_ids = CCRun.run_ids_for_rse(self.Path, self.RSE)
-        my_index = run_ids.index(self.Run)
-        if my_index == 0:
-            return None     # no previous run
-        else:
-            return CCRun(self.Path, self.RSE, run_ids[my_index-1])
+        return self.history().previous(self.Run)
+
+    def next_run(self):
+        return self.history().next(self.Run)
     
+    def list_path(self, typ):
+        # returns path to the list file, plain or gzipped, or None if not found
+        return find_list(f"{self.Path}/{self.RSE}_{self.Run}_{typ}.list")
+
     def list_lines(self, typ):
-        path = f"{self.Path}/{self.RSE}_{self.Run}_{typ}.list"
-        gzipped_path = path + ".gz"
-        if os.path.isfile(path):
-            f = open(path, "r")
-        elif os.path.isfile(gzipped_path):
-            f = gzip.open(gzipped_path, "rt")
-        else:
-            raise RuntimeError("File not found: %s, %s" % (path, gzipped_path))
-        for line in f:
-            line = line.strip()
-            if line:
-                yield line
+        path = self.list_path(typ)
+        if path is None:
+            path = f"{self.Path}/{self.RSE}_{self.Run}_{typ}.list"
+            raise RuntimeError("File not found: %s, %s" % (path, path + ".gz"))
+        yield from read_lines(path)
                 
-    def list_iterator(self, typ):
-        path = f"{self.Path}/{self.RSE}_{self.Run}_{typ}.list"
-        gzipped_path = path + ".gz"
-        if os.path.isfile(path):
-            f = open(path, "r")
-        elif os.path.isfile(gzipped_path):
-            f = gzip.open(gzipped_path, "rt")
-        else:
-            raise FileNotFoundException("File not found: %s, %s" % (path, gzipped_path))
-        return (l for l in (line.strip() for line in f) if l)
+    def list_iterator(self, typ, as_bytes=False):
+        # returns generator of lines, the file is closed when the generator is exhausted or discarded
+        path = self.list_path(typ)
+        if path is None:
+            path = f"{self.Path}/{self.RSE}_{self.Run}_{typ}.list"
+            raise FileNotFoundException("File not found: %s, %s" % (path, path + ".gz"))
+        return read_lines(path, as_bytes)
 
+    @memoized
     def list_exists(self, typ):
-        path = f"{self.Path}/{self.RSE}_{self.Run}_{typ}.list"
-        return os.path.isfile(path) or os.path.isfile(path + ".gz")
+        return self.list_path(typ) is not None
 
     def missing_files(self):
         yield from self.list_iterator("M")
@@ -189,6 +228,102 @@ class CCRun(object):
     def confirmed_empty_directories(self):
         yield from self.list_lines("ED_action")
 
+class RunHistory(object):
+    #
+    # All runs for one RSE in one directory. The run ids are listed once, CCRun objects are created on demand
+    # and shared, so that the stats file of each run is read at most once and the values derived from it
+    # are computed once. RunHistory.get() returns the same object for the same (directory, RSE) within
+    # the process.
+    #
+
+    Histories = {}          # {(dir_path, rse) -> RunHistory}
+
+    def __init__(self, dir_path, rse):
+        self.Path = dir_path
+        self.RSE = rse
+        self.CompleteIds = None             # set of run ids known to be complete from the catalog.
+                                            # A run missing from it may have completed after the last catalog sync,
+                                            # so its stats file is checked
+        catalog = CCRun.catalog(dir_path)
+        if catalog is not None:
+            try:
+                self.RunIds = catalog.run_ids(rse)
+                self.CompleteIds = set(catalog.run_ids(rse, complete_only=True))
+            finally:
+                catalog.close()
+        else:
+            self.RunIds = CCRun.run_ids_for_rse(dir_path, rse)
+        self.Index = {run_id: i for i, run_id in enumerate(self.RunIds)}
+        self.Runs = {}                      # {run_id -> CCRun}
+
+    @staticmethod
+    def get(dir_path, rse, refresh=False):
+        key = (dir_path, rse)
+        history = RunHistory.Histories.get(key)
+        if history is None or refresh:
+            history = RunHistory.Histories[key] = RunHistory(dir_path, rse)
+        return history
+
+    def __len__(self):
+        return len(self.RunIds)
+
+    def __iter__(self):
+        return (self.run(run_id) for run_id in self.RunIds)
+
+    def run(self, run_id):
+        # returns CCRun or None if the run is not in the history and has no stats file
+        run = self.Runs.get(run_id)
+        if run is None:
+            if run_id not in self.Index and not self.add_run_id(run_id):
+                return None
+            run = self.Runs[run_id] = CCRun(self.Path, self.RSE, run_id, self)
+        return run
+
+    def add_run_id(self, run_id):
+        # adds a run which was not listed when the history was created, e.g. a run started after the last
+        # catalog sync, if its stats file exists. Returns True if the run was added
+        try:
+            CCRun.parse_run(run_id)
+            if os.stat(f"{self.Path}/{self.RSE}_{run_id}_stats.json").st_size == 0:
+                return False
+        except (ValueError, OSError):
+            return False
+        bisect.insort(self.RunIds, run_id)
+        self.Index = {run_id: i for i, run_id in enumerate(self.RunIds)}
+        return True
+
+    def is_complete(self, run):
+        # complete runs do not become incomplete, so the catalog is trusted only when it says the run is complete
+        return (self.CompleteIds is not None and run.Run in self.CompleteIds) or run.is_complete()
+
+    def runs(self, complete_only=False):
+        # returns list of CCRun objects in chronological order
+        runs = [self.run(run_id) for run_id in self.RunIds]
+        if complete_only:
+            runs = [run for run in runs if self.is_complete(run)]
+        return runs
+
+    def last(self, complete_only=False):
+        if not complete_only:
+            return self.run(self.RunIds[-1]) if self.RunIds else None
+        for run_id in self.RunIds[::-1]:
+            run = self.run(run_id)
+            if self.is_complete(run):
+                return run
+        return None
+
+    def previous(self, run_id):
+        i = self.Index.get(run_id)
+        if i is None:
+            i = bisect.bisect_left(self.RunIds, run_id)         # the run is not in the history, e.g. empty stats file
+        return self.run(self.RunIds[i-1]) if i > 0 else None
+
+    def next(self, run_id):
+        i = self.Index.get(run_id)
+        if i is None:
+            i = bisect.bisect_left(self.RunIds, run_id) - 1
+        return self.run(self.RunIds[i+1]) if i + 1 < len(self.RunIds) else None
+
 if __name__ == "__main__":
     import sys
     
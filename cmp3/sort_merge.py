@@ -0,0 +1,146 @@
+import os, heapq, tempfile, itertools
+
+#
+# Sort-merge comparison engine.
+#
+# Instead of loading whole partitions into Python sets, each list is externally sorted
+# (sorted runs of bounded size are spilled to temporary files and then merged) and
+# the sorted lists are compared in a single k-way merge pass. Memory use is bounded by
+# the run size, regardless of the list size, and the output comes out sorted.
+#
+
+class ExternalSort(object):
+
+    RUN_SIZE = 1000000           # max number of items kept in memory at once
+
+    def __init__(self, items=None, tmp_dir=None, run_size=RUN_SIZE, unique=True):
+        #
+        # items: iterable of strings, without trailing newlines. More items can be added with add()
+        #
+        self.Items = items
+        self.TmpDir = tmp_dir
+        self.RunSize = run_size
+        self.Unique = unique
+        self.RunFiles = []
+        self.Buffer = []
+
+    def add(self, item):
+        self.Buffer.append(item)
+        if len(self.Buffer) >= self.RunSize:
+            self.write_run(self.Buffer)
+            self.Buffer = []
+
+    def write_run(self, buf):
+        buf.sort()
+        fd, path = tempfile.mkstemp(prefix="sort_run_", suffix=".tmp", dir=self.TmpDir)
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(buf))
+            f.write("\n")
+        self.RunFiles.append(path)
+
+    def read_run(self, path):
+        with open(path, "r") as f:
+            for line in f:
+                yield line[:-1]
+
+    def cleanup(self):
+        for path in self.RunFiles:
+            try:    os.remove(path)
+            except OSError: pass
+        self.RunFiles = []
+
+    def sorted(self):
+        try:
+            if self.Items is not None:
+                for item in self.Items:
+                    self.add(item)
+            buf, self.Buffer = self.Buffer, []
+            if not self.RunFiles:
+                # everything fits in memory
+                buf.sort()
+                merged = iter(buf)
+            else:
+                if buf:
+                    self.write_run(buf)
+                    buf = []
+                merged = heapq.merge(*[self.read_run(path) for path in self.RunFiles])
+            if self.Unique:
+                last = None
+                for item in merged:
+                    if item != last:
+                        yield item
+                        last = item
+            else:
+                yield from merged
+        finally:
+            self.cleanup()
+
+    def __iter__(self):
+        return self.sorted()
+
+def external_sort(items, tmp_dir=None, run_size=ExternalSort.RUN_SIZE, unique=True):
+    return ExternalSort(items, tmp_dir, run_size, unique).sorted()
+
+def tag_stream(stream, tag):
+    for item in stream:
+        yield item, tag
+
+def multi_merge(streams):
+    #
+    # streams: list of iterables, each sorted and without duplicates
+    # yields (item, [stream index, ...]) for every distinct item, in sorted order
+    #
+    tagged = [tag_stream(stream, i) for i, stream in enumerate(streams)]
+    for item, group in itertools.groupby(heapq.merge(*tagged), key=lambda x: x[0]):
+        yield item, [i for _, i in group]
+
+def multi_intersect(streams, dropped=None):
+    #
+    # streams: list of iterables, each sorted and without duplicates
+    # yields items present in all the streams, in sorted order
+    # dropped: optional list of len(streams) counters. For every item of streams[0] which is
+    #       not present in all the streams, dropped[j] is incremented, where j is the first stream missing it
+    #
+    n = len(streams)
+    for item, where in multi_merge(streams):
+        if len(where) == n:
+            yield item
+        elif dropped is not None and where[0] == 0:
+            j = len(where)
+            for k, i in enumerate(where):
+                if k != i:
+                    j = k
+                    break
+            dropped[j] += 1
+
+def cmp3_sorted(a, r, b):
+    #
+    # a, r, b: sorted iterables without duplicates
+    # yields ('d', path) and ('m', path) tuples in sorted path order:
+    #
+    #       D = R-A-B
+    #       M = A*B-R
+    #
+    A, R, B = 0, 1, 2
+    for path, where in multi_merge([a, r, b]):
+        if where == [R]:
+            yield 'd', path
+        elif where == [A, B]:
+            yield 'm', path
+
+def cmp3_merge(a, r, b, tmp_dir=None, run_size=ExternalSort.RUN_SIZE):
+    #
+    # a, r, b: iterables of paths in any order
+    # returns sorted dark and missing lists
+    #
+    d, m = [], []
+    for t, path in cmp3_sorted(
+                external_sort(a, tmp_dir, run_size),
+                external_sort(r, tmp_dir, run_size),
+                external_sort(b, tmp_dir, run_size)
+            ):
+        if t == 'd':
+            d.append(path)
+        else:
+            m.append(path)
+    return d, m
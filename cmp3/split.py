@@ -1,26 +1,34 @@
-import random, string, sys, getopt, os, zlib
-
-py3 = sys.version_info >= (3,)
+import sys
+from partitioner import StreamingPartitioner
 
 Usage = """
-python split.py <input file> <n parts>
+python split.py [-z] [-v] <input file> <n parts>
+	-z - compress output parts
+	-v - print number of lines written to stderr
+	<input file> can be gzipped (*.gz) or "-" for stdin
+
+	A line goes to part adler32(<stripped line>) % <n parts>, the same as with PartitionedList
 """
 
-if len(sys.argv[1:]) < 2:
-	print(Usage)
-	sys.exit(2)
+if __name__ == "__main__":
+	import getopt
+
+	opts, args = getopt.getopt(sys.argv[1:], "zv")
+	opts = dict(opts)
 
-input_file = sys.argv[1]
-nparts = int(sys.argv[2])
+	if len(args) < 2:
+		print(Usage)
+		sys.exit(2)
 
-part_names = ["%s.%03d" % (input_file, i) for i in range(nparts)]
-parts = [open(fn, "w") for fn in part_names]
+	input_file = args[0]
+	nparts = int(args[1])
+	compressed = "-z" in opts
 
-in_file = open(input_file, "r")
-l = in_file.readline()
-while l:
-	i = zlib.adler32(bytes(l, "utf-8") if py3 else l) % nparts
-	parts[i].write(l)			# this will include training '\n'
-	l = in_file.readline()
+	prefix = "stdin" if input_file == "-" else input_file
+	if prefix.endswith(".gz"):
+		prefix = prefix[:-3]
+	part_names = ["%s.%03d%s" % (prefix, i, ".gz" if compressed else "") for i in range(nparts)]
 
-[part.close() for part in parts]
+	n = StreamingPartitioner(nparts).split(input_file, part_names, compressed)
+	if "-v" in opts:
+		print(n, file=sys.stderr)
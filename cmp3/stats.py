@@ -1,17 +1,72 @@
-import json, os.path, traceback, copy
+import json, os, os.path, traceback, copy, time, threading, atexit, fcntl
+from contextlib import contextmanager
+
+#
+# Stats files are read by the monitor while they are being updated, and different stages of a run may update
+# different sections of the same file concurrently. To make this safe:
+#   - the file is always written to a temporary file in the same directory and then renamed over the original,
+#     so a reader sees either the old or the new version, never a truncated file
+#   - the read-merge-write cycle is done under an exclusive lock on <path>.lock, and the pending events
+#     from the stats event log (see stats_log.py) are folded in first
+#   - only the sections modified by this Stats object are merged into the file, the others are left as they are
+#   - updates are coalesced: the file is written at most once per flush interval, the pending updates
+#     are flushed at exit. A section whose "status" becomes final (done, failed, ...) is flushed immediately,
+#     so that the final status is not lost if the process is killed by a signal before the deferred write
+#
+
+def atomic_write_json(path, data, indent=None):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=indent)
+        os.replace(tmp, path)
+    except:
+        try:    os.unlink(tmp)
+        except OSError: pass
+        raise
+
+@contextmanager
+def locked(path):
+    # exclusive lock on <path>.lock, held across the read-merge-write cycle
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def read_json(path, default=None):
+    try:
+        with open(path, "r") as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = ""
+    return json.loads(data) if data else default
 
 class Stats(object):
+
+    FLUSH_INTERVAL = 1.0            # seconds, 0 - write on every update
+    FinalStatuses = {"done", "failed", "aborted", "disabled"}
     
-    def __init__(self, path):
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
         self.Path = path
         self.Data = {}
+        self.Dirty = set()          # top level keys modified since last flush
+        self.FlushInterval = flush_interval
+        self.LastFlush = 0
+        self.Timer = None
+        self.Lock = threading.RLock()
+        self.AtExit = False
+        self.FlushedStatus = {}     # {section -> status written by the last flush}
         
     def __getitem__(self, name):
         return self.Data[name]
         
     def overwrite(self, key, value):
-        self.Data[key] = value
-        self.save()
+        with self.Lock:
+            self.Data[key] = value
+            self.Dirty.add(key)
+            self.save()
         
     __setitem__ = overwrite
     
@@ -19,11 +74,14 @@ class Stats(object):
         return self.Data.get(name, default)
         
     def setdefault(self, name, value):
-        if name in self.Data:
-            d = self.Data[name]
-        else:
-            self.Data[name] = value
-            d = value
+        # the returned value may be modified by the caller before calling save()
+        with self.Lock:
+            if name in self.Data:
+                d = self.Data[name]
+            else:
+                self.Data[name] = value
+                d = value
+            self.Dirty.add(name)
         return d
     
     def __update_deep(self, data, update):
@@ -47,54 +105,117 @@ class Stats(object):
     def update(self, __update=None, **kw):
         if __update is None:    __update = kw
         assert isinstance(__update, dict)
-        self.__update_deep(self.Data, __update)
-        self.save()        
+        with self.Lock:
+            self.__update_deep(self.Data, __update)
+            self.Dirty.update(__update.keys())
+            self.save()        
 
     def update_section(self, section, __update=None, **kw):
         if __update is None:    __update = kw
         assert isinstance(__update, dict)
-        self.__update_deep(self.Data.setdefault(section, {}), __update)
-        self.save()
+        with self.Lock:
+            self.__update_deep(self.Data.setdefault(section, {}), __update)
+            self.Dirty.add(section)
+            self.save()
         
     def save(self):
-        try:
-            with open(self.Path, "r") as f:
-                data = f.read()
-        except:
-            #traceback.print_exc()
-            data = ""
-        #print("data:", data)
-        data = json.loads(data or "{}")
-        data.update(self.Data)
-        open(self.Path, "w").write(json.dumps(data, indent=4))
+        # writes the file now or schedules the write within the flush interval
+        with self.Lock:
+            if not self.AtExit:
+                atexit.register(self.flush)
+                self.AtExit = True
+            delay = self.LastFlush + self.FlushInterval - time.time()
+            if delay <= 0 or self.final_status_changed():
+                self.flush()
+            elif self.Timer is None:
+                self.Timer = threading.Timer(delay, self.flush)
+                self.Timer.daemon = True
+                self.Timer.start()
+
+    def section_status(self, key):
+        section = self.Data.get(key)
+        return section.get("status") if isinstance(section, dict) else None
+
+    def final_status_changed(self):
+        for key in self.Dirty:
+            status = self.section_status(key)
+            if status in self.FinalStatuses and status != self.FlushedStatus.get(key):
+                return True
+        return False
+
+    def flush(self):
+        with self.Lock:
+            if self.Timer is not None:
+                self.Timer.cancel()
+                self.Timer = None
+            if not self.Dirty:
+                return
+            def merge(data):
+                for key in self.Dirty:
+                    if key in self.Data:
+                        data[key] = self.Data[key]
+            from stats_log import compact
+            compact(self.Path, merge, indent=4)
+            for key in self.Dirty:
+                self.FlushedStatus[key] = self.section_status(key)
+            self.Dirty = set()
+            self.LastFlush = time.time()
 
 
 def write_stats(my_stats, stats_file, stats_key = None):
     if stats_file:
-        stats = {}
-        if os.path.isfile(stats_file):    
-            with open(stats_file, "r") as f:
-                stats = json.loads(f.read())
-        if stats_key:
-            stats[stats_key] = my_stats
-        else:
-            stats.update(my_stats)
-        open(stats_file, "w").write(json.dumps(stats))
+        def merge(stats):
+            if stats_key:
+                stats[stats_key] = my_stats
+            else:
+                stats.update(my_stats)
+        from stats_log import compact
+        compact(stats_file, merge, indent=4)
 
 Usage = """
 python [-k <key>] [-u <update JSON file>] [-j "<inline JSON expression>"] [-t] <stats JSON file to update>
+python -b <stats JSON file to update> < <operations>
+    -b      - apply operations read from stdin, one per line, with one write:
+                set <key> <JSON expression>
+                set -t <key> <text to the end of the line>
+                set -f <key> <file>         - the text value is read from the file
+                update [<key>] <JSON expression>
+              <key> is "/"-separated, like with -k
 """
 
 if __name__ == "__main__":
     import sys, getopt
     
-    opts, args = getopt.getopt(sys.argv[1:], "k:u:j:t")
+    opts, args = getopt.getopt(sys.argv[1:], "k:u:j:tb")
     opts = dict(opts)
     
     if not args:
         print(Usage)
         sys.exit(2)
     stats_file = args[0]
+
+    if "-b" in opts:
+        from stats_log import parse_batch, apply_event, compact
+        events = []
+        for op, key, value in parse_batch(sys.stdin):
+            path = [p for p in key.split("/") if p]
+            if not path and not isinstance(value, dict):
+                print("Empty key can only be used with a JSON object value: %s %s" % (op, json.dumps(value)), file=sys.stderr)
+                sys.exit(2)
+            events.append({"op": op, "path": ".".join(path), "value": value})
+
+        def update(data):
+            # applied under the stats file lock, so that concurrent writers do not lose each other's updates
+            updated = data
+            for event in events:
+                updated = apply_event(updated, event)
+            if updated is not data:
+                data.clear()
+                data.update(updated)
+
+        compact(stats_file, update, indent=4)
+        sys.exit(0)
+
     key = opts.get("-k")
     if "-u" in opts:
         update = json.loads(open(opts["-u"], "r").read())
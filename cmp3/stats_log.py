@@ -0,0 +1,262 @@
+import sys, os, time, json, fcntl, getopt
+from stats import atomic_write_json, locked, read_json
+
+Usage = """
+python stats_log.py set [-t] <stats file> <path> (<JSON value>|-)       - append "set" event, -t: the value is text
+python stats_log.py update <stats file> [<path>] (<JSON value>|-)      - append "update" (deep merge) event
+python stats_log.py batch [-c] <stats file> < <operations>                - append events for operations read from stdin, one per line,
+                                                                          -c: compact the log after that:
+        set <path> <JSON value>
+        set -t <path> <text to the end of the line>
+        set -f <path> <file>                                            - the text value is read from the file
+        update [<path>] <JSON value>
+python stats_log.py compact <stats file>                               - fold the log into the stats file
+python stats_log.py show <stats file>                                  - print the stats with the log folded in
+python stats_log.py timeline <stats file>                              - print all events, including compacted ones
+
+<path> is dot-separated, e.g. scanner.scanner.attempt
+"""
+
+#
+# Append-only event log for stats files.
+#
+# Instead of parsing and rewriting <rse>_<run>_stats.json, a stage can append a one-line JSON event
+# to <rse>_<run>_stats.log:
+#
+#   {"time": <t>, "op": "set"|"update", "path": "a.b.c", "value": <JSON value>}
+#
+# "set" replaces the value at the path, "update" deep-merges a dictionary into the value at the path.
+# Readers fold the log into the stats file. The compactor folds the log into the stats file and moves
+# the events to <rse>_<run>_stats.timeline, so the full history of the run stays available.
+#
+# Appenders hold a shared lock on the log while writing, the compactor renames the log to <log>.compacting
+# and takes the exclusive lock on it before reading it. An appender which finds that the log it has opened
+# was renamed, opens the new one.
+#
+
+def log_path(stats_path):
+    base = stats_path[:-len(".json")] if stats_path.endswith(".json") else stats_path
+    return base + ".log"
+
+def compacting_path(stats_path):
+    return log_path(stats_path) + ".compacting"
+
+def timeline_path(stats_path):
+    return log_path(stats_path)[:-len(".log")] + ".timeline"
+
+def append(stats_path, op, path, value, t=None):
+    append_many(stats_path, [(op, path, value)], t)
+
+def append_many(stats_path, operations, t=None):
+    # operations: [(op, path, value), ...], appended with one write
+    t = t or time.time()
+    lines = []
+    for op, path, value in operations:
+        assert op in ("set", "update")
+        lines.append(json.dumps({"time": t, "op": op, "path": path, "value": value}) + "\n")
+    if not lines:
+        return
+    data = "".join(lines).encode("utf-8")
+    lpath = log_path(stats_path)
+    while True:
+        fd = os.open(lpath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:    current = os.stat(lpath).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                os.write(fd, data)
+                return
+        finally:
+            os.close(fd)
+
+def parse_batch_line(line):
+    #
+    # returns (op, path, value) or None for empty and comment lines
+    #   set <path> <JSON value>
+    #   set -t <path> <text to the end of the line>      or  set <path> -t <text>
+    #   set -f <path> <file>                             or  set <path> -f <file>
+    #   update [<path>] <JSON value>
+    #
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    words = line.split(None, 1)
+    op, rest = words[0], (words[1] if len(words) > 1 else "")
+    if op == "set":
+        # the -t/-f flag can also follow the path, like with json_file.py set
+        mode = None
+        if rest[:3] in ("-t ", "-f "):
+            mode, rest = rest[1], rest[3:].lstrip()
+        words = rest.split(None, 1)
+        if not words:
+            raise ValueError("Missing path: %s" % (line,))
+        path, value = words[0], (words[1] if len(words) > 1 else "")
+        if mode is None and (value[:3] in ("-t ", "-f ") or value in ("-t", "-f")):
+            mode, value = value[1], value[3:].lstrip()
+        if mode == "t":
+            pass
+        elif mode == "f":
+            with open(value, "r") as f:
+                value = f.read()
+        else:
+            value = json.loads(value)
+        return op, path, value
+    elif op == "update":
+        if rest.startswith("{") or rest.startswith("["):
+            path, value = "", rest
+        else:
+            words = rest.split(None, 1)
+            if len(words) < 2:
+                raise ValueError("Missing value: %s" % (line,))
+            path, value = words
+        return op, path, json.loads(value)
+    else:
+        raise ValueError("Unknown operation: %s" % (line,))
+
+def parse_batch(lines):
+    return [op for op in (parse_batch_line(line) for line in lines) if op is not None]
+
+def update_deep(data, update):
+    for k, v in update.items():
+        if isinstance(v, dict) and isinstance(data.get(k), dict):
+            update_deep(data[k], v)
+        else:
+            data[k] = v
+
+def apply_event(data, event):
+    # returns the updated data
+    op, path, value = event.get("op"), event.get("path") or "", event.get("value")
+    keys = path.split(".") if path else []
+    if not keys:
+        if op == "set":
+            return value
+        if isinstance(data, dict) and isinstance(value, dict):
+            update_deep(data, value)
+            return data
+        return value
+    if not isinstance(data, dict):
+        data = {}
+    o = data
+    for k in keys[:-1]:
+        if not isinstance(o.get(k), dict):
+            o[k] = {}
+        o = o[k]
+    k = keys[-1]
+    if op == "update" and isinstance(value, dict) and isinstance(o.get(k), dict):
+        update_deep(o[k], value)
+    else:
+        o[k] = value
+    return data
+
+def read_events(path):
+    # yields events from a log file, ignores incomplete last line
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            if line.endswith("\n"):
+                try:    event = json.loads(line)
+                except ValueError:
+                    continue
+                yield event
+
+def fold(data, stats_path):
+    # applies the events from the log, including the one being compacted, to the data
+    for path in (compacting_path(stats_path), log_path(stats_path)):
+        for event in read_events(path):
+            data = apply_event(data, event)
+    return data
+
+def read_stats(stats_path):
+    # returns the stats with the log folded in, or None if neither the stats file nor the log exists
+    data = read_json(stats_path)
+    if data is None and not os.path.isfile(log_path(stats_path)):
+        return None
+    return fold(data or {}, stats_path)
+
+def compact(stats_path, update=None, indent=4):
+    #
+    # folds the log into the stats file. If update is given, update(data) is called with the folded data
+    # before it is written. The stats file is written with the given JSON indent, readable by default. All writers of the stats file use this, so that the log is never applied over
+    # newer data written directly into the stats file.
+    #
+    lpath = log_path(stats_path)
+    cpath = compacting_path(stats_path)
+    with locked(stats_path):
+        data = read_json(stats_path, {})
+        if os.path.isfile(lpath):
+            if os.path.isfile(cpath):
+                # left over from an interrupted compaction, add the new events to it
+                detached = cpath + ".new"
+            else:
+                detached = cpath
+            os.replace(lpath, detached)
+            with open(detached, "r") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)       # wait for the appends in progress
+                if detached != cpath:
+                    with open(cpath, "a") as out:
+                        out.write(f.read())
+            if detached != cpath:
+                os.unlink(detached)
+        events = list(read_events(cpath))
+        for event in events:
+            data = apply_event(data, event)
+        if update is not None:
+            update(data)
+        atomic_write_json(stats_path, data, indent=indent)
+        if events:
+            with open(timeline_path(stats_path), "a") as f:
+                for event in events:
+                    f.write(json.dumps(event) + "\n")
+        if os.path.isfile(cpath):
+            os.unlink(cpath)
+    return len(events)
+
+def timeline(stats_path):
+    # yields all events for the stats file, compacted and pending
+    for path in (timeline_path(stats_path), compacting_path(stats_path), log_path(stats_path)):
+        yield from read_events(path)
+
+def main():
+    if len(sys.argv) < 3:
+        print(Usage)
+        sys.exit(2)
+    cmd, args = sys.argv[1], sys.argv[2:]
+    if cmd in ("set", "update"):
+        opts, args = getopt.gnu_getopt(args, "t")
+        opts = dict(opts)
+        if cmd == "update" and len(args) == 2:
+            args = [args[0], ""] + args[1:]
+        if len(args) != 3:
+            print(Usage)
+            sys.exit(2)
+        stats_path, path, value = args
+        if value == "-":
+            value = sys.stdin.read()
+        if "-t" not in opts:
+            value = json.loads(value)
+        append(stats_path, cmd, path, value)
+    elif cmd == "batch":
+        opts, args = getopt.getopt(args, "c")
+        append_many(args[0], parse_batch(sys.stdin))
+        if "-c" in dict(opts):
+            compact(args[0])
+    elif cmd == "compact":
+        n = compact(args[0])
+        print("events compacted:", n, file=sys.stderr)
+    elif cmd == "show":
+        print(json.dumps(read_stats(args[0]), indent=4, sort_keys=True))
+    elif cmd == "timeline":
+        for event in timeline(args[0]):
+            print(time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(event["time"])), event["op"], event["path"] or ".",
+                json.dumps(event["value"]))
+    else:
+        print(Usage)
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
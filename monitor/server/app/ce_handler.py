@@ -37,7 +37,8 @@ class CEHandler(WPHandler):
     def __init__(self, *params, **args):
         WPHandler.__init__(self, *params, **args)
         self.static = WPStaticHandler(*params, **args)
-        self.CCDataSource = CCDataSource(self.App.CCPath, self.App.StatsCache)
+        self.CCDataSource = CCDataSource(self.App.CCPath, self.App.StatsCache, run_index=self.App.CCRunIndex,
+                summary_cache=self.App.SummaryCache)
         
     def probe(self, request, relpath, **args):
         return self.CCDataSource.status(), "text/plain"
@@ -54,8 +55,7 @@ class CEHandler(WPHandler):
 
         view = view or sort     # for backward compatibility
 
-        all_stats = data_source.latest_stats_per_rse()
-        summaries = {rse: data_source.run_summary(stats) for rse, stats in all_stats.items()}
+        summaries = data_source.latest_run_summaries()
         for rse, summary in summaries.items():
             summary["rse"] = rse
         now = time.time()
@@ -124,6 +124,21 @@ class CEHandler(WPHandler):
     
     def cache_hit_ratio(self, request, relpath, **args):
         return str(self.App.StatsCache.HitRatio), "text/plain"
+
+    def stats_cache_stats(self, request, relpath, **args):
+        return json.dumps(self.App.StatsCache.stats()), "text/json"
+
+    def warmup_status(self, request, relpath, **args):
+        warmer = self.App.CacheWarmer
+        status = warmer.status() if warmer is not None else {"status": "disabled"}
+        status["cache"] = self.App.StatsCache.stats()
+        return json.dumps(status), "text/json"
+
+    def summary_cache_stats(self, request, relpath, **args):
+        return json.dumps(self.App.SummaryCache.stats()), "text/json"
+
+    def view_store_stats(self, request, relpath, **args):
+        return json.dumps(self.App.ViewStore.stats()), "text/json"
         
     def raw_stats(self, request, relpath, rse=None, run=None, **args):
         runs = self.CCDataSource.list_runs(rse)
@@ -241,33 +256,114 @@ class CEHandler(WPHandler):
             errors.append("Missing file list not found")
         return errors
         
-    def dark(self, request, relpath, rse=None, run=None, **args):
-        lst = self.CCDataSource.get_dark(rse, run)
-        return (path+"\n" for path in lst), {
+    def download_list(self, request, typ, rse, run, offset=None, limit=None, prefix=None):
+        #
+        # Streams the list. Without selection parameters, a gzipped list is sent as stored, with
+        # Content-Encoding: gzip, if the client accepts it, otherwise it is decompressed in large chunks.
+        # offset, limit, prefix select a part of the list to let the client page through it.
+        #
+        data_source = self.CCDataSource
+        path, compressed = data_source.list_file(rse, run, typ)
+        if path is None:
+            return 404, "not found"
+        try:
+            offset = int(offset) if offset else 0
+            limit = int(limit) if limit else None
+        except ValueError:
+            return 400, "offset and limit must be integers"
+        headers = {
             "Content-Type":"text/plain",
             "Content-Disposition":"attachment"
         }
+        if offset or limit is not None or prefix:
+            return data_source.list_selection(path, compressed, offset, limit, prefix), headers
+        if compressed and "gzip" in request.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            return data_source.raw_chunks(path), headers
+        return data_source.list_chunks(path, compressed), headers
+
+    def dark(self, request, relpath, rse=None, run=None, offset=None, limit=None, prefix=None, **args):
+        return self.download_list(request, "D", rse, run, offset, limit, prefix)
             
-    def dark_confirmed(self, request, relpath, rse=None, run=None, **args):
-        lst = self.CCDataSource.get_dark_action(rse, run)
-        return (path+"\n" for path in lst), {
-            "Content-Type":"text/plain",
-            "Content-Disposition":"attachment"
-        }
+    def dark_confirmed(self, request, relpath, rse=None, run=None, offset=None, limit=None, prefix=None, **args):
+        return self.download_list(request, "D_action", rse, run, offset, limit, prefix)
             
-    def missing(self, request, relpath, rse=None, run=None, **args):
-        lst = self.CCDataSource.get_missing(rse, run)
-        return (path+"\n" for path in lst), {
-            "Content-Type":"text/plain",
-            "Content-Disposition":"attachment"
-        }
+    def missing(self, request, relpath, rse=None, run=None, offset=None, limit=None, prefix=None, **args):
+        return self.download_list(request, "M", rse, run, offset, limit, prefix)
 
-    def lost(self, request, relpath, rse=None, run=None, **args):
-        lst = self.CCDataSource.get_lost(rse, run)
-        return (path+"\n" for path in lst), {
-            "Content-Type":"text/plain",
-            "Content-Disposition":"attachment"
-        }
+    def lost(self, request, relpath, rse=None, run=None, offset=None, limit=None, prefix=None, **args):
+        return self.download_list(request, "permLost", rse, run, offset, limit, prefix)
+
+    def rollup(self, request, relpath, rse=None, run=None, **args):
+        if not rse or not run:
+            return 400, "Missing RSE or run"
+        path = self.CCDataSource.rollup_path(rse, run)
+        if not os.path.isfile(path):
+            return 404, "not found"
+        return open(path, "r").read(), "text/json"
+
+    def show_rollup(self, request, relpath, rse=None, run=None, type="dark", depth=None, **args):
+        if not rse or not run:
+            return 400, "Missing RSE or run"
+        data = self.CCDataSource.get_rollup(rse, run)
+        if data is None:
+            return 404, "not found"
+        depths = [str(d) for d in data.get("depths", [])]
+        if depth not in depths:
+            depth = depths[-1] if depths else None
+        rollup = data.get(type) or {}
+        depth_data = rollup.get("depths", {}).get(depth) or {}
+        return self.render_to_response("ce_rollup.html", rse=rse, run=run, type=type, depth=depth, depths=depths,
+            total=rollup.get("total"),
+            ndirectories=depth_data.get("directories"),
+            counts=depth_data.get("counts", []))
+
+    def runs_with_status(self, request, relpath, component="scanner", status="failed", days=None, **args):
+        # runs where the component has the status, started in last <days> days
+        since = time.time() - float(days)*24*3600 if days else None
+        runs, source = self.CCDataSource.runs_with_status(component, status, since)
+        data = dict(
+            component = component,
+            status = status,
+            since = since,
+            source = source,
+            runs = [{"rse": rse, "run": run, "start_time": start_time} for rse, run, start_time in runs]
+        )
+        return json.dumps(data), "text/json"
+
+    ListTypes = ("D", "M", "D_action", "ED", "permLost")
+    MAX_PAGE_SIZE = 10000
+
+    def list_page(self, request, relpath, rse=None, run=None, type="D", page=0, page_size=1000, prefix=None, **args):
+        #
+        # returns page of a list as JSON:
+        #   {"rse":..., "run":..., "type":..., "prefix":..., "page":..., "page_size":..., "total":..., "paths": [...]}
+        # total is the number of paths in the list or, with prefix, the number of paths with the prefix
+        #
+        if not rse or not run:
+            return 400, "Missing RSE or run"
+        if type not in self.ListTypes:
+            return 400, "Unknown list type. Known types: " + ",".join(self.ListTypes)
+        try:
+            page = int(page)
+            page_size = min(int(page_size), self.MAX_PAGE_SIZE)
+        except ValueError:
+            return 400, "page and page_size must be integers"
+        if page < 0 or page_size <= 0:
+            return 400, "page must be >= 0 and page_size must be > 0"
+        total, paths = self.CCDataSource.list_page(rse, run, type, page, page_size, prefix)
+        if total is None:
+            return 404, "not found"
+        return json.dumps({
+            "rse":          rse,
+            "run":          run,
+            "type":         type,
+            "prefix":       prefix,
+            "page":         page,
+            "page_size":    page_size,
+            "total":        total,
+            "paths":        paths
+        }), "text/json"
 
     LIMIT = 1000
     
@@ -339,6 +435,7 @@ class CEHandler(WPHandler):
         
         return self.render_to_response("ce_run.html", 
             rse=rse, run=run,
+            has_rollup=os.path.isfile(data_source.rollup_path(rse, run)),
             disabled=stats.get("disabled", False),
             errors = errors,
             dark_truncated = dark_truncated, 
@@ -382,73 +479,25 @@ class CEHandler(WPHandler):
         stats = self.CCDataSource.get_stats(rse, run)[0]
         return json.dumps(stats, indent=4, sort_keys=True), "text/json"
 
-    def lists_diffs(self, request, relpath, rses=None, **args):
-        cc_data_source = self.CCDataSource
+    def materialized_view(self, request, kind, rses):
         if rses is None:
-            rses = set(um_data_source.list_rses()) | set(cc_data_source.list_rses())
+            rses = set(self.App.UMRunIndex.rses()) | set(self.CCDataSource.list_rses())
         else:
             rses = rses.split(",")
-        data = {}      # {rse -> {"old_missing":.., "new_missing":, "old_dark":, "new_dark"}}
-        for rse in rses:
-            rse_data = dict(
-                    nmissing = None,
-                    ndark = None,
-                    prev_run=None,
-                    last_run=None,
-                    nmissing_old=None, 
-                    ndark_old=None,
-            )
-            last_stats = cc_data_source.latest_stats_for_rse(rse)
-            if last_stats is not None:
-                rse_data["last_run"] = last_run = last_stats["run"]
-                if last_stats.get("cmp3", {}).get("status") == "done":
-                    rse_data["nmissing"] = last_stats["cmp3"]["missing"]
-                    rse_data["ndark"] = last_stats["cmp3"]["dark"]
-                    rse_data["last_run"] = last_run = last_stats["run"]
-                    prev_run, missing_old, dark_old = cc_data_source.file_lists_diffs_counts(rse, last_run)
-                    if prev_run is not None:
-                        rse_data.update(dict(
-                                prev_run=prev_run,
-                                nmissing_old=missing_old,
-                                ndark_old=dark_old
-                        ))
-            data[rse] = rse_data
-        return json.dumps(data), "text/json"
-        
-    MAX_HISTORY = 10
-        
+        rses = [rse for rse in rses if rse]
+        etag, data = self.App.ViewStore.get(kind, rses)
+        if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+            return "", 304, {"ETag": etag}
+        return json.dumps(data), {"Content-Type": "text/json", "ETag": etag}
+
+    def lists_diffs(self, request, relpath, rses=None, **args):
+        # {rse -> {"nmissing":.., "ndark":.., "nmissing_old":.., "ndark_old":.., "last_run":.., "prev_run":..}}
+        return self.materialized_view(request, "lists_diffs", rses)
+
     def status_history(self, request, relpath, rses=None, **args):
-        cc_data_source = self.CCDataSource
+        # {rse -> {"cc_total":.., "cc_success":.., "cc_status_history":[...]}}
+        return self.materialized_view(request, "status_history", rses)
 
-        if rses is None:
-            rses = set(um_data_source.list_rses()) | set(cc_data_source.list_rses())
-        else:
-            rses = rses.split(",")
-            
-        data = {}      # {rse -> (cc_total, um_total, cc_success, um_success)}
-        
-        for rse in rses:
-            if not rse: continue
-            cc_summaries = [cc_data_source.run_summary(x) for x in cc_data_source.all_stats_for_rse(rse)]
-            
-            cc_total = cc_success = 0
-            
-            cc_total = len(cc_summaries)
-            cc_success = len([x for x in cc_summaries if x.get("status") == "done"])
-            
-            data[rse] = dict(cc_total=cc_total, cc_success=cc_success,
-                cc_status_history=[
-                    {
-                        "cc":       x.get("detection_status") if not x.get("disabled") else "disabled",
-                        "missing":  x.get("missing_stats",{}).get("action_status"),
-                        "dark":     x.get("dark_stats",{}).get("action_status")
-                    }
-                    for x in cc_summaries
-                ][-self.MAX_HISTORY:],
-            )
-            
-        return json.dumps(data), "text/json"
-        
     def ls(self, request, relpath, rse="*", **args):
         lst = self.CCDataSource.ls(rse)
         return ["%s -> %s %s %s %s %s\n" % (d["path"], d["real_path"] or "", d["size"], d["ctime"], d["ctime_text"], d["error"]) for d in lst], "text/plain"
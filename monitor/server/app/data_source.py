@@ -1,45 +1,714 @@
-import os, glob, json, time, os, gzip, os.path, sys, re
-from pythreader import Primitive, synchronized, RWLock
+import os, glob, json, time, os, gzip, os.path, sys, re, zlib, bisect, hashlib, sqlite3
+from fnmatch import fnmatch
+from pythreader import Primitive, synchronized, TaskQueue, Task
+
+FileNameRE = re.compile(r"""
+        (?P<rse>\w+?)
+        (_(?P<timestamp>\d{4}_\d{2}_\d{2}_\d{2}_\d{2}))?
+        _(?P<type>[A-Za-z]+)
+        \.(?P<ext>.+)
+    """, re.VERBOSE)
+
+def parse_filename(fn):
+    # filename looks like this:
+    #
+    #   <rse>_%Y_%m_%d_%H_%M_<type>.<extension>
+    #   <rse>_<type>.<extension>
+    #
+    m = FileNameRE.match(fn)
+    if not m:
+        return None, None, None, None
+    return m["rse"], m["timestamp"], m["type"], m["ext"]
+
+#
+# Stats event log, written by cmp3/stats_log.py: <rse>_<run>_stats.log next to <rse>_<run>_stats.json,
+# one JSON event per line, {"time":..., "op": "set"|"update", "path": "a.b.c", "value":...}.
+# The events not compacted yet are folded into the stats when the stats file is read.
+#
+
+def stats_log_paths(path):
+    # returns the log paths in the order they have to be applied, or [] if the path is not a stats file
+    if not path.endswith("_stats.json"):
+        return []
+    log_path = path[:-len(".json")] + ".log"
+    return [log_path + ".compacting", log_path]
+
+def file_version(path):
+    # returns file mtime, or (mtime, log mtime, log size) if there is a stats log. Raises OSError if the file does not exist
+    mtime = os.path.getmtime(path)
+    for log_path in stats_log_paths(path)[::-1]:
+        try:    st = os.stat(log_path)
+        except OSError: continue
+        return (mtime, st.st_mtime, st.st_size)
+    return mtime
+
+def update_deep(data, update):
+    for k, v in update.items():
+        if isinstance(v, dict) and isinstance(data.get(k), dict):
+            update_deep(data[k], v)
+        else:
+            data[k] = v
+
+def apply_stats_event(data, event):
+    op, path, value = event.get("op"), event.get("path") or "", event.get("value")
+    keys = path.split(".") if path else []
+    if not keys:
+        if op == "update" and isinstance(data, dict) and isinstance(value, dict):
+            update_deep(data, value)
+            return data
+        return value
+    if not isinstance(data, dict):
+        data = {}
+    o = data
+    for k in keys[:-1]:
+        if not isinstance(o.get(k), dict):
+            o[k] = {}
+        o = o[k]
+    k = keys[-1]
+    if op == "update" and isinstance(value, dict) and isinstance(o.get(k), dict):
+        update_deep(o[k], value)
+    else:
+        o[k] = value
+    return data
+
+def fold_stats_log(data, path):
+    # returns (data, number of bytes read from the logs)
+    nbytes = 0
+    for log_path in stats_log_paths(path):
+        try:    f = open(log_path, "r")
+        except OSError: continue
+        with f:
+            for line in f:
+                nbytes += len(line)
+                if line.endswith("\n"):            # ignore incomplete last line
+                    try:    event = json.loads(line)
+                    except ValueError:
+                        continue
+                    data = apply_stats_event(data, event)
+    return data, nbytes
 
 class StatsCache(Primitive):
+    #
+    # Size-bounded cache of parsed stats files.
+    #
+    # Hits do not take any locks: the entry is looked up in the dictionary and, unless it is time
+    # to check the file mtime again (at most once per CHECK_INTERVAL per path), returned as is.
+    # Misses load the file outside of the lock and insert the data under the lock.
+    # When the number of entries or the approximate size (the total size of the JSON files) exceeds
+    # the limits, least recently used entries are evicted until the cache is below LOW_WATER of the limits.
+    #
+
+    MAX_ENTRIES = 5000
+    MAX_BYTES = 500*1024*1024
+    CHECK_INTERVAL = 5.0            # seconds
+    LOW_WATER = 0.9
 
-    def __init__(self):
+    # entry layout
+    DATA, MTIME, SIZE, CHECKED, USED = range(5)
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, check_interval=CHECK_INTERVAL):
         Primitive.__init__(self)
-        self.RWLock = RWLock()
-        self.Cache = {}             # {path -> (mtime, data)}
+        self.MaxEntries = max_entries
+        self.MaxBytes = max_bytes
+        self.CheckInterval = check_interval
+        self.Cache = {}             # {path -> [data, mtime, size, checked time, last used time]}
+        self.Bytes = 0
         self.HitRatio = 0.0
+        self.Hits = 0
+        self.Misses = 0
+        self.Evictions = 0
+        self.MTimeChecks = 0
     
     def init(self, dir_path):
-        # pre-read all JSON files
-        with self.RWLock.exclusive:
-            for path in glob.glob(dir_path + "/*stats.json"):
-                try:    self.get(path)
-                except: pass
+        # pre-read the most recent JSON files, as many as fit into the cache
+        paths = []
+        for path in glob.glob(dir_path + "/*stats.json"):
+            try:    paths.append((os.path.getmtime(path), path))
+            except OSError: pass
+        for _, path in sorted(paths, reverse=True)[:self.MaxEntries]:
+            try:    self.get(path)
+            except: pass
+            if self.Bytes >= self.MaxBytes * self.LOW_WATER:
+                break
 
-    @synchronized
     def get(self, path):
-        mtime = os.path.getmtime(path)
-        with self.RWLock.shared:
-            tup = self.Cache.get(path)
-            if tup:
-                my_mtime, data = tup
-                if mtime == my_mtime:
-                    self.HitRatio = self.HitRatio*0.99 + 0.01
-                    return data
-        with self.RWLock.exclusive:
-            data = json.load(open(path, "r"))
-            self.Cache[path] = (mtime, data)
-            self.HitRatio = self.HitRatio*0.99
+        now = time.time()
+        entry = self.Cache.get(path)
+        if entry is not None:
+            if now < entry[self.CHECKED] + self.CheckInterval:
+                return self.hit(entry, now)
+            self.MTimeChecks += 1
+            if file_version(path) == entry[self.MTIME]:
+                entry[self.CHECKED] = now
+                return self.hit(entry, now)
+        return self.load(path, now)
+
+    def hit(self, entry, now):
+        entry[self.USED] = now
+        self.Hits += 1
+        self.HitRatio = self.HitRatio*0.99 + 0.01
+        return entry[self.DATA]
+
+    def load(self, path, now):
+        mtime = file_version(path)
+        with open(path, "r") as f:
+            text = f.read()
+        data = json.loads(text)
+        size = len(text)
+        if isinstance(mtime, tuple):
+            data, log_size = fold_stats_log(data, path)
+            size += log_size
+        self.insert(path, [data, mtime, size, now, now])
         return data
+
+    @synchronized
+    def insert(self, path, entry):
+        self.Misses += 1
+        self.HitRatio = self.HitRatio*0.99
+        old = self.Cache.get(path)
+        if old is not None:
+            self.Bytes -= old[self.SIZE]
+        self.Cache[path] = entry
+        self.Bytes += entry[self.SIZE]
+        if len(self.Cache) > self.MaxEntries or self.Bytes > self.MaxBytes:
+            self.evict()
+
+    def evict(self):
+        # called under the lock
+        max_entries = int(self.MaxEntries * self.LOW_WATER)
+        max_bytes = self.MaxBytes * self.LOW_WATER
+        by_use = sorted(self.Cache.items(), key=lambda item: item[1][self.USED])
+        for path, entry in by_use:
+            if len(self.Cache) <= max_entries and self.Bytes <= max_bytes:
+                break
+            del self.Cache[path]
+            self.Bytes -= entry[self.SIZE]
+            self.Evictions += 1
+
+    def stats(self):
+        return {
+            "entries":          len(self.Cache),
+            "bytes":            self.Bytes,
+            "max_entries":      self.MaxEntries,
+            "max_bytes":        self.MaxBytes,
+            "hits":             self.Hits,
+            "misses":           self.Misses,
+            "hit_ratio":        self.HitRatio,
+            "evictions":        self.Evictions,
+            "mtime_checks":     self.MTimeChecks,
+            "check_interval":   self.CheckInterval
+        }
         
     def __len__(self):
         return len(self.Cache)
 
+class WarmUpTask(Task):
+
+    def __init__(self, warmer, path):
+        Task.__init__(self)
+        self.Warmer = warmer
+        self.Path = path
+
+    def run(self):
+        # returns True if the file was loaded, False if skipped because the cache is full
+        if self.Warmer.cache_full():
+            return False
+        self.Warmer.Cache.get(self.Path)
+        return True
+
+class CacheWarmer(Primitive):
+    #
+    # Reads stats files into the StatsCache in the background, newest runs first,
+    # so that the server can start serving requests immediately
+    #
+
+    def __init__(self, cache, dir_paths, nworkers=5):
+        Primitive.__init__(self)
+        self.Cache = cache
+        self.DirPaths = dir_paths
+        self.NWorkers = nworkers
+        self.Queue = None
+        self.Status = "not started"
+        self.Total = None
+        self.Loaded = 0
+        self.Failed = 0
+        self.Skipped = 0
+        self.StartTime = self.EndTime = None
+
+    def paths(self):
+        # stats file paths, newest runs first
+        runs = []
+        for dir_path in self.DirPaths:
+            try:    names = os.listdir(dir_path)
+            except OSError: continue
+            for fn in names:
+                rse, run, typ, ext = parse_filename(fn)
+                if run and typ == "stats" and ext == "json":
+                    runs.append((run, rse, f"{dir_path}/{fn}"))
+        runs.sort(reverse=True)
+        return [path for _, _, path in runs]
+
+    def start(self):
+        self.StartTime = time.time()
+        self.Status = "listing"
+        paths = self.paths()[:self.Cache.MaxEntries]
+        self.Total = len(paths)
+        self.Status = "running"
+        if not paths:
+            self.done()
+            return self
+        self.Queue = TaskQueue(self.NWorkers, delegate=self)
+        for path in paths:
+            self.Queue.append(WarmUpTask(self, path))
+        return self
+
+    def cache_full(self):
+        return len(self.Cache) >= self.Cache.MaxEntries * self.Cache.LOW_WATER \
+            or self.Cache.Bytes >= self.Cache.MaxBytes * self.Cache.LOW_WATER
+
+    def done(self):
+        self.Status = "done"
+        self.EndTime = time.time()
+
+    @synchronized
+    def taskEnded(self, queue, task, loaded):
+        if loaded:
+            self.Loaded += 1
+        else:
+            self.Skipped += 1
+        if self.Loaded + self.Failed + self.Skipped >= self.Total:
+            self.done()
+
+    @synchronized
+    def taskFailed(self, queue, task, exc_type, exc_value, tb):
+        self.Failed += 1
+        if self.Loaded + self.Failed + self.Skipped >= self.Total:
+            self.done()
+
+    def status(self):
+        end = self.EndTime or time.time()
+        return {
+            "status":       self.Status,
+            "workers":      self.NWorkers,
+            "total":        self.Total,
+            "loaded":       self.Loaded,
+            "failed":       self.Failed,
+            "skipped":      self.Skipped,
+            "elapsed":      None if self.StartTime is None else end - self.StartTime
+        }
+
+class SummaryCache(Primitive):
+    #
+    # Size-bounded cache for values computed from one file, like the run summary or the list index, keyed by
+    # (kind, path). An entry is invalidated when the file version changes or, for values which depend on time,
+    # when its expiration time passes. The size of an entry is its JSON size, or value.cache_size() if the value
+    # has this method. Least recently used entries are evicted the same way as in the StatsCache.
+    #
+
+    MAX_ENTRIES = 20000
+    MAX_BYTES = 200*1024*1024
+    LOW_WATER = 0.9
+    DEFAULT_SIZE = 1024             # for values which are not JSON serializable and do not know their size
+
+    # entry layout
+    VERSION, VALUE, SIZE, USED, EXPIRES = range(5)
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        Primitive.__init__(self)
+        self.MaxEntries = max_entries
+        self.MaxBytes = max_bytes
+        self.Cache = {}             # {(kind, path) -> [version, value, size, last used time, expiration time or None]}
+        self.Bytes = 0
+        self.Hits = 0
+        self.Misses = 0
+        self.Expired = 0
+        self.Evictions = 0
+
+    @synchronized
+    def lookup(self, key, version, now):
+        # returns (found, value)
+        entry = self.Cache.get(key)
+        if entry is not None and entry[self.VERSION] == version:
+            if entry[self.EXPIRES] is None or now < entry[self.EXPIRES]:
+                entry[self.USED] = now
+                self.Hits += 1
+                return True, entry[self.VALUE]
+            self.Expired += 1
+        self.Misses += 1
+        return False, None
+
+    @staticmethod
+    def value_size(value):
+        if hasattr(value, "cache_size"):
+            return value.cache_size()
+        try:    return len(json.dumps(value))
+        except (TypeError, ValueError):
+            return SummaryCache.DEFAULT_SIZE
+
+    @synchronized
+    def store(self, key, version, value, expires, now):
+        size = self.value_size(value)
+        old = self.Cache.get(key)
+        if old is not None:
+            self.Bytes -= old[self.SIZE]
+        self.Cache[key] = [version, value, size, now, expires]
+        self.Bytes += size
+        if len(self.Cache) > self.MaxEntries or self.Bytes > self.MaxBytes:
+            self.evict()
+
+    def evict(self):
+        # called under the lock
+        max_entries = int(self.MaxEntries * self.LOW_WATER)
+        max_bytes = self.MaxBytes * self.LOW_WATER
+        by_use = sorted(self.Cache.items(), key=lambda item: item[1][self.USED])
+        for key, entry in by_use:
+            if len(self.Cache) <= max_entries and self.Bytes <= max_bytes:
+                break
+            del self.Cache[key]
+            self.Bytes -= entry[self.SIZE]
+            self.Evictions += 1
+
+    def get(self, kind, path, compute, expiring=False):
+        #
+        # compute() is called without holding the lock. It returns the value or, if expiring is True,
+        # (value, expiration time or None)
+        #
+        try:    version = file_version(path)
+        except OSError:
+            return None
+        key = (kind, path)
+        now = time.time()
+        found, value = self.lookup(key, version, now)
+        if not found:
+            expires = None
+            if expiring:
+                value, expires = compute()
+            else:
+                value = compute()
+            self.store(key, version, value, expires, now)
+        return value
+
+    def stats(self):
+        return {
+            "entries":      len(self.Cache),
+            "bytes":        self.Bytes,
+            "max_entries":  self.MaxEntries,
+            "max_bytes":    self.MaxBytes,
+            "hits":         self.Hits,
+            "misses":       self.Misses,
+            "expired":      self.Expired,
+            "evictions":    self.Evictions
+        }
+
+    def __len__(self):
+        return len(self.Cache)
+
+class RunIndex(Primitive):
+    #
+    # In-memory index of the data directory: {rse -> sorted runs} and {rse -> file names}.
+    # The directory is scanned once and then re-scanned only when its mtime changes, checked at most
+    # once per POLL_INTERVAL. Empty stats files (runs just started) are kept aside and re-checked
+    # on every poll, because writing into an existing file does not change the directory mtime.
+    #
+
+    POLL_INTERVAL = 10          # seconds
+    MTIME_RESOLUTION = 2        # seconds, re-scan again if the directory was modified so recently
+
+    def __init__(self, dir_path, poll_interval=POLL_INTERVAL):
+        Primitive.__init__(self)
+        self.Path = dir_path
+        self.PollInterval = poll_interval
+        self.DirMTime = None
+        self.LastCheck = 0
+        self.Runs = {}              # {rse -> sorted list of runs with non-empty stats files}
+        self.Files = {}             # {rse -> sorted list of file names}
+        self.Pending = {}           # {path -> (rse, run)} for empty stats files
+        self.ScanCount = 0
+        self.refresh(force=True)
+
+    @synchronized
+    def refresh(self, force=False):
+        now = time.time()
+        if not force and now < self.LastCheck + self.PollInterval:
+            return
+        self.LastCheck = now
+        try:    mtime = os.stat(self.Path).st_mtime
+        except OSError: mtime = None
+        if force or mtime is None or mtime != self.DirMTime:
+            self.scan()
+            # the directory could be modified again within the mtime resolution
+            self.DirMTime = mtime if mtime is not None and mtime < now - self.MTIME_RESOLUTION else None
+        elif self.Pending:
+            self.check_pending()
+
+    def scan(self):
+        runs = {}
+        files = {}
+        pending = {}
+        try:    entries = list(os.scandir(self.Path))
+        except OSError: entries = []
+        for entry in entries:
+            rse, run, typ, ext = parse_filename(entry.name)
+            if not rse:
+                continue
+            files.setdefault(rse, []).append(entry.name)
+            if run and typ == "stats" and ext == "json":
+                try:    size = entry.stat().st_size
+                except OSError: continue
+                if size > 0:
+                    runs.setdefault(rse, []).append(run)
+                else:
+                    pending[entry.path] = (rse, run)
+        for lst in runs.values():    lst.sort()
+        for lst in files.values():   lst.sort()
+        self.Runs, self.Files, self.Pending = runs, files, pending
+        self.ScanCount += 1
+
+    def check_pending(self):
+        ready = []
+        for path, (rse, run) in self.Pending.items():
+            try:
+                if os.path.getsize(path) > 0:
+                    ready.append(path)
+            except OSError:
+                ready.append(path)          # deleted, will be ignored
+        if ready:
+            runs = {rse: lst[:] for rse, lst in self.Runs.items()}
+            for path in ready:
+                rse, run = self.Pending.pop(path)
+                if os.path.isfile(path):
+                    lst = runs.setdefault(rse, [])
+                    if run not in lst:
+                        lst.append(run)
+                        lst.sort()
+            self.Runs = runs
+
+    def rses(self):
+        self.refresh()
+        return sorted(self.Files.keys())
+
+    def runs(self, rse):
+        # returns sorted list of runs with non-empty stats files. The list must not be modified by the caller.
+        self.refresh()
+        return self.Runs.get(rse, [])
+
+    def files(self, rse):
+        # returns sorted list of file names for the RSE. The list must not be modified by the caller.
+        self.refresh()
+        return self.Files.get(rse, [])
+
+class ListIndex(object):
+    #
+    # Checkpoint index of a plain or gzipped list file for paging through it without re-reading
+    # it from the start. The file is read once in chunks. Before every chunk starting at least
+    # CHECKPOINT_INTERVAL bytes after the previous checkpoint, the index remembers the number of lines
+    # read so far, the file offset, the incomplete last line and, for gzipped files, a copy of
+    # the decompressor state. Empty lines are not counted.
+    #
+    # The index also remembers the first line after each checkpoint and whether the file is sorted. For sorted
+    # files, the lines with a given prefix are found by bisecting the first lines, reading from the checkpoint
+    # just before the prefix and stopping after the last matching line. The (first line number, count) range
+    # of the recently used prefixes is kept, so the next pages with the same prefix are read like unfiltered ones.
+    #
+
+    CHUNK_SIZE = 1024*1024
+    CHECKPOINT_INTERVAL = 1024*1024             # for plain files
+    GZ_CHECKPOINT_INTERVAL = 4*1024*1024        # compressed bytes. Each checkpoint keeps a decompressor copy (~50KB)
+    MAX_PREFIXES = 100
+
+    def __init__(self, path, compressed):
+        self.Path = path
+        self.Compressed = compressed
+        self.Checkpoints = []           # [(line number, offset, decompressor or None, tail), ...]
+        self.LineNumbers = []           # line numbers of the checkpoints, for bisect
+        self.FirstLines = []            # first line after each checkpoint, for bisect. Checkpoints at the end of the file have none
+        self.Sorted = True
+        self.Prefixes = {}              # {prefix -> (line number of the first matching line, number of matching lines)}
+        self.Total = 0
+        self.build()
+
+    @staticmethod
+    def decompressor():
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def chunks(self, offset=0, decompressor=None, tail=b"", checkpoint=None):
+        #
+        # yields lists of complete stripped non-empty lines as bytes
+        # checkpoint: callback(offset, decompressor, tail) called before each chunk is processed
+        #
+        with open(self.Path, "rb") as f:
+            f.seek(offset)
+            if self.Compressed:
+                decompressor = decompressor.copy() if decompressor is not None else self.decompressor()
+            while True:
+                if checkpoint is not None:
+                    checkpoint(offset, decompressor, tail)
+                raw = f.read(self.CHUNK_SIZE)
+                if not raw:
+                    break
+                offset += len(raw)
+                if self.Compressed:
+                    data = decompressor.decompress(raw)
+                    while decompressor.eof and decompressor.unused_data:
+                        # multi-member gzip file
+                        unused = decompressor.unused_data
+                        decompressor = self.decompressor()
+                        data += decompressor.decompress(unused)
+                else:
+                    data = raw
+                lines = (tail + data).split(b"\n")
+                tail = lines.pop()
+                yield [l for l in (line.strip() for line in lines) if l]
+            tail = tail.strip()
+            if tail:
+                yield [tail]
+
+    def build(self):
+        interval = self.GZ_CHECKPOINT_INTERVAL if self.Compressed else self.CHECKPOINT_INTERVAL
+        next_checkpoint = 0
+        def checkpoint(offset, decompressor, tail):
+            nonlocal next_checkpoint
+            if offset >= next_checkpoint:
+                self.Checkpoints.append((self.Total, offset, decompressor.copy() if decompressor is not None else None, tail))
+                self.LineNumbers.append(self.Total)
+                next_checkpoint = offset + interval
+        last = None
+        for lines in self.chunks(checkpoint=checkpoint):
+            if lines:
+                while len(self.FirstLines) < len(self.Checkpoints):
+                    self.FirstLines.append(lines[0])
+                if self.Sorted:
+                    self.Sorted = (last is None or last <= lines[0]) and all(map(bytes.__le__, lines, lines[1:]))
+                last = lines[-1]
+            self.Total += len(lines)
+
+    DECOMPRESSOR_SIZE = 48*1024                 # approximate size of a zlib decompressor copy
+
+    def cache_size(self):
+        # approximate memory footprint, for the SummaryCache
+        size = 0
+        for _, _, decompressor, tail in self.Checkpoints:
+            size += 100 + len(tail) + (self.DECOMPRESSOR_SIZE if decompressor is not None else 0)
+        size += sum(len(line) + 50 for line in self.FirstLines)
+        size += 100 * len(self.Prefixes)
+        return size
+
+    def lines(self, start=0):
+        # yields lines as strings starting from line number <start>
+        i = bisect.bisect_right(self.LineNumbers, start) - 1
+        line_number, offset, decompressor, tail = self.Checkpoints[max(i, 0)]
+        for lines in self.chunks(offset, decompressor, tail):
+            if line_number + len(lines) > start:
+                for line in lines[max(start - line_number, 0):]:
+                    yield line.decode("utf-8")
+            line_number += len(lines)
+
+    def page(self, start, count):
+        out = []
+        if count > 0:
+            for line in self.lines(start):
+                out.append(line)
+                if len(out) >= count:
+                    break
+        return out
+
+    @staticmethod
+    def prefix_end(prefix):
+        # returns the smallest bytes string greater than all strings starting with the prefix, or None
+        prefix = prefix.rstrip(b"\xff")
+        if not prefix:
+            return None
+        return prefix[:-1] + bytes([prefix[-1] + 1])
+
+    def prefix_range(self, prefix):
+        # for sorted files: returns (line number of the first line with the prefix, number of such lines)
+        found = self.Prefixes.get(prefix)
+        if found is not None:
+            return found
+        p = prefix.encode("utf-8")
+        end = self.prefix_end(p)
+        i = max(bisect.bisect_left(self.FirstLines, p) - 1, 0)
+        line_number, offset, decompressor, tail = self.Checkpoints[i]
+        first = None
+        total = 0
+        for lines in self.chunks(offset, decompressor, tail):
+            lo = bisect.bisect_left(lines, p)
+            hi = len(lines) if end is None else bisect.bisect_left(lines, end, lo)
+            if hi > lo:
+                if first is None:
+                    first = line_number + lo
+                total += hi - lo
+            line_number += len(lines)
+            if hi < len(lines):
+                break               # past the last line with the prefix
+        found = (first or 0, total)
+        if len(self.Prefixes) >= self.MAX_PREFIXES:
+            self.Prefixes.pop(next(iter(self.Prefixes)), None)
+        self.Prefixes[prefix] = found
+        return found
+
+    def select(self, prefix, start, count):
+        # returns (total number of lines with the prefix, list of up to <count> of them starting from <start>)
+        if self.Sorted:
+            first, total = self.prefix_range(prefix)
+            return total, self.page(first + start, min(count, total - start))
+        prefix = prefix.encode("utf-8")
+        total = 0
+        out = []
+        for lines in self.chunks():
+            for line in lines:
+                if line.startswith(prefix):
+                    if total >= start and len(out) < count:
+                        out.append(line.decode("utf-8"))
+                    total += 1
+        return total, out
+
+class CatalogReader(object):
+    #
+    # Read-only access to the SQLite run catalog maintained by cmp3/catalog.py in the data directory.
+    # The monitor never writes to the catalog, so the catalog is as fresh as its last sync by the
+    # consistency enforcement jobs.
+    #
+
+    FileName = "catalog.sqlite"
+    SCHEMA_VERSION = "1"
+
+    def __init__(self, dir_path):
+        self.DB = sqlite3.connect("file:%s/%s?mode=ro" % (dir_path, self.FileName), uri=True, timeout=10)
+        version = self.DB.execute("select value from meta where name='schema_version'").fetchone()
+        if version is None or version[0] != self.SCHEMA_VERSION:
+            self.DB.close()
+            raise ValueError("Unsupported catalog schema version")
+
+    @staticmethod
+    def open(dir_path):
+        # returns CatalogReader or None if the catalog is absent or not usable
+        if not os.path.isfile(f"{dir_path}/{CatalogReader.FileName}"):
+            return None
+        try:
+            return CatalogReader(dir_path)
+        except (sqlite3.Error, ValueError):
+            return None
+
+    def close(self):
+        self.DB.close()
+
+    def runs_with_status(self, component, status, since=None):
+        # returns [(rse, run, start_time), ...]
+        sql = "select rse, run, start_time from components where component=? and status=?"
+        params = [component, status]
+        if since is not None:
+            sql += " and start_time >= ?"
+            params.append(since)
+        return list(self.DB.execute(sql + " order by rse, run", params))
+
 class DataSource(object):
     
-    def __init__(self, path, cache):
+    def __init__(self, path, cache, run_index=None, summary_cache=None):
         self.Path = path
         self.Cache = cache
+        self.RunIndex = run_index if run_index is not None else RunIndex(path)
+        self.SummaryCache = summary_cache if summary_cache is not None else SummaryCache()     # an empty cache is false
         
     def is_mounted(self):
         return os.path.isdir(self.Path)
@@ -53,23 +722,10 @@ class DataSource(object):
         dir_path, fn = path.rsplit("/", 1)
         return (dir_path,) + self.parse_filename(fn)
         
-    FileNameRE = re.compile(r"""
-            (?P<rse>\w+?)
-            (_(?P<timestamp>\d{4}_\d{2}_\d{2}_\d{2}_\d{2}))?
-            _(?P<type>[A-Za-z]+)
-            \.(?P<ext>.+)
-        """, re.VERBOSE)
+    FileNameRE = FileNameRE
         
     def parse_filename(self, fn):
-        # filename looks like this:
-        #
-        #   <rse>_%Y_%m_%d_%H_%M_<type>.<extension>
-        #   <rse>_<type>.<extension>
-        #
-        m = self.FileNameRE.match(fn)
-        if not m:
-            return None, None, None, None
-        return m["rse"], m["timestamp"], m["type"], m["ext"]
+        return parse_filename(fn)
         
     def parse_stats_path(self, path):
         fn = path.split("/")[-1]
@@ -78,27 +734,12 @@ class DataSource(object):
         return rse, run
 
     def list_rses(self):
-        files = glob.glob(f"{self.Path}/*_stats.json")
-        rses = set()
-        for path in files:
-            dirpath, rse, timestamp, typ, ext = self.parse_path(path)
-            rses.add(rse)
-        return sorted(list(rses))
+        return self.RunIndex.rses()
 
     NLAST_RUNS = 10
     
     def list_runs(self, rse, nlast=NLAST_RUNS):
-        files = glob.glob(f"{self.Path}/{rse}_*_stats.json")
-        runs = []
-        for path in files:
-            fn = path.rsplit("/",1)[-1]
-            if os.stat(path).st_size > 0:
-                r, timestamp, typ, ext = self.parse_filename(fn)
-                if r == rse:
-                    # if the RSE was X, then rses like X_Y will appear in this list too,
-                    # so double check that we get the right RSE
-                    runs.append(timestamp)
-        return sorted(runs)[-nlast:]
+        return self.RunIndex.runs(rse)[-nlast:]
         
     def latest_run(self, rse):
         runs = self.list_runs(rse, 1)
@@ -141,48 +782,32 @@ class DataSource(object):
         return out
         
     def latest_stats_for_rse(self, rse):
-        files = sorted(glob.glob(f"{self.Path}/{rse}_*_stats.json"), reverse=True)
-        latest_file = None
-        latest_run = None
-        latest_stats = None
-        for path in files:
-            tup = self.parse_stats_path(path)
-            if tup:
-                r, run = tup
-                if r == rse:
-                    stats = self.read_stats(rse, run, path=path)
-                    if stats:
-                        return stats
+        for run in self.RunIndex.runs(rse)[::-1]:
+            stats = self.read_stats(rse, run)
+            if stats:
+                return stats
         else:
             return None
             
     def all_stats_for_rse(self, rse, limit=NLAST_RUNS):
         out = []
-        files = sorted(glob.glob(f"{self.Path}/{rse}_*_stats.json"))
-        for path in files:
-            r, run = self.parse_stats_path(path)
-            if r == rse:
-                data = self.read_stats(rse, run, path=path)
-                if data:
-                    out.append(data)
-        if limit is not None:
-            out = out[-limit:]
-        return out
+        for run in self.RunIndex.runs(rse)[::-1]:
+            if limit is not None and len(out) >= limit:
+                break
+            data = self.read_stats(rse, run)
+            if data:
+                out.append(data)
+        return out[::-1]
 
     def ls(self, rse="*", run="*", typ="*"):
-        pattern = f"{self.Path}/{rse}_{run}_{typ}.*"
-        files = set(glob.glob(pattern))
-        if run == "*":
-            files |= set(glob.glob(f"{self.Path}/{rse}_{typ}.*"))
-            if typ == "*":
-                files |= set(glob.glob(f"{self.Path}/{rse}_*"))
-        files = sorted(list(files))
+        files = []
+        for r in (self.RunIndex.rses() if rse == "*" else [rse]):
+            for fn in self.RunIndex.files(r):
+                if fnmatch(fn, f"{r}_{run}_{typ}.*") or run == "*" and (typ == "*" or fnmatch(fn, f"{r}_{typ}.*")):
+                    files.append(f"{self.Path}/{fn}")
+        files.sort()
         out = []
         for path in files:
-            if rse != "*":
-                _, r, _, _, _ = self.parse_path(path)
-                if r != rse:
-                    continue
             d = { "path": path, "error":"",
                 "size": None, "ctime":None, "ctime_text":None,
                 "real_path": None
@@ -210,35 +835,94 @@ class DataSource(object):
         return open(path, "r")
         
     def files(self, rse, typ="*"):
-        files = sorted(glob.glob(f"{self.Path}/{rse}_*_{typ}.*"))
-        return files
+        return [f"{self.Path}/{fn}" for fn in self.RunIndex.files(rse) if fnmatch(fn, f"{rse}_*_{typ}.*")]
         
     def open_file(self, path):
         return open(self.Path+"/"+path, "r")
 
-    def latest_empty_dir_counts(self, rse):
-        # returns latest empty dirs counts as a dictionary {rse->count}
-        all_stats = self.all_stats_for_rse(rse)
-        if not all_stats:   return None
-        out = None
-        for stats in all_stats[::-1]:           # latest first
-            scanner_stats = stats.get("scanner")
-            if not scanner_stats:
-                continue
-            if scanner_stats.get("status") != "done":
-                continue
-            if not scanner_stats.get("compute_empty_dirs"):
-                continue
-            root_stats = scanner_stats.get("roots")
-            if not root_stats:
-                continue
-            per_root_counts = {}
-            out = {"run": stats["run"], "root_counts": per_root_counts}
-            for stats in root_stats:
-                per_root_counts[stats["root"]] = stats.get("empty_directories", 0)
-            break
+    def stats_path(self, rse, run):
+        return f"{self.Path}/{rse}_{run}_stats.json"
+
+    def cached(self, kind, rse, run, compute, expires=None):
+        #
+        # compute(stats) is called only if the stats file has changed since the last call or, if expires is given,
+        # after the time returned by expires(stats, now) for the cached value
+        #
+        def compute_from_stats():
+            stats = self.read_stats(rse, run)
+            if stats is None:
+                return None, None
+            now = time.time()
+            value = compute(stats)
+            return value, (expires(stats, now) if expires is not None else None)
+        return self.SummaryCache.get(self.__class__.__name__ + "." + kind, self.stats_path(rse, run), compute_from_stats,
+            expiring=True)
+
+    # overridable
+    def summary_expires(self, stats, now):
+        # returns the time after which run_summary(stats) may be different, or None if it depends on the stats only
+        return None
+
+    def run_summary_for(self, rse, run):
+        # returns a copy of the cached run summary, or None if the stats can not be read.
+        # The copy is shallow, so the caller may add keys to it but should not modify the nested dictionaries.
+        summary = self.cached("run_summary", rse, run, self.run_summary, self.summary_expires)
+        return dict(summary) if summary is not None else None
+
+    def run_summaries_for_rse(self, rse, limit=NLAST_RUNS):
+        out = []
+        for run in self.RunIndex.runs(rse)[::-1]:
+            if limit is not None and len(out) >= limit:
+                break
+            summary = self.run_summary_for(rse, run)
+            if summary is not None:
+                out.append(summary)
+        return out[::-1]
+
+    def latest_run_summaries(self):
+        # returns {rse -> summary of the latest run with readable stats}
+        out = {}
+        for rse in self.list_rses():
+            for run in self.RunIndex.runs(rse)[::-1]:
+                summary = self.run_summary_for(rse, run)
+                if summary is not None:
+                    out[rse] = summary
+                    break
         return out
 
+    @staticmethod
+    def empty_dir_counts(stats):
+        # returns {"run":..., "root_counts": {root -> count}} or None if the run did not count the empty directories
+        scanner_stats = stats.get("scanner")
+        if not scanner_stats:
+            return None
+        if scanner_stats.get("status") != "done":
+            return None
+        if not scanner_stats.get("compute_empty_dirs"):
+            return None
+        root_stats = scanner_stats.get("roots")
+        if not root_stats:
+            return None
+        per_root_counts = {}
+        for r in root_stats:
+            per_root_counts[r["root"]] = r.get("empty_directories", 0)
+        return {"run": stats["run"], "root_counts": per_root_counts}
+
+    def latest_empty_dir_counts(self, rse):
+        # returns latest empty dirs counts as a dictionary {"run":..., "root_counts": {root->count}}
+        # looks at up to NLAST_RUNS latest runs with readable stats
+        n = 0
+        for run in self.RunIndex.runs(rse)[::-1]:
+            if n >= self.NLAST_RUNS:
+                break
+            # None - stats not readable, {"counts": None} - no empty directory counts in the run
+            cached = self.cached("empty_dir_counts", rse, run, lambda stats: {"counts": self.empty_dir_counts(stats)})
+            if cached is not None:
+                n += 1
+                if cached["counts"] is not None:
+                    return cached["counts"]
+        return None
+
     def latest_empty_dirs_count(self, rse):
         # returns (run, count) tuple
         data = self.latest_empty_dir_counts(rse)
@@ -249,8 +933,8 @@ class DataSource(object):
 
 class UMDataSource(DataSource):
 
-    def __init__(self, path, cache, ignore_list):
-        DataSource.__init__(self, path, cache)
+    def __init__(self, path, cache, ignore_list, run_index=None, summary_cache=None):
+        DataSource.__init__(self, path, cache, run_index, summary_cache)
         self.DefaultIgnoreRE = None if not ignore_list else re.compile("^(%s)" % ("|".join(ignore_list),))
 
     def get_stats(self, rse, run):
@@ -282,9 +966,9 @@ class UMDataSource(DataSource):
         return summary
         
     def open_file_list(self, rse, binary=True):
-        files = glob.glob(f"{self.Path}/{rse}_files.list*")
+        files = [fn for fn in self.RunIndex.files(rse) if fnmatch(fn, f"{rse}_files.list*")]
         if files:
-            path = files[0]
+            path = f"{self.Path}/{files[0]}"
         else:
             raise FileNotFoundError("not found")
         
@@ -346,8 +1030,8 @@ class CCDataSource(DataSource):
     MissingSection = "missing_action"
     EmptyDirSection = "empty_action"
 
-    def __init__(self, path, cache, new=False):
-        DataSource.__init__(self, path, cache)
+    def __init__(self, path, cache, new=False, run_index=None, summary_cache=None):
+        DataSource.__init__(self, path, cache, run_index, summary_cache)
         
     def config_file(self):
         return open(f"{self.Path}/ce_config.yaml", "r").read()
@@ -455,10 +1139,98 @@ class CCDataSource(DataSource):
 
         return limited_line_reader(f, limit)
 
+    LIST_CHUNK_SIZE = 1024*1024
+
+    def list_file(self, rse, run, typ):
+        # returns (path, compressed) for the stored list, or (None, None) if not found
+        path = f"{self.Path}/{rse}_{run}_{typ}.list"
+        if os.path.isfile(path + ".gz"):
+            return path + ".gz", True
+        elif os.path.isfile(path):
+            return path, False
+        return None, None
+
+    def raw_chunks(self, path, chunk_size=LIST_CHUNK_SIZE):
+        # stored bytes as is
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                yield data
+
+    def list_chunks(self, path, compressed, chunk_size=LIST_CHUNK_SIZE):
+        # uncompressed bytes, decompressed in large chunks
+        with (gzip.open(path, "rb") if compressed else open(path, "rb")) as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                yield data
+
+    def list_selection(self, path, compressed, offset=0, limit=None, prefix=None, chunk_size=LIST_CHUNK_SIZE):
+        #
+        # yields chunks of newline-terminated lines as bytes. Empty lines are ignored.
+        # prefix: only lines starting with it are selected
+        # offset, limit: skip the first <offset> selected lines and stop after <limit> lines
+        #
+        prefix = prefix.encode("utf-8") if prefix else None
+        tail = b""
+        skip = offset or 0
+        remaining = limit
+        for data in self.list_chunks(path, compressed, chunk_size):
+            lines = (tail + data).split(b"\n")
+            tail = lines.pop()
+            lines = [l for l in (line.strip() for line in lines) if l and (prefix is None or l.startswith(prefix))]
+            if skip:
+                n = min(skip, len(lines))
+                lines = lines[n:]
+                skip -= n
+            if remaining is not None:
+                lines = lines[:remaining]
+                remaining -= len(lines)
+            if lines:
+                yield b"\n".join(lines) + b"\n"
+            if remaining == 0:
+                return
+        tail = tail.strip()
+        if tail and (prefix is None or tail.startswith(prefix)) and not skip and remaining != 0:
+            yield tail + b"\n"
+
+    def list_index(self, rse, run, typ):
+        # returns ListIndex for the list, built once per file version, or None if the list is not found
+        path, compressed = self.list_file(rse, run, typ)
+        if path is None:
+            return None
+        return self.SummaryCache.get("list_index", path, lambda: ListIndex(path, compressed))
+
+    def list_page(self, rse, run, typ, page=0, page_size=1000, prefix=None):
+        # returns (total, paths) or (None, None) if the list is not found
+        index = self.list_index(rse, run, typ)
+        if index is None:
+            return None, None
+        start = page * page_size
+        if prefix:
+            return index.select(prefix, start, page_size)
+        return index.Total, index.page(start, page_size)
+
+    def rollup_path(self, rse, run):
+        return f"{self.Path}/{rse}_{run}_rollup.json"
+
+    def get_rollup(self, rse, run):
+        # returns per-directory counts computed by cmp3/rollup.py or None
+        path = self.rollup_path(rse, run)
+        if not os.path.isfile(path):
+            return None
+        return self.Cache.get(path)
+
     def file_lists_diffs_counts(self, rse, run):
         # compare dark or missing list from the run to the previous run
         # returns (prev_run, missing old count, dark_old count)
         # or (None, None, None)
+        #
+        # the counts are computed by cmp3/diffs.py and stored in the "diffs" section of the run stats.
+        # The lists are not compared here because it requires reading and comparing them on every page view.
 
         stats = self.get_data(rse, run, "stats")
         if stats is not None and "diffs" in stats:
@@ -468,39 +1240,68 @@ class CCDataSource(DataSource):
                 diffs["missing_old"],
                 diffs["dark_old"]
             )
+        return (None, None, None)
 
-        runs = self.list_runs(rse)
-        try:    this_i = runs.index(run)
-        except ValueError:
-            return (None, None, None)         # run not found
+    MAX_HISTORY = 10
 
-        this_dark = self.get_dark(rse, run)
-        this_missing = self.get_missing(rse, run)
-        this_lost = self.get_lost(rse, run)
-        if this_dark is None or this_missing is None:
-            return (None, None, None)         # one of the lists missing
+    def lists_diffs_view(self, rse):
+        rse_data = dict(
+                nmissing = None,
+                ndark = None,
+                prev_run=None,
+                last_run=None,
+                nmissing_old=None, 
+                ndark_old=None,
+        )
+        last_stats = self.latest_stats_for_rse(rse)
+        if last_stats is not None:
+            rse_data["last_run"] = last_run = last_stats["run"]
+            if last_stats.get("cmp3", {}).get("status") == "done":
+                rse_data["nmissing"] = last_stats["cmp3"]["missing"]
+                rse_data["ndark"] = last_stats["cmp3"]["dark"]
+                prev_run, missing_old, dark_old = self.file_lists_diffs_counts(rse, last_run)
+                if prev_run is not None:
+                    rse_data.update(dict(
+                            prev_run=prev_run,
+                            nmissing_old=missing_old,
+                            ndark_old=dark_old
+                    ))
+        return rse_data
 
-        prev_stats = prev_dark = prev_missing = None
-        prev_i = this_i - 1
-        if prev_i >= 0:
-            prev_run = runs[prev_i]
-            prev_stats, _, _, _, _ = self.get_stats(rse, prev_run)
-            if prev_stats is not None and prev_stats.get("cmp3", {}).get("status") == "done":
-                prev_dark = self.get_dark(rse, prev_run)
-                prev_missing = self.get_missing(rse, prev_run)
-
-        if prev_dark is None or prev_missing is None:
-            return (None, None, None)         # no run to compare to
-
-        this_dark = set(this_dark)
-        this_missing = set(this_missing)
-        prev_dark = set(prev_dark)
-        prev_missing = set(prev_missing)
-
-        old_missing = len(this_missing & prev_missing)
-        old_dark = len(this_dark & prev_dark)
+    def status_history_view(self, rse):
+        cc_summaries = self.run_summaries_for_rse(rse)
+        return dict(
+            cc_total = len(cc_summaries),
+            cc_success = len([x for x in cc_summaries if x.get("status") == "done"]),
+            cc_status_history=[
+                {
+                    "cc":       x.get("detection_status") if not x.get("disabled") else "disabled",
+                    "missing":  x.get("missing_stats",{}).get("action_status"),
+                    "dark":     x.get("dark_stats",{}).get("action_status")
+                }
+                for x in cc_summaries
+            ][-self.MAX_HISTORY:]
+        )
 
-        return (prev_run, old_missing, old_dark)
+    def runs_with_status(self, component, status, since=None):
+        # returns ([(rse, run, start_time), ...], source), source is "catalog" or "stats"
+        catalog = CatalogReader.open(self.Path)
+        if catalog is not None:
+            try:
+                return catalog.runs_with_status(component, status, since), "catalog"
+            except sqlite3.Error:
+                pass
+            finally:
+                catalog.close()
+        out = []
+        for rse in self.list_rses():
+            for run in self.RunIndex.runs(rse)[-self.NLAST_RUNS:]:
+                section = self.cached("component." + component, rse, run,
+                    lambda stats: {"status": stats.get(component, {}).get("status"), "start_time": stats.get(component, {}).get("start_time")})
+                if section is not None and section["status"] == status and \
+                            (since is None or (section["start_time"] or 0) >= since):
+                    out.append((rse, run, section["start_time"]))
+        return out, "stats"
 
     def get_dark(self, rse, run, limit=None):
         return self.get_dark_or_missing(rse, run, "D", limit)
@@ -536,6 +1337,23 @@ class CCDataSource(DataSource):
     DETECTION_COMPONENTS = ["dbdump_before", "scanner", "dbdump_after", "cmp3"]
     ACTION_COMPONENTS = [MissingSection, DarkSection]
     COMPONENTS = DETECTION_COMPONENTS + ACTION_COMPONENTS
+
+    HEARTBEAT_TIMEOUT = 30*60       # a started component is considered dead if its last heartbeat is older than that
+
+    def heartbeat_deadlines(self, stats):
+        # returns sorted times when the started components will be considered dead unless the heartbeat is updated
+        deadlines = []
+        for comp in self.COMPONENTS:
+            comp_stats = stats.get(comp)
+            if isinstance(comp_stats, dict) and comp_stats.get("status") == "started" \
+                        and comp_stats.get("heartbeat") is not None:
+                deadlines.append(comp_stats["heartbeat"] + self.HEARTBEAT_TIMEOUT)
+        return sorted(deadlines)
+
+    def summary_expires(self, stats, now):
+        # a "running" component turns into "died" when its heartbeat deadline passes
+        deadlines = [t for t in self.heartbeat_deadlines(stats) if t > now]
+        return deadlines[0] if deadlines else None
     
     def stage_status(self, stats, components):
         status = None
@@ -550,7 +1368,7 @@ class CCDataSource(DataSource):
                 comp_stats = stats[comp]
                 comp_status = comp_stats.get("status")
                 if comp_status == "started" and "heartbeat" in comp_stats:
-                    comp_status = "running" if comp_stats["heartbeat"] > time.time() - 30*60 else "died"
+                    comp_status = "running" if comp_stats["heartbeat"] > time.time() - self.HEARTBEAT_TIMEOUT else "died"
 
                 status_by_comp[comp] = comp_status
 
@@ -713,3 +1531,118 @@ class CCDataSource(DataSource):
                     ed_summary["action_status"] = "errors"
 
         return summary
+
+class ViewStore(Primitive):
+    #
+    # Materialized per-RSE views for the status_history and lists_diffs endpoints.
+    #
+    # The views for an RSE are recomputed only when its signature changes. The signature is the list of
+    # (run, stats file version, number of passed heartbeat deadlines) for the last NLAST_RUNS runs, so the views
+    # also change when a started component stops sending heartbeats and turns from "running" into "died".
+    # The signature is checked at most once per REFRESH_INTERVAL.
+    #
+    # If views_dir is given, the views are also saved into <views_dir>/<rse>_views.json so that a restarted server
+    # does not need to recompute them. The views are not written into the data directory, because that would
+    # change its mtime and make the RunIndex re-scan it. If views_dir is not given or is read-only,
+    # the views are kept in memory only.
+    #
+
+    REFRESH_INTERVAL = 30           # seconds
+    VERSION = 2                     # views file format version
+
+    def __init__(self, data_source, views_dir=None, refresh_interval=REFRESH_INTERVAL):
+        Primitive.__init__(self)
+        self.DataSource = data_source
+        self.ViewsDir = views_dir
+        self.RefreshInterval = refresh_interval
+        self.Entries = {}           # {rse -> {"signature":..., "version":..., "views":..., "checked": t}}
+        self.Hits = 0
+        self.Loaded = 0
+        self.Recomputed = 0
+        self.WriteErrors = 0
+
+    def views_path(self, rse):
+        return f"{self.ViewsDir}/{rse}_views.json"
+
+    def signature(self, rse, now):
+        data_source = self.DataSource
+        signature = []
+        for run in data_source.RunIndex.runs(rse)[-data_source.NLAST_RUNS:]:
+            try:    version = file_version(data_source.stats_path(rse, run))
+            except OSError:
+                version = None
+            deadlines = data_source.cached("heartbeat_deadlines", rse, run, data_source.heartbeat_deadlines) or []
+            passed = len([t for t in deadlines if t <= now])
+            signature.append([run, list(version) if isinstance(version, tuple) else version, passed])
+        return signature
+
+    def load(self, rse):
+        if self.ViewsDir is None:
+            return None
+        try:
+            with open(self.views_path(rse), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("format") != self.VERSION:
+            return None
+        self.Loaded += 1
+        return entry
+
+    def save(self, rse, entry):
+        if self.ViewsDir is None:
+            return
+        path = self.views_path(rse)
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(dict(format=self.VERSION, signature=entry["signature"], version=entry["version"],
+                    views=entry["views"]), f)
+            os.replace(tmp, path)
+        except OSError:
+            self.WriteErrors += 1
+
+    @synchronized
+    def refresh(self, rse, now):
+        entry = self.Entries.get(rse)
+        if entry is not None and now < entry["checked"] + self.RefreshInterval:
+            return entry                # refreshed by another thread
+        signature = self.signature(rse, now)
+        if entry is None:
+            entry = self.load(rse)
+        if entry is None or entry["signature"] != signature:
+            views = dict(
+                status_history = self.DataSource.status_history_view(rse),
+                lists_diffs = self.DataSource.lists_diffs_view(rse)
+            )
+            version = hashlib.sha1(json.dumps(views, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+            entry = dict(signature=signature, version=version, views=views)
+            self.Recomputed += 1
+            self.save(rse, entry)
+        entry["checked"] = now
+        self.Entries[rse] = entry
+        return entry
+
+    def entry(self, rse):
+        now = time.time()
+        entry = self.Entries.get(rse)
+        if entry is not None and now < entry["checked"] + self.RefreshInterval:
+            self.Hits += 1
+            return entry
+        return self.refresh(rse, now)
+
+    def get(self, kind, rses):
+        # returns (etag, {rse -> view}). The etag changes only when one of the views changes
+        entries = [(rse, self.entry(rse)) for rse in sorted(rses)]
+        versions = [(rse, e["version"]) for rse, e in entries]
+        etag = '"%s"' % (hashlib.sha1(json.dumps([kind, versions]).encode("utf-8")).hexdigest()[:24],)
+        return etag, {rse: e["views"][kind] for rse, e in entries}
+
+    def stats(self):
+        return {
+            "rses":         len(self.Entries),
+            "hits":         self.Hits,
+            "loaded":       self.Loaded,
+            "recomputed":   self.Recomputed,
+            "write_errors": self.WriteErrors
+        }
@@ -0,0 +1,204 @@
+import time, threading, bisect
+from pythreader import Primitive, synchronized
+
+#
+# Request scheduling for the monitor app.
+#
+# Requests are split into 2 classes with separate bounded worker pools, so that a few expensive requests
+# can not starve the page renders:
+#   bulk    - requests which take long to serve: list and file downloads, full list scans, ...
+#   page    - everything else
+# The class is chosen by cost. Requests are grouped by handler method and the names of the query arguments,
+# e.g. "ce/list_page?page&prefix&rse&run&typ", and a group whose recent mean service time (not counting
+# the wait for a pool slot) is above BULK_SERVICE_TIME goes to the bulk pool. Until a group has MIN_SAMPLES
+# requests, the list and file downloads (BulkMethods) are assumed to be bulk.
+#
+# The pool slot is held until the response body is fully sent, because the downloads are streamed.
+# Every request waiting for a slot holds a server connection thread, so the number of waiting requests per
+# pool is limited and the wait is limited to QUEUE_TIMEOUT. Requests beyond that get "503 Service Unavailable"
+# with Retry-After instead of holding a connection.
+#
+# Latency histograms, including the time spent waiting for a pool slot, are collected per request group.
+#
+
+class LatencyHistogram(object):
+
+    Buckets = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)       # upper bounds, seconds
+
+    SERVICE_TIME_WEIGHT = 0.2       # weight of the latest request in the service time moving average
+
+    def __init__(self):
+        self.Counts = [0] * (len(self.Buckets) + 1)              # last bucket is for > Buckets[-1]
+        self.N = 0
+        self.Sum = 0.0
+        self.Max = 0.0
+        self.WaitSum = 0.0
+        self.ServiceTime = None         # moving average of elapsed - wait
+
+    def add(self, elapsed, wait):
+        self.Counts[bisect.bisect_left(self.Buckets, elapsed)] += 1
+        self.N += 1
+        self.Sum += elapsed
+        self.Max = max(self.Max, elapsed)
+        self.WaitSum += wait
+        service = elapsed - wait
+        if self.ServiceTime is None:
+            self.ServiceTime = service
+        else:
+            self.ServiceTime += (service - self.ServiceTime) * self.SERVICE_TIME_WEIGHT
+
+    def as_json(self):
+        labels = ["<=%s" % (b,) for b in self.Buckets] + [">%s" % (self.Buckets[-1],)]
+        return {
+            "count":        self.N,
+            "mean":         self.Sum/self.N if self.N else None,
+            "max":          self.Max,
+            "mean_wait":    self.WaitSum/self.N if self.N else None,
+            "service_time": self.ServiceTime,
+            "buckets":      dict(zip(labels, self.Counts))
+        }
+
+class ScheduledResponse(object):
+    # wraps WSGI response iterable, releases the pool slot and records the latency when the response is closed
+
+    def __init__(self, scheduler, response, pool, method, t0, wait):
+        self.Scheduler = scheduler
+        self.Response = response
+        self.Pool = pool
+        self.Method = method
+        self.T0 = t0
+        self.Wait = wait
+        self.Closed = False
+
+    def __iter__(self):
+        return iter(self.Response)
+
+    def close(self):
+        if self.Closed:
+            return
+        self.Closed = True
+        try:
+            if hasattr(self.Response, "close"):
+                self.Response.close()
+        finally:
+            self.Scheduler.done(self.Pool, self.Method, self.T0, self.Wait)
+
+class RequestScheduler(Primitive):
+
+    BulkMethods = {"dark", "dark_confirmed", "missing", "lost", "files", "file", "ls"}
+    BULK_SERVICE_TIME = 1.0         # seconds
+    MIN_SAMPLES = 5
+    QUEUE_TIMEOUT = 30.0            # seconds
+    RETRY_AFTER = 10                # seconds, for rejected requests
+
+    def __init__(self, page_workers, bulk_workers, prefix=None, page_queue=None, bulk_queue=None):
+        #
+        # page_queue, bulk_queue: max number of requests waiting for a pool slot,
+        #   default: 4 times the page pool size and the bulk pool size
+        #
+        Primitive.__init__(self)
+        self.Prefix = prefix
+        self.PoolSizes = {"page": page_workers, "bulk": bulk_workers}
+        self.QueueLimits = {
+            "page": page_queue if page_queue is not None else 4*page_workers,
+            "bulk": bulk_queue if bulk_queue is not None else bulk_workers
+        }
+        self.Pools = {name: threading.BoundedSemaphore(n) for name, n in self.PoolSizes.items()}
+        self.Active = {name: 0 for name in self.PoolSizes}
+        self.Waiting = {name: 0 for name in self.PoolSizes}
+        self.Rejected = {name: 0 for name in self.PoolSizes}
+        self.Histograms = {}            # {request group -> LatencyHistogram}
+
+    def method_name(self, environ):
+        # "ce/index", "unmerged/files", ...
+        path = environ.get("PATH_INFO", "")
+        if self.Prefix and path.startswith(self.Prefix):
+            path = path[len(self.Prefix):]
+        words = [w for w in path.split("/") if w]
+        return "/".join(words[:2]) or "index"
+
+    def request_group(self, environ):
+        # method name and the names of the query arguments, the cost is tracked per group
+        method = self.method_name(environ)
+        names = sorted(set(item.split("=", 1)[0] for item in environ.get("QUERY_STRING", "").split("&") if item))
+        return method + ("?" + "&".join(names) if names else "")
+
+    def pool_name(self, group):
+        h = self.Histograms.get(group)
+        if h is not None and h.N >= self.MIN_SAMPLES:
+            return "bulk" if h.ServiceTime >= self.BULK_SERVICE_TIME else "page"
+        method = group.split("?", 1)[0]
+        return "bulk" if method.rsplit("/", 1)[-1] in self.BulkMethods else "page"
+
+    def acquire(self, pool):
+        # returns True if the pool slot was acquired, False if the request has to be rejected
+        semaphore = self.Pools[pool]
+        if semaphore.acquire(blocking=False):
+            return True
+        if not self.enqueue(pool):
+            return False
+        try:
+            return semaphore.acquire(timeout=self.QUEUE_TIMEOUT)
+        finally:
+            self.dequeue(pool)
+
+    @synchronized
+    def enqueue(self, pool):
+        if self.Waiting[pool] >= self.QueueLimits[pool]:
+            return False
+        self.Waiting[pool] += 1
+        return True
+
+    @synchronized
+    def dequeue(self, pool):
+        self.Waiting[pool] -= 1
+
+    @synchronized
+    def rejected(self, pool):
+        self.Rejected[pool] += 1
+
+    def handle(self, environ, start_response, app):
+        t0 = time.time()
+        group = self.request_group(environ)
+        pool = self.pool_name(group)
+        if not self.acquire(pool):
+            self.rejected(pool)
+            start_response("503 Service Unavailable", [("Content-Type", "text/plain"), ("Retry-After", str(self.RETRY_AFTER))])
+            return [b"Server busy, try again later\n"]
+        wait = time.time() - t0
+        self.started(pool)
+        try:
+            response = app(environ, start_response)
+        except:
+            self.done(pool, group, t0, wait)
+            raise
+        return ScheduledResponse(self, response, pool, group, t0, wait)
+
+    @synchronized
+    def started(self, pool):
+        self.Active[pool] += 1
+
+    def done(self, pool, group, t0, wait):
+        self.record(pool, group, time.time() - t0, wait)
+        self.Pools[pool].release()
+
+    @synchronized
+    def record(self, pool, group, elapsed, wait):
+        self.Active[pool] -= 1
+        h = self.Histograms.get(group)
+        if h is None:
+            h = self.Histograms[group] = LatencyHistogram()
+        h.add(elapsed, wait)
+
+    @synchronized
+    def stats(self):
+        return {
+            "pools":    {name: {
+                            "size":         self.PoolSizes[name],
+                            "active":       self.Active[name],
+                            "waiting":      self.Waiting[name],
+                            "queue_limit":  self.QueueLimits[name],
+                            "rejected":     self.Rejected[name]
+                        } for name in self.PoolSizes},
+            "methods":  {group: dict(h.as_json(), pool=self.pool_name(group)) for group, h in sorted(self.Histograms.items())}
+        }
@@ -3,7 +3,8 @@ import sys, glob, json, time, os, gzip
 from datetime import datetime
 from um_handler import UMHandler
 from ce_handler import CEHandler
-from data_source import CCDataSource, UMDataSource, StatsCache
+from data_source import CCDataSource, UMDataSource, StatsCache, RunIndex, SummaryCache, CacheWarmer, ViewStore
+from request_scheduler import RequestScheduler
 
 Version = "2.5.4"
 
@@ -48,6 +49,12 @@ class Handler(WPHandler):
     def probe(self, request, relpath, **args):
         return self.ce.probe(request, relpath, **args)
 
+    def request_stats(self, request, relpath, **args):
+        scheduler = self.App.Scheduler
+        if scheduler is None:
+            return json.dumps({"scheduler": "disabled"}), "text/json"
+        return json.dumps(scheduler.stats()), "text/json"
+
 def as_dt(t):
     # datetim in UTC
     if t is None:
@@ -135,17 +142,39 @@ def format_human(n):
 class App(WPApp):
 
     Version = Version
+    BULK_WORKERS = 2
     
-    def __init__(self, handler, home, cc_path, prefix, um_path, um_ignore_list):
+    def __init__(self, handler, home, cc_path, prefix, um_path, um_ignore_list,
+                cache_entries=StatsCache.MAX_ENTRIES, cache_bytes=StatsCache.MAX_BYTES, warmup_workers=None,
+                workers=None, bulk_workers=None, bulk_queue=None, views_dir=None):
         WPApp.__init__(self, handler, prefix=prefix)
+        self.Scheduler = None
+        if workers:
+            self.Scheduler = RequestScheduler(workers, bulk_workers or self.BULK_WORKERS, prefix, bulk_queue=bulk_queue)
         self.CCPath = cc_path
         self.UMPath = um_path
         self.UMIgnoreList = um_ignore_list
         self.Home = home
-        self.StatsCache = StatsCache()
-        self.StatsCache.init(cc_path)
-        self.StatsCache.init(um_path)
-        print("Stats cache initialized with", len(self.StatsCache), "entries")
+        self.StatsCache = StatsCache(cache_entries, cache_bytes)
+        self.CacheWarmer = None
+        if warmup_workers is None:
+            self.StatsCache.init(cc_path)
+            self.StatsCache.init(um_path)
+            print("Stats cache initialized with", len(self.StatsCache), "entries")
+        elif warmup_workers > 0:
+            self.CacheWarmer = CacheWarmer(self.StatsCache, [cc_path, um_path], warmup_workers).start()
+            print("Stats cache warm-up started with", warmup_workers, "workers")
+        self.CCRunIndex = RunIndex(cc_path)
+        self.UMRunIndex = RunIndex(um_path)
+        self.SummaryCache = SummaryCache()
+        self.ViewStore = ViewStore(CCDataSource(cc_path, self.StatsCache, run_index=self.CCRunIndex,
+                summary_cache=self.SummaryCache), views_dir)
+
+    def __call__(self, environ, start_response):
+        if self.Scheduler is None:
+            return WPApp.__call__(self, environ, start_response)
+        return self.Scheduler.handle(environ, start_response, 
+            lambda environ, start_response: WPApp.__call__(self, environ, start_response))
 
     def init(self):
         self.initJinjaEnvironment(tempdirs=[self.Home],
@@ -162,13 +191,29 @@ class App(WPApp):
 
 
 Usage = """
-python server.py [-r <url prefix to remove>] -p <port> <cc data path> <wm data path>
-"""
+python server.py [options] -p <port> <cc data path> <wm data path>
+    -r <url prefix to remove>
+    --um-ignore=<path>,...
+    --cache-entries=<n>         - max number of stats files in the stats cache, default %d
+    --cache-mb=<n>              - max total size of stats files in the stats cache in MB, default %d
+    --warmup=<n>                - start serving immediately and fill the stats cache in the background
+                                  using <n> threads, newest runs first. 0 - do not pre-fill the cache.
+                                  Default: fill the cache before starting the server
+    --workers=<n>               - serve up to <n> page requests concurrently, with separate pool for expensive
+                                  requests like list and file downloads. Default: no request scheduling
+    --bulk-workers=<n>          - with --workers, number of concurrent expensive requests, default %d
+    --bulk-queue=<n>            - with --workers, max number of expensive requests waiting for a worker, the others
+                                  get "503 Service Unavailable". Default: same as --bulk-workers
+    --max-connections=<n>       - max number of concurrent connections, default: web server default
+    --views-dir=<path>          - directory to save the precomputed status views to, so that they survive restarts.
+                                  Must not be the CC data directory. Default: keep the views in memory only
+""" % (StatsCache.MAX_ENTRIES, StatsCache.MAX_BYTES//(1024*1024), App.BULK_WORKERS)
 
 if __name__ == "__main__":
     import sys, getopt
 
-    opts, args = getopt.getopt(sys.argv[1:], "r:ldp:", ["um-ignore="])
+    opts, args = getopt.getopt(sys.argv[1:], "r:ldp:", ["um-ignore=", "cache-entries=", "cache-mb=", "warmup=", "workers=", "bulk-workers=",
+            "bulk-queue=", "max-connections=", "views-dir="])
     opts = dict(opts)
 
     if not args:
@@ -185,8 +230,27 @@ if __name__ == "__main__":
     if um_ignore_list:
         um_ignore_list = um_ignore_list.split(",")
 
+    cache_entries = int(opts.get("--cache-entries", StatsCache.MAX_ENTRIES))
+    cache_bytes = int(opts.get("--cache-mb", StatsCache.MAX_BYTES//(1024*1024)))*1024*1024
+    warmup_workers = opts.get("--warmup")
+    if warmup_workers is not None:
+        warmup_workers = int(warmup_workers)
+    workers = int(opts.get("--workers", 0)) or None
+    bulk_workers = int(opts.get("--bulk-workers", App.BULK_WORKERS))
+    bulk_queue = opts.get("--bulk-queue")
+    if bulk_queue is not None:
+        bulk_queue = int(bulk_queue)
+    views_dir = opts.get("--views-dir")
+    if views_dir is not None and os.path.realpath(views_dir) == os.path.realpath(cc_path):
+        print("The views directory must be different from the CC data directory")
+        sys.exit(2)
+    server_args = {}
+    if "--max-connections" in opts:
+        server_args["max_connections"] = int(opts["--max-connections"])
+
     print("Starting server:\n  port %s\n  CC path %s\n  WM path %s" % (port, cc_path, wm_path))
 
     sys.stdout.flush()
     home = os.path.dirname(__file__) or "."
-    App(Handler, home, cc_path, prefix, wm_path, um_ignore_list).run_server(port, logging=logging, debug=debug)
+    App(Handler, home, cc_path, prefix, wm_path, um_ignore_list, cache_entries, cache_bytes, warmup_workers,
+            workers, bulk_workers, bulk_queue, views_dir).run_server(port, logging=logging, debug=debug, **server_args)
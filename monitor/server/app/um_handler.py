@@ -25,7 +25,8 @@ class UMHandler(WPHandler):
     
     def __init__(self, *params, **args):
         WPHandler.__init__(self, *params, **args)
-        self.DataSource = UMDataSource(self.App.UMPath, self.App.StatsCache, self.App.UMIgnoreList)
+        self.DataSource = UMDataSource(self.App.UMPath, self.App.StatsCache, self.App.UMIgnoreList, self.App.UMRunIndex,
+                self.App.SummaryCache)
         self.static = WPStaticHandler(*params, **args)
     
     def version(self, request, replapth, **args):
@@ -157,8 +158,7 @@ class UMHandler(WPHandler):
         um_data_source = self.DataSource
         attention = attention == "yes"
 
-        um_stats = um_data_source.latest_stats_per_rse()
-        summaries = [(rse, um_data_source.run_summary(stats)) for rse, stats in um_stats.items()]
+        summaries = list(um_data_source.latest_run_summaries().items())
         for rse, summary in summaries:
             summary["rse"] = rse
         summaries = [summary for _, summary in summaries]
@@ -243,7 +243,7 @@ class UMHandler(WPHandler):
         
         for rse in rses:
             if not rse: continue
-            um_summaries = [um_data_source.run_summary(x) for x in um_data_source.all_stats_for_rse(rse)]
+            um_summaries = um_data_source.run_summaries_for_rse(rse)
             
             um_total = um_success = 0
             
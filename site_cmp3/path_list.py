@@ -1,138 +1,210 @@
 from gzip import GzipFile
+import json, bisect
+
+from py3 import to_bytes, to_str
+from sort_merge import ExternalSort
 
 Usage = """
-pyhton path_list.py compress <input> <putput>
-pyhton path_list.py decompress <input> <putput>
+pyhton path_list.py compress [-z] <input> <output>
+pyhton path_list.py decompress [-z] <input> <output>
+pyhton path_list.py lookup <input> <prefix>
+
+    -z - use plain gzip format instead of the prefix-compressed format
+
+The prefix-compressed format is a text file with one path per line, written as "<n>:<tail>" where <n> is the
+length of the prefix shared with the previous path. Paths are sorted. Every RESTART_INTERVAL-th path is stored
+in full ("0:<path>"), and the offsets of these restart points are stored in the index file <output>.idx,
+which is used by lookup to find the first path with given prefix without reading the whole file.
 """
 
-from py3 import to_bytes, to_str
+def index_path(path):
+    return path + ".idx"
 
 class PathListRead(object):
-    
-    def __init__(self, f):
+
+    def __init__(self, f, index=None):
+        # f: file open in binary mode
+        # index: the index data as saved by PathListWrite, needed for seek() and lookup()
         self.F = f
         self.LastPath = ""
-        
+        self.Index = index
+        self.RestartPaths = [path for path, _ in index["restarts"]] if index else []
+
+    @staticmethod
+    def open(path, use_index=True):
+        index = None
+        if use_index:
+            with open(index_path(path), "r") as f:
+                index = json.load(f)
+        return PathListRead(open(path, "rb"), index)
+
     def read(self):
-        done = False
-        while not done:
+        while True:
             line = self.F.readline()
             if not line:    return None     # EOF
-            line = line.strip()
+            line = to_str(line).rstrip("\n")
             if line:
                 words = line.split(":",1)
                 n = int(words[0])
                 tail = words[1]
                 self.LastPath = self.LastPath[:n] + tail
                 return self.LastPath
-    
+
     def paths(self):
-        done = False
-        while not done:
+        while True:
             path = self.read()
-            if not path:    break
+            if path is None:    break
             yield path
-            
+
+    def __iter__(self):
+        return self.paths()
+
+    def seek(self, prefix):
+        #
+        # positions the reader at the restart point preceding the first path >= prefix
+        #
+        assert self.Index is not None, "Index is required for seek()"
+        i = bisect.bisect_left(self.RestartPaths, prefix) - 1
+        offset = self.Index["restarts"][i][1] if i >= 0 else 0
+        self.F.seek(offset, 0)
+        self.LastPath = ""
+
+    def lookup(self, prefix):
+        # yields all paths starting with prefix
+        self.seek(prefix)
+        for path in self.paths():
+            if path.startswith(prefix):
+                yield path
+            elif path > prefix:
+                break
+
+    def close(self):
+        self.F.close()
+
 class PathListWrite(object):
 
-    BUFFER_SIZE = 100000
-    
-    def __init__(self, f):
+    RESTART_INTERVAL = 128
+
+    def __init__(self, f, index_file=None, tmp_dir=None, restart_interval=RESTART_INTERVAL):
+        # f: file open in binary mode
+        # index_file: file to write the index into, open in text mode, optional
         self.F = f
-        self.LastPath = []
-        self.Buffer = []
-        
+        self.IndexFile = index_file
+        self.Sorter = ExternalSort(tmp_dir=tmp_dir)
+        self.RestartInterval = restart_interval
+        self.Count = 0
+
     def write(self, path):
-        print("write: path:", repr(path))
-        self.Buffer.append(path)
-        if len(self.Buffer) >= self.BUFFER_SIZE:
-            self.flush()
-    
+        self.Sorter.add(path)
+
     def flush(self):
-        paths = sorted(self.Buffer)
-        for path in paths:
-            min_len = min(len(path), len(self.LastPath))
-            n = 0
-            for n, (a, b) in enumerate(zip(path, self.LastPath)):
-                if a != b:  break
-            self.F.write("%d:%s" % (n, path[n:]))
-            self.LastPath = path
-        self.Buffer = []
-    
+        restarts = []
+        last_path = ""
+        offset = self.F.tell()
+        for path in self.Sorter.sorted():
+            if self.Count % self.RestartInterval == 0:
+                restarts.append((path, offset))
+                n = 0
+            else:
+                n = 0
+                for a, b in zip(path, last_path):
+                    if a != b:  break
+                    n += 1
+            line = to_bytes("%d:%s\n" % (n, path[n:]))
+            self.F.write(line)
+            offset += len(line)
+            last_path = path
+            self.Count += 1
+        if self.IndexFile is not None:
+            json.dump({
+                    "version":          1,
+                    "count":            self.Count,
+                    "restart_interval": self.RestartInterval,
+                    "restarts":         restarts
+                }, self.IndexFile)
+
     def close(self):
         self.flush()
         self.F.close()
-        
+        if self.IndexFile is not None:
+            self.IndexFile.close()
+
 class PathListWrite_gzip(object):
 
     def __init__(self, f):
         self.F = f
         self.G = GzipFile(fileobj=f, mode="wb")
-        
+
     def write(self, path):
         self.G.write(to_bytes(path+"\n"))
-    
+
     def flush(self):
         pass
-    
+
     def close(self):
         self.G.close()
-        
+
 class PathListRead_gzip(object):
-    
+
     def __init__(self, f):
         self.F = f
         self.G = GzipFile(fileobj=f, mode="rb")
-        
+
     def read(self):
-        done = False
-        while not done:
-            line = self.G.readline()
-            if not line:    return None     # EOF
-            path = line.strip()
-            return path
-    
+        line = self.G.readline()
+        if not line:    return None     # EOF
+        return to_str(line).strip()
+
     def paths(self):
-        done = False
-        while not done:
+        while True:
             path = self.read()
-            if not path:    break
+            if path is None:    break
             yield path
-            
 
-        
 if __name__ == "__main__":
-    import sys
-    
-    if len(sys.argv[1:]) < 3:
+    import sys, getopt
+
+    opts, args = getopt.getopt(sys.argv[1:], "z")
+    opts = dict(opts)
+    use_gzip = "-z" in opts
+
+    if len(args) < 3:
         print (Usage)
         sys.exit(2)
 
-    cmd, inp, out = sys.argv[1:]
-    
-    if sys.argv[1] == "compress":
+    cmd, inp, out = args
+
+    if cmd == "compress":
         if inp == "-":
             inp = sys.stdin
         else:
             inp = open(inp, "r")
-        out = open(out, "wb")
-        w = PathListWrite_gzip(out)
-        for line in inp.readlines():
+        if use_gzip:
+            w = PathListWrite_gzip(open(out, "wb"))
+        else:
+            w = PathListWrite(open(out, "wb"), open(index_path(out), "w"))
+        for line in inp:
             path = line.strip()
             if path:
                 w.write(path)
         w.close()
-    else:
-        inp = open(inp, "rb")
+    elif cmd == "decompress":
+        if use_gzip:
+            r = PathListRead_gzip(open(inp, "rb"))
+        else:
+            r = PathListRead.open(inp, use_index=False)
         if out == "-":
             out = sys.stdout
         else:
             out = open(out, "w")
-        r = PathListRead_gzip(inp)
         for path in r.paths():
-            out.write(to_str(path)+"\n")
+            out.write(path+"\n")
         out.close()
-    
-        
-            
-            
+    elif cmd == "lookup":
+        prefix = out
+        r = PathListRead.open(inp)
+        for path in r.lookup(prefix):
+            print(path)
+    else:
+        print (Usage)
+        sys.exit(2)
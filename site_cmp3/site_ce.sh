@@ -169,6 +169,7 @@ $python actions/declare_dark.py    -o ${d_action_list} -c ${config_file} -s $sta
 
 end_time=`date -u +%s`
 
-$python cmp3/stats.py stats.json << _EOF_
-{ "end_time":${end_time}.0 }
+# -c: fold the pending stats events into the stats file at the end of the run
+$python cmp3/stats_log.py batch -c $stats << _EOF_
+set end_time ${end_time}.0
 _EOF_
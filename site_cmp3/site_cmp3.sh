@@ -193,8 +193,16 @@ rce_cmp5 -z -s ${stats} \
     ${am_prefix} ${ad_prefix} \
     ${d_out} ${m_out}
 
-# 4.1 Calculate diffs with previous run
-$python cmp3/diffs.py -u -s ${stats} $out $RSE $now
+# 4.1 Add the compared run to the run catalog, if the out dir has one, so that the following steps see it complete
+if [ -f ${out}/catalog.sqlite ]; then
+    $python cmp3/catalog.py sync $out
+fi
+
+# 4.2 Calculate diffs with previous run
+$python cmp3/diffs.py -u -l -s ${stats} $out $RSE $now
+
+# 4.3 Per-directory counts of dark and missing files
+$python cmp3/rollup.py -u -s ${stats} $out $RSE $now
 
 #
 # 5. Declare missing and dark replicas
@@ -234,13 +242,17 @@ $python actions/remove_empty_dirs.py -s $stats -c ${merged_config_file} -L 10000
 end_time=`date -u +%s`
 elapsed_time=$((end_time - timestamp))
 
-rce_update_stats $stats << _EOF_
-{ 
-    "end_time": ${end_time}.0,
-    "elapsed_time": ${elapsed_time}.0
-}
+# -c: fold the pending stats events into the stats file before it is pushed to Prometheus
+$python cmp3/stats_log.py batch -c $stats << _EOF_
+set end_time ${end_time}.0
+set elapsed_time ${elapsed_time}.0
 _EOF_
 
+# 6.1 Update the run catalog with the final stats
+if [ -f ${out}/catalog.sqlite ]; then
+    $python cmp3/catalog.py sync $out
+fi
+
 #
 # 7. Push2Prometheus
 #
@@ -113,6 +113,7 @@ $python actions/remove_empty_dirs.py -s $stats -c ${config_file} -L 10000 $out $
 
 end_time=`date -u +%s`
 
-$python cmp3/stats.py $stats << _EOF_
-{ "end_time":${end_time}.0 }
+# -c: fold the pending stats events into the stats file at the end of the run
+$python cmp3/stats_log.py batch -c $stats << _EOF_
+set end_time ${end_time}.0
 _EOF_
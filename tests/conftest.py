@@ -0,0 +1,14 @@
+import os, sys
+
+# the cmp3 scripts import each other as top level modules
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ScriptDirs = [os.path.join(Root, "cmp3"), os.path.join(Root, "cmp3", "old")]
+for d in ScriptDirs[::-1]:
+    if d not in sys.path:
+        sys.path.insert(0, d)
+
+def script_env():
+    # environment for running the cmp3 scripts as subprocesses
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(ScriptDirs + [env.get("PYTHONPATH", "")])
+    return env
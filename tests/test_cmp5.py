@@ -0,0 +1,42 @@
+import json, os, subprocess, sys
+from conftest import Root, script_env
+from part import PartitionedList
+
+NPARTS = 3
+
+def write_list(prefix, paths):
+    lst = PartitionedList.create(NPARTS, prefix)
+    for path in paths:
+        lst.add(path)
+    lst.close()
+    return prefix
+
+def read_list(path):
+    with open(path) as f:
+        return sorted(line.strip() for line in f if line.strip())
+
+def run_cmp5(tmp_path, name, *options):
+    common = ["/store/common/f%d" % (i,) for i in range(50)]
+    b_m = write_list(str(tmp_path / "b_m"), common + ["/store/missing/m1", "/store/missing/m2", "/store/new/b1"])
+    b_d = write_list(str(tmp_path / "b_d"), common + ["/store/missing/m1", "/store/missing/m2"])
+    # R has a repeated path, which must be counted as a duplicate and not reported
+    r = write_list(str(tmp_path / "r"), common + ["/store/dark/d1", "/store/dark/d2", "/store/dark/d1"])
+    a_m = write_list(str(tmp_path / "a_m"), common + ["/store/missing/m1", "/store/missing/m2", "/store/new/a1"])
+    a_d = write_list(str(tmp_path / "a_d"), common + ["/store/missing/m1", "/store/missing/m2"])
+    stats = tmp_path / (name + "_stats.json")
+    dark, missing = tmp_path / (name + "_D.list"), tmp_path / (name + "_M.list")
+    subprocess.run([sys.executable, os.path.join(Root, "cmp3", "old", "cmp5.py"), "-s", str(stats)] + list(options)
+            + [b_m, b_d, r, a_m, a_d, str(dark), str(missing)],
+        env=script_env(), check=True, stdout=subprocess.DEVNULL)
+    with open(stats) as f:
+        return read_list(dark), read_list(missing), json.load(f)["cmp3"]
+
+def test_parallel_fingerprints(tmp_path):
+    dark, missing, stats = run_cmp5(tmp_path, "fp", "-j", "2", "-f")
+    assert dark == ["/store/dark/d1", "/store/dark/d2"]
+    assert missing == ["/store/missing/m1", "/store/missing/m2"]
+    assert stats["status"] == "done"
+    assert stats["fingerprints"] == {"duplicates": 1, "collisions": 0}
+
+def test_parallel_fingerprints_match_sets(tmp_path):
+    assert run_cmp5(tmp_path, "fp", "-j", "2", "-f")[:2] == run_cmp5(tmp_path, "sets", "-j", "2")[:2]
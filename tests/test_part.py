@@ -0,0 +1,35 @@
+import random
+from part import PartitionedList, _BinaryPartitionWriter, _BinaryPartitionReader
+
+def test_binary_partition_spilled_sort(tmp_path):
+    paths = ["/store/data/%05d/file_%d.root" % (random.randrange(1000), i) for i in range(5000)]
+    path = str(tmp_path / "p.00000.plb")
+    writer = _BinaryPartitionWriter(path, 0, 1, sort_run_size=700)
+    for p in paths + paths[:100]:                   # with duplicates
+        writer.write(p + "\n")
+    writer.close()
+    assert sorted(tmp_path.iterdir()) == [tmp_path / "p.00000.plb"]         # sort runs removed
+    reader = _BinaryPartitionReader(path)
+    assert reader.Sorted and reader.Count == len(paths)
+    assert list(reader) == sorted(paths)
+
+def test_binary_partition_unsorted(tmp_path):
+    paths = ["/store/data/file_%d.root" % (i,) for i in range(3000)][::-1]
+    path = str(tmp_path / "u.00000.plb")
+    writer = _BinaryPartitionWriter(path, 0, 1, sort=False)
+    for p in paths:
+        writer.write(p)
+    writer.close()
+    reader = _BinaryPartitionReader(path)
+    assert not reader.Sorted and reader.Count == len(paths)
+    assert list(reader) == paths
+
+def test_binary_partitioned_list(tmp_path):
+    paths = ["/store/mc/file_%d.root" % (i,) for i in range(2000)]
+    lst = PartitionedList.create(4, str(tmp_path / "b"), binary=True)
+    for p in paths:
+        lst.add(p)
+    lst.close()
+    lst = PartitionedList.open(str(tmp_path / "b"))
+    assert lst.is_sorted()
+    assert list(lst.sorted_items()) == sorted(paths)
@@ -0,0 +1,46 @@
+import gzip, os, subprocess, sys
+from conftest import Root, script_env
+from part import PartitionedList, part
+from partitioner import StreamingPartitioner
+
+NPARTS = 5
+Paths = ["/store/data/run%d/file_%d.root" % (i % 7, i) for i in range(500)] + ["/store/unicode/fé"]
+
+def write_input(path):
+    # trailing blanks and empty lines must not affect the partition assignment
+    with open(path, "w") as f:
+        for i, p in enumerate(Paths):
+            f.write(p + (" \n" if i % 3 == 0 else "\n"))
+            if i % 50 == 0:
+                f.write("\n")
+
+def expected_parts():
+    parts = [[] for _ in range(NPARTS)]
+    for p in Paths:
+        parts[part(NPARTS, p)].append(p)
+    return parts
+
+def read_part(path):
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def test_partitioned_list_key(tmp_path):
+    lst = PartitionedList.create(NPARTS, str(tmp_path / "pl"))
+    for p in Paths:
+        lst.add(p + "\n")
+    lst.close()
+    assert [read_part(fn) for fn in lst.FileNames] == expected_parts()
+
+def test_split_script(tmp_path):
+    input_file = str(tmp_path / "in.list")
+    write_input(input_file)
+    out = subprocess.run([sys.executable, os.path.join(Root, "cmp3", "split.py"), input_file, str(NPARTS)],
+        env=script_env(), check=True, capture_output=True)
+    assert out.stdout == b""
+    assert [read_part("%s.%03d" % (input_file, i)) for i in range(NPARTS)] == expected_parts()
+
+def test_spill(tmp_path):
+    input_file = str(tmp_path / "in.list")
+    write_input(input_file)
+    names = StreamingPartitioner(NPARTS).spill(input_file, str(tmp_path), "spill")
+    assert [list(StreamingPartitioner.read_part(fn)) for fn in names] == expected_parts()
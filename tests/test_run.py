@@ -0,0 +1,53 @@
+import json, os, subprocess, sys
+from conftest import Root, script_env
+from catalog import Catalog
+from run import RunHistory
+
+RSE = "T2_XX_Test"
+
+def write_stats(dir_path, run, status):
+    with open("%s/%s_%s_stats.json" % (dir_path, RSE, run), "w") as f:
+        json.dump({"rse": RSE, "run": run, "cmp3": {"status": status}}, f)
+
+def test_run_completed_after_catalog_sync(tmp_path):
+    d = str(tmp_path)
+    write_stats(d, "2024_01_01_00_00", "done")
+    write_stats(d, "2024_01_02_00_00", "started")
+    Catalog(d).sync()
+    write_stats(d, "2024_01_02_00_00", "done")          # completed after the sync
+    history = RunHistory(d, RSE)
+    assert history.CompleteIds == {"2024_01_01_00_00"}
+    assert [run.Run for run in history.runs(complete_only=True)] == ["2024_01_01_00_00", "2024_01_02_00_00"]
+    assert history.last(complete_only=True).Run == "2024_01_02_00_00"
+
+def write_list(dir_path, run, typ, paths):
+    with open("%s/%s_%s_%s.list" % (dir_path, RSE, run, typ), "w") as f:
+        f.write("".join(p + "\n" for p in paths))
+
+def test_current_run_not_in_catalog(tmp_path):
+    # the drivers run diffs.py and rollup.py for a run which may not be in the catalog yet
+    d = str(tmp_path)
+    prev, last = "2024_01_01_00_00", "2024_01_02_00_00"
+    write_stats(d, prev, "done")
+    write_list(d, prev, "D", ["/store/a/d1", "/store/a/d2"])
+    write_list(d, prev, "M", ["/store/b/m1"])
+    Catalog(d).sync()
+    write_stats(d, last, "done")
+    write_list(d, last, "D", ["/store/a/d2", "/store/a/d3"])
+    write_list(d, last, "M", [])
+
+    history = RunHistory(d, RSE)
+    run = history.run(last)
+    assert run is not None and run.previous_run().Run == prev
+    assert history.last().Run == last
+    assert history.run("2024_01_03_00_00") is None
+
+    for script in ("diffs.py", "rollup.py"):
+        subprocess.run([sys.executable, os.path.join(Root, "cmp3", script), "-u", d, RSE, last],
+            env=script_env(), check=True, stdout=subprocess.DEVNULL)
+    with open("%s/%s_%s_stats.json" % (d, RSE, last)) as f:
+        stats = json.load(f)
+    assert stats["diffs"]["prev_run"] == prev
+    assert (stats["diffs"]["dark_old"], stats["diffs"]["dark_new"], stats["diffs"]["dark_resolved"]) == (1, 1, 1)
+    assert stats["diffs"]["missing_resolved"] == 1
+    assert stats["rollup"]["status"] == "done"
@@ -0,0 +1,28 @@
+import json, os, subprocess, sys
+from concurrent.futures import ThreadPoolExecutor
+from conftest import Root, script_env
+
+def batch(stats_file, text):
+    return subprocess.run([sys.executable, os.path.join(Root, "cmp3", "stats.py"), "-b", stats_file],
+        input=text, env=script_env(), capture_output=True, text=True)
+
+def test_batch_empty_key_needs_object(tmp_path):
+    stats_file = str(tmp_path / "stats.json")
+    out = batch(stats_file, "set / 5\n")
+    assert out.returncode != 0
+    assert "Empty key" in out.stderr
+    assert not os.path.exists(stats_file)
+
+def test_batch_concurrent_writers(tmp_path):
+    stats_file = str(tmp_path / "stats.json")
+    with open(stats_file, "w") as f:
+        json.dump({"scanner": {"status": "started"}}, f)
+    writers = 8
+    with ThreadPoolExecutor(writers) as pool:
+        results = list(pool.map(lambda i: batch(stats_file, "set scanner/w%d %d\nupdate {\"top%d\": true}\n" % (i, i, i)),
+            range(writers)))
+    assert all(r.returncode == 0 for r in results), [r.stderr for r in results]
+    with open(stats_file) as f:
+        data = json.load(f)
+    assert data["scanner"] == dict({"status": "started"}, **{"w%d" % (i,): i for i in range(writers)})
+    assert all(data["top%d" % (i,)] for i in range(writers))